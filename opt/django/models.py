@@ -4,7 +4,7 @@ Example Django models.py file
 
 from django.db import models
 from django.core.validators import ValidationError
-from pypassage import Passage, InvalidPassageException
+from pypassage import Passage, InvalidPassageException, TextFetchError
 from pypassage.bibledata import book_names
 from django.conf import settings
 
@@ -82,7 +82,11 @@ class BiblePassage(models.Model):
                     self.build_object()
                 except InvalidPassageException as e:
                     return "Invalid passage"
-        (text, self.truncated) = self.p.text(**kwargs)
+        try:
+            (text, self.truncated) = self.p.text(**kwargs)
+        except TextFetchError:
+            self.truncated = False
+            return "Could not fetch passage text"
         return text
 
     def was_truncated(self):
@@ -2,6 +2,15 @@ from .reference import Passage
 from .reference import PassageCollection
 from .reference import PassageDelta
 from .reference import InvalidPassageException
+from .bibledata.transport import TextFetchError
 from .reference import book_total_verses
 from .reference import get_passage_text
 from .reference import passages_from_string
+from .reference import passage_from_ordinals
+from .reference import render_many
+from .reference import clear_reference_cache
+from .index import PassageIndex
+from .verseset import VerseSet
+from .coverage import Coverage
+from .columnar import PassageArray
+from .styles import ReferenceStyle
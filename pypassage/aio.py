@@ -0,0 +1,163 @@
+"""
+asyncio versions of the passage text functions, for use within an event loop.
+Requires Python 3.7 or later; this module is not imported by pypassage itself,
+but is used by Passage.atext and PassageCollection.atext.
+
+For example:
+>>> (text, truncated) = await Passage('Jn',3,16).atext(api_key="XXXX")
+
+HTTP requests are made in the event loop's executor (or the given
+'executor'), so the event loop is never blocked. Text is cached in the same
+cache as the synchronous functions, and concurrent requests for the same text
+(with the same API key and transport) share a single HTTP request: if a
+hundred coroutines await the text of John 3 at once, the API is only asked
+for it once.
+
+As with the synchronous functions, 'timeout' or 'deadline' arguments limit how
+long to wait for text. Coroutines sharing a request also share the deadline
+and priority of the first of them. Requests wait for the transport's rate
+limiter (see bibledata.rate_limit) in an executor thread, like any other part
+of the request; the acquire coroutine waits for a RateLimiter in the event
+loop instead, for other asyncio code.
+"""
+import asyncio
+import time
+import weakref
+
+from .bibledata.rate_limit import INTERACTIVE
+from .bibledata.transport import FetchTimeoutError, deadline_after
+from .reference import TextResult, join_texts, with_deadline
+
+# Requests in progress, as {key: future} for each event loop, where key is the
+# request's negative_key and its transport
+_in_flight = weakref.WeakKeyDictionary()
+
+
+async def get_passage_text(passage, api_key="", html=False, options={},
+                           cache=None, api_url=None, raise_errors=True,
+                           executor=None, transport=None,
+                           negative_cache=None, timeout=None, deadline=None,
+                           priority=INTERACTIVE):
+    """
+    Coroutine returning tuple of (passage_text, truncated) for a Passage;
+    as for the get_passage_text function of the passage's bibledata module.
+    'cache' and 'negative_cache' default to the module's default_cache and
+    default_negative_cache. 'executor' is the concurrent.futures executor to
+    make HTTP requests in; defaults to the event loop's default executor.
+    """
+    deadline = deadline_after(timeout, deadline)
+    bd = passage.bd
+    if cache is None:
+        cache = bd.default_cache
+    if negative_cache is None:
+        negative_cache = bd.default_negative_cache
+    (url, param_string, trun_pass, truncated) = bd.passage_request(
+        passage, html, options, api_url)
+    cached = cache.get(param_string, None)
+    if cached is not None:
+        return (cached[2], truncated)
+
+    def fetch():
+        return asyncio.get_running_loop().run_in_executor(
+            executor, bd.fetch_passage_text, url, param_string, api_key,
+            transport, negative_cache, deadline, priority)
+
+    try:
+        text = await single_flight(
+            bd.negative_key(url, param_string, api_key) + (transport,),
+            deadline, fetch)
+    except IOError as e:
+        stale = bd.stale_text(cache, param_string, e)
+        if stale is not None:
+            return (stale, truncated)
+        if raise_errors:
+            raise
+        return (bd.FETCH_ERROR_TEXT, truncated)
+    cache[param_string] = (trun_pass.book_n, len(trun_pass), text)
+    return (text, truncated)
+
+
+async def single_flight(key, deadline, function):
+    """
+    Coroutine returning the result of awaiting function(). While a call for
+    'key' is in progress, further calls for the same key wait for its result
+    (or exception) rather than calling the function again. Raises
+    FetchTimeoutError if the result isn't ready by 'deadline' (or None).
+    """
+    loop = asyncio.get_running_loop()
+    flights = _in_flight.setdefault(loop, {})
+    future = flights.get(key)
+    if future is None:
+        future = flights[key] = asyncio.ensure_future(function())
+
+        def done(f):
+            flights.pop(key, None)
+            if not f.cancelled():
+                # Retrieved, in case every caller stopped waiting for it
+                f.exception()
+
+        future.add_done_callback(done)
+    # Shielded, so that a cancelled caller doesn't cancel the shared request
+    if deadline is None:
+        return await asyncio.shield(future)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future),
+                                      max(0, deadline - time.time()))
+    except asyncio.TimeoutError:
+        raise FetchTimeoutError("Timed out fetching " + key[0])
+
+
+async def acquire(rate_limiter, url, priority=INTERACTIVE, deadline=None,
+                  account=None):
+    """
+    Coroutine version of RateLimiter.acquire, waiting in the event loop
+    rather than blocking it.
+    """
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    ticket = rate_limiter.join(url, priority, deadline,
+                               lambda: loop.call_soon_threadsafe(event.set),
+                               account)
+    try:
+        while True:
+            delay = rate_limiter.dispatch(ticket)
+            if delay is None:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            event.clear()
+    except BaseException:
+        rate_limiter.leave(ticket)
+        raise
+
+
+async def fetch_text(passage, kwargs):
+    """ Coroutine returning TextResult for a passage; see fetch_text """
+    try:
+        (text, truncated) = await get_passage_text(
+            passage, **dict(kwargs, raise_errors=True))
+        return TextResult(passage, text, truncated, None)
+    except (IOError, ValueError, KeyError) as e:
+        # Network and HTTP errors, or an invalid response
+        return TextResult(passage, None, None, e)
+
+
+async def collection_texts(passages, **kwargs):
+    """
+    Coroutine returning list of TextResult tuples for a sequence of passages,
+    fetched concurrently; see PassageCollection.texts.
+    """
+    kwargs = with_deadline(kwargs)
+    return list(await asyncio.gather(*[fetch_text(p, kwargs)
+                                       for p in passages]))
+
+
+async def collection_text(passages, raise_errors=True, **kwargs):
+    """
+    Coroutine returning tuple of (text, truncated) for a sequence of passages;
+    see PassageCollection.text.
+    """
+    return join_texts(await collection_texts(passages, **kwargs),
+                      raise_errors)
@@ -1,3 +1,4 @@
 from .common import book_names, book_numbers
 from . import esv
 from . import osis
+from . import usfm
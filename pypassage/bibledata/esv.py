@@ -7,6 +7,8 @@ book_names      | book number            | tuples of corresponding (three letter
 book_numbers    | book name              | corresponding book number
 number_chapters | book number            | number of chapters in that book
 last_verses     | (book number, chapter) | last verse of that chapter
+chapter_index   | (book number, chapter) | position of chapter in chapter_list and chapter_start_ordinals
+book_start_ordinals | book number        | ordinal of the first verse in that book
 ---------------------------------------------------------------------------
 
 In addition, the get_passage_text function is provided to look up passage text for a given passage.
@@ -158,28 +160,78 @@ for b, vv in enumerate(last_verse_data):
             len(missing_verses.get((book, chapter), []))
     number_verses_in_book[book] = total_verses
 
+# Creating cumulative verse counts, used to convert between references and
+# 'verse ordinals': the position of a verse within the whole bible, counting
+# from 0 (Gen 1:1) and skipping missing verses.
+# chapter_list holds (book, chapter) tuples in canonical order;
+# chapter_start_ordinals holds the ordinal of the first verse of each of those
+# chapters; chapter_index is keyed to (book, chapter) and returns the position
+# of that chapter in both lists; and book_start_ordinals is keyed to book
+# number and returns the ordinal of the first verse of that book.
+chapter_list = []
+chapter_start_ordinals = []
+chapter_index = {}
+book_start_ordinals = {}
+ordinal = 0
+for book in range(1, len(last_verse_data)+1):
+    book_start_ordinals[book] = ordinal
+    for chapter in range(1, number_chapters[book]+1):
+        chapter_index[book, chapter] = len(chapter_list)
+        chapter_list.append((book, chapter))
+        chapter_start_ordinals.append(ordinal)
+        ordinal += last_verses[book, chapter] - \
+            len(missing_verses.get((book, chapter), []))
+number_verses_in_bible = ordinal
+
+# Optional per-verse word and character counts (a text_size.TextSizeTable);
+# none are distributed with pypassage.
+size_table = None
+
 try:
     from urllib.parse import urlencode
-    from urllib.request import urlopen, Request
 except ImportError:  # Python 2
     from urllib import urlencode
-    from urllib2 import urlopen, Request
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
-from .text_cache import SimpleCache
+from .text_cache import SimpleCache, NegativeCache
+from .rate_limit import RateLimiter, RateLimitedTransport, INTERACTIVE
+from .transport import HTTPTransport, RetryTransport, CircuitBreakerTransport
+from .transport import TextFetchError, CircuitOpenError, InvalidResponseError
+from .transport import FetchTimeoutError, deadline_after
 
 API_TOTAL_PROPORTION_OF_BOOK = 0.5
 API_CONSECUTIVE_VERSES = 500
+API_BATCH_PASSAGES = 50
+SPLIT_WORKERS = 4
 CACHE_TOTAL_PROPORTION_OF_BOOK = 0.5
 CACHE_CONSECUTIVE_VERSES = 500
+NEGATIVE_CACHE_SECONDS = 10
+# Requests per minute, hour and day; as per https://api.esv.org/v3/docs/
+API_RATE_LIMITS = ((60, 60), (1000, 3600), (5000, 86400))
+# Longest in seconds a request waits for the rate limiter, without a deadline
+RATE_LIMIT_MAX_WAIT = 60
+API_URL = "https://api.esv.org/v3/passage/"
+FETCH_ERROR_TEXT = "Error: Could not fetch passage text!"
+# Text between passages, as the API separates passages in a response
+PASSAGE_SEPARATOR = "\n\n"
 
 book_limits = dict([(k, v*CACHE_TOTAL_PROPORTION_OF_BOOK)
                     for (k, v) in number_verses_in_book.items()])
 default_cache = SimpleCache(CACHE_CONSECUTIVE_VERSES, book_limits)
+default_negative_cache = NegativeCache(NEGATIVE_CACHE_SECONDS)
+default_rate_limiter = RateLimiter(API_RATE_LIMITS, RATE_LIMIT_MAX_WAIT)
+default_transport = CircuitBreakerTransport(RetryTransport(
+    RateLimitedTransport(HTTPTransport(), default_rate_limiter)))
 
 
 def get_passage_text(passage, api_key="", html=False, options={},
-                     cache=default_cache):
+                     cache=default_cache, api_url=None, raise_errors=True,
+                     split=False, workers=SPLIT_WORKERS, transport=None,
+                     negative_cache=default_negative_cache, timeout=None,
+                     deadline=None, priority=INTERACTIVE):
     """
     Fetch biblical text (in ESV translation) corresponding to the provided
     Passage object. Returns tuple of (passage_text, truncated), where
@@ -197,7 +249,343 @@ def get_passage_text(passage, api_key="", html=False, options={},
         html format or plain-text format
     'cache' is a dictionary-like object or function that stores tuples of
         (book_n, passage_length, passage_text) keyed to params string.
+    'api_url' is the base URL of the API; defaults to API_URL.
+    'raise_errors' is a boolean indicating whether errors fetching the text
+        should be raised (as TextFetchError; see transport.py). If False,
+        FETCH_ERROR_TEXT is returned as the text instead.
+    'split' is a boolean indicating whether passages longer than
+        API_CONSECUTIVE_VERSES should be fetched in several parts (using up
+        to 'workers' threads at once) rather than truncated. The passage is
+        still truncated to API_TOTAL_PROPORTION_OF_BOOK.
+    'transport' is the HTTP transport to use (see transport.py); defaults to
+        default_transport, which retries failed requests and fails fast while
+        the API is down.
+    'negative_cache' is a text_cache.NegativeCache recording recent failures,
+        so that a request that has just failed fails again without waiting on
+        the network; or None.
+    'timeout' is the number of seconds to wait for the text, and 'deadline'
+        the time (as from time.time()) by which it must be fetched. If either
+        passes, FetchTimeoutError is raised; unless the cache has expired
+        (stale) text for the passage (see SimpleCache's 'max_age'), which is
+        returned instead.
+    'priority' orders requests waiting for a rate limit (lower first); e.g.
+        rate_limit.BACKGROUND for prefetching, so as not to delay INTERACTIVE
+        requests. The default transport keeps requests within the API's
+        quotas with default_rate_limiter; see rate_limit.py.
+    """
+    deadline = deadline_after(timeout, deadline)
+    if split:
+        trun_pass = api_truncate(passage, split=True)
+        if len(trun_pass) > API_CONSECUTIVE_VERSES:
+            return _get_split_text(passage, trun_pass, api_key, html, options,
+                                   cache, api_url, raise_errors, workers,
+                                   transport, negative_cache, deadline,
+                                   priority)
+    (url, param_string, trun_pass, truncated) = passage_request(
+        passage, html, options, api_url)
+    # Check cache
+    cached = cache.get(param_string, None)
+    if cached is not None:
+        return (cached[2], truncated)
+    # Get text from ESV webservice
+    try:
+        text = fetch_passage_text(url, param_string, api_key, transport,
+                                  negative_cache, deadline, priority)
+        cache[param_string] = (trun_pass.book_n, len(trun_pass), text)
+        return (text, truncated)
+    except IOError as e:
+        stale = stale_text(cache, param_string, e)
+        if stale is not None:
+            return (stale, truncated)
+        if raise_errors:
+            raise
+        return (FETCH_ERROR_TEXT, truncated)
+
+
+def passage_request(passage, html=False, options={}, api_url=None):
+    """
+    Return tuple of (url, param_string, truncated_passage, truncated) for an
+    API request for the text of 'passage'. 'param_string' is also the cache
+    key for the request. Arguments are as for get_passage_text.
+    """
+    (url, params) = _request_params(html, options, api_url)
+    # Truncate passage to API limits, as necessary
+    trun_pass = api_truncate(passage)
+    if trun_pass is passage:
+        truncated = False
+    else:
+        truncated = True
+    # Add in passage reference
+    params["q"] = str(trun_pass)
+    # Construct parameters string from sorted variables
+    param_string = urlencode(list(params.items()))
+    return (url, param_string, trun_pass, truncated)
+
+
+def api_truncate(passage, split=False):
+    """
+    Return 'passage' truncated to API limits (or 'passage' itself if within
+    them), as for get_passage_text with the given 'split' argument.
+    """
+    if split:
+        return passage.truncate(
+            proportion_of_book=API_TOTAL_PROPORTION_OF_BOOK)
+    return passage.truncate(API_CONSECUTIVE_VERSES,
+                            API_TOTAL_PROPORTION_OF_BOOK)
+
+
+def cached_text(passage, html=False, options={}, cache=default_cache,
+                api_url=None, **kwargs):
+    """
+    Return text of 'passage' from the cache (as get_passage_text would give
+    it), or None if not cached. Other get_passage_text arguments are ignored.
+    """
+    cached = cache.get(passage_request(passage, html, options, api_url)[1],
+                       None)
+    if cached is not None:
+        return cached[2]
+    return None
+
+
+def fetch_passage_text(url, param_string, api_key="", transport=None,
+                       negative_cache=None, deadline=None,
+                       priority=INTERACTIVE):
     """
+    Fetch text from the ESV webservice for a request made by passage_request,
+    without using the (positive) cache. Raises TextFetchError for network,
+    HTTP and response errors, and FetchTimeoutError if 'deadline' passes. If
+    'negative_cache' is given, failures are recorded in it, and a recent
+    failure of the same request is raised again without making the request.
+    'priority' is passed to the transport; see get_passage_text.
+    """
+    return PASSAGE_SEPARATOR.join(fetch_passages_text(
+        url, param_string, api_key, transport, negative_cache, deadline,
+        priority))
+
+
+def get_passages_text(passages, api_key="", html=False, options={},
+                      cache=default_cache, api_url=None, raise_errors=True,
+                      split=False, transport=None,
+                      negative_cache=default_negative_cache, timeout=None,
+                      deadline=None, priority=INTERACTIVE):
+    """
+    Fetch the text of several Passage objects with a single API request,
+    returning a list of (passage_text, truncated) tuples in the same order.
+    Each passage's text is cached as if fetched with get_passage_text.
+    Arguments are as for get_passage_text; 'passages' should fit within the
+    API limits when requested together (see batch_passages).
+    Raises InvalidResponseError if the API doesn't return one text per
+    passage.
+    If 'split' is True, passages too long for a single request are fetched
+    separately, in parts; see get_passage_text.
+    """
+    deadline = deadline_after(timeout, deadline)
+    if split:
+        long_passages = [_is_long(p) for p in passages]
+        if any(long_passages):
+            results = iter(get_passages_text(
+                [p for (p, l) in zip(passages, long_passages) if not l],
+                api_key, html, options, cache, api_url, raise_errors,
+                transport=transport, negative_cache=negative_cache,
+                deadline=deadline, priority=priority))
+            return [get_passage_text(p, api_key, html, options, cache,
+                                     api_url, raise_errors, split=True,
+                                     transport=transport,
+                                     negative_cache=negative_cache,
+                                     deadline=deadline,
+                                     priority=priority)
+                    if l else next(results)
+                    for (p, l) in zip(passages, long_passages)]
+    requests = [passage_request(p, html, options, api_url) for p in passages]
+    texts = {}
+    refs = []
+    for (url, param_string, trun_pass, truncated) in requests:
+        cached = cache.get(param_string, None)
+        if cached is not None:
+            texts[param_string] = cached[2]
+        elif param_string not in texts:
+            texts[param_string] = None
+            refs.append((param_string, trun_pass))
+    if refs:
+        (url, params) = _request_params(html, options, api_url)
+        params["q"] = ";".join([str(p) for (k, p) in refs])
+        try:
+            passages_text = fetch_passages_text(
+                url, urlencode(list(params.items())), api_key, transport,
+                negative_cache, deadline, priority)
+            if len(passages_text) != len(refs):
+                raise InvalidResponseError(
+                    "Expected " + str(len(refs)) + " passages from API, " +
+                    "but got " + str(len(passages_text)))
+        except IOError as e:
+            passages_text = [stale_text(cache, k, e) for (k, p) in refs]
+            if None in passages_text:
+                if raise_errors:
+                    raise
+                passages_text = [FETCH_ERROR_TEXT] * len(refs)
+        else:
+            for ((param_string, trun_pass), text) in zip(refs, passages_text):
+                cache[param_string] = (trun_pass.book_n, len(trun_pass), text)
+        for ((param_string, trun_pass), text) in zip(refs, passages_text):
+            texts[param_string] = text
+    return [(texts[r[1]], r[3]) for r in requests]
+
+
+def batch_passages(passages, api_key="", html=False, options={},
+                   cache=default_cache, api_url=None, raise_errors=True,
+                   split=False, transport=None, negative_cache=None,
+                   timeout=None, deadline=None, priority=INTERACTIVE):
+    """
+    Split a list of Passage objects into groups that can be fetched together
+    with get_passages_text, while keeping each request within
+    API_CONSECUTIVE_VERSES verses, API_TOTAL_PROPORTION_OF_BOOK of any book
+    and API_BATCH_PASSAGES passages. Passages that overlap or adjoin another
+    passage in a group are put in a different group, as the API would merge
+    them. Returns list of lists of indices into 'passages', in order.
+    Arguments are as for get_passages_text; if 'split' is True, passages too
+    long for a single request are each given a group of their own.
+    """
+    batches = []
+    indices = []
+    verses = 0
+    book_verses = defaultdict(int)
+    ranges = []
+    for (i, passage) in enumerate(passages):
+        (url, param_string, trun_pass, truncated) = passage_request(
+            passage, html, options, api_url)
+        if split and _is_long(passage):
+            if indices:
+                batches.append(indices)
+            batches.append([i])
+            (indices, verses, ranges) = ([], 0, [])
+            book_verses.clear()
+            continue
+        elif cache.get(param_string, None) is not None:
+            # Cached passages need no part of a request
+            (length, per_book, r) = (0, {}, None)
+        else:
+            length = len(trun_pass)
+            per_book = trun_pass.number_verses(per_book=True)
+            r = trun_pass.ordinal_range()
+        fits = indices and len(indices) < API_BATCH_PASSAGES and \
+            verses + length <= API_CONSECUTIVE_VERSES and \
+            all([book_verses[b] + n <= API_TOTAL_PROPORTION_OF_BOOK *
+                 number_verses_in_book[b] for (b, n) in per_book.items()])
+        if fits and r is not None:
+            fits = not any([s <= r[1] + 1 and r[0] <= e + 1
+                            for (s, e) in ranges])
+        if indices and not fits:
+            batches.append(indices)
+            (indices, verses, ranges) = ([], 0, [])
+            book_verses.clear()
+        indices.append(i)
+        verses += length
+        for (b, n) in per_book.items():
+            book_verses[b] += n
+        if r is not None:
+            ranges.append(r)
+    if indices:
+        batches.append(indices)
+    return batches
+
+
+def fetch_passages_text(url, param_string, api_key="", transport=None,
+                        negative_cache=None, deadline=None,
+                        priority=INTERACTIVE):
+    """
+    As for fetch_passage_text, but returning the list of passage texts from
+    the response; one for each reference in the request.
+    """
+    key = url+"?"+param_string
+    if negative_cache is not None:
+        error = negative_cache.get(negative_key(url, param_string, api_key))
+        if error is not None:
+            raise error
+    try:
+        response = (transport or default_transport).get(
+            key, {"Authorization": "Token "+api_key}, deadline, priority)
+        try:
+            passages = json.loads(response.body.decode("utf-8"))["passages"]
+        except (ValueError, KeyError, TypeError) as e:
+            raise InvalidResponseError("Invalid response from API: " +
+                                       repr(e))
+        if not isinstance(passages, list):
+            raise InvalidResponseError("Invalid response from API: " +
+                                       "passages is not a list")
+    except CircuitOpenError:
+        # Already failing fast
+        raise
+    except TextFetchError as e:
+        # Missing the caller's deadline isn't necessarily a failure of the API
+        if negative_cache is not None and not (
+                deadline is not None and isinstance(e, FetchTimeoutError)):
+            negative_cache[negative_key(url, param_string, api_key)] = e
+        raise
+    return passages
+
+
+def negative_key(url, param_string, api_key=""):
+    """
+    Return the negative cache key for a request. It includes (a hash of) the
+    API key, as errors such as 401 responses depend on it.
+    """
+    return (url+"?"+param_string,
+            hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+
+
+def stale_text(cache, key, error):
+    """
+    Return expired text cached against 'key', if 'error' is a timeout and the
+    cache keeps expired text; otherwise None.
+    """
+    get_stale = getattr(cache, "get_stale", None)
+    if not isinstance(error, FetchTimeoutError) or get_stale is None:
+        return None
+    stale = get_stale(key)
+    if stale is None:
+        return None
+    return stale[2]
+
+
+# === Internal functions ===
+def _is_long(passage):
+    """
+    Return True if 'passage' needs more than one request when fetched with
+    split=True.
+    """
+    return len(passage) > API_CONSECUTIVE_VERSES and \
+        len(api_truncate(passage, split=True)) > API_CONSECUTIVE_VERSES
+
+
+def _get_split_text(passage, trun_pass, api_key, html, options, cache,
+                    api_url, raise_errors, workers, transport,
+                    negative_cache, deadline, priority):
+    """
+    Fetch text of 'trun_pass' (a passage within API_TOTAL_PROPORTION_OF_BOOK)
+    in parts of at most API_CONSECUTIVE_VERSES verses, concurrently, and
+    join it together with PASSAGE_SEPARATOR. Each part is cached separately.
+    """
+    parts = list(trun_pass.chunks(API_CONSECUTIVE_VERSES, align="chapter"))
+
+    def fetch(part):
+        return get_passage_text(part, api_key, html, options, cache, api_url,
+                                raise_errors=True, transport=transport,
+                                negative_cache=negative_cache,
+                                deadline=deadline, priority=priority)[0]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(parts)))) \
+                as pool:
+            text = PASSAGE_SEPARATOR.join(pool.map(fetch, parts))
+    except IOError:
+        if raise_errors:
+            raise
+        text = FETCH_ERROR_TEXT
+    return (text, trun_pass is not passage)
+
+
+def _request_params(html=False, options={}, api_url=None):
+    """ Return tuple of (url, params) for an API request, without 'q' """
     # Set default parameters
     params = {
         "include-headings": "false",
@@ -206,7 +594,7 @@ def get_passage_text(passage, api_key="", html=False, options={},
         "include-passage-references": "false",
         "include-short-copyright": "false"
     }
-    url = "https://api.esv.org/v3/passage/html/"
+    url = (api_url or API_URL) + "html/"
     # If we're just wanting plain-text:
     if not html:
         params.update({
@@ -216,30 +604,7 @@ def get_passage_text(passage, api_key="", html=False, options={},
             "include-heading-horizontal-lines": "false",
             "line-length": 0,
         })
-        url = "https://api.esv.org/v3/passage/text/"
+        url = (api_url or API_URL) + "text/"
     # Add in user-defined variables (possibly overwriting defaults)
     params.update(options)
-    # Truncate passage to API limits, as necessary
-    trun_pass = passage.truncate(API_CONSECUTIVE_VERSES,
-                                 API_TOTAL_PROPORTION_OF_BOOK)
-    if trun_pass is passage:
-        truncated = False
-    else:
-        truncated = True
-    # Add in passage reference
-    params["q"] = str(trun_pass)
-    # Construct parameters string from sorted variables
-    param_string = urlencode(list(params.items()))
-    # Check cache
-    if cache.get(param_string, None) != None:
-        return (cache[param_string][2], truncated)
-    # Get text from ESV webservice
-    try:
-        q = Request(url+"?"+param_string)
-        q.add_header("Authorization", "Token "+api_key)
-        response = json.loads(urlopen(q).read())
-        text = "".join(response["passages"])
-        cache[param_string] = (trun_pass.book_n, len(trun_pass), text)
-        return (text, truncated)
-    except IOError:
-        return ("Error: Could not fetch passage text!", truncated)
+    return (url, params)
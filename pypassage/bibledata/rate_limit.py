@@ -0,0 +1,256 @@
+"""
+Client-side rate limiting of requests for passage text.
+
+A RateLimiter keeps requests to each server within quotas of a number of
+requests per period (such as 60 a minute and 1000 an hour), with a token
+bucket for each quota. Quotas are kept separately for each account (API key)
+using a server, as the ESV API counts them. Requests that can't be made
+straight away wait in a queue, in order of priority (lower first) and then of
+arrival, so that INTERACTIVE requests are made before BACKGROUND ones such as
+prefetching. A request fails rather than wait beyond its deadline, or beyond
+the limiter's max_wait.
+
+RateLimitedTransport takes a token for every request made through it. It
+is placed below any RetryTransport or HedgingTransport, so that retries and
+hedged requests count against the quotas too. When a server answers 429 (Too
+Many Requests), the account's buckets are emptied, and no more requests are
+let through until any Retry-After time has passed. The account of a request
+is its Authorization header. By default, ESV requests
+are limited to the API's quotas; see esv.default_rate_limiter.
+
+Threads wait with RateLimiter.acquire, and coroutines with the aio module's
+acquire coroutine; both share the same queues and quotas.
+"""
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+from .transport import FetchTimeoutError, HTTPStatusError, retry_after
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class RateLimiter(object):
+    """
+    Token-bucket rate limiter with a priority queue of waiting requests for
+    each server and account.
+    """
+
+    def __init__(self, limits=(), max_wait=None):
+        """
+        'limits' is a sequence of (requests, seconds) tuples; e.g.
+        ((60, 60), (1000, 3600)) for at most 60 requests a minute and 1000 an
+        hour. Each quota may be used in a single burst. 'max_wait' is the
+        longest in seconds a request may wait, where it has no earlier
+        deadline; by default, requests without a deadline wait as long as
+        the quotas need.
+        """
+        self.limits = tuple(limits)
+        self.max_wait = max_wait
+        # Lists of [tokens, time_updated] for each limit, keyed to server and
+        # account
+        self.buckets = {}
+        # Heaps of (priority, order, ticket) keyed to server and account
+        self.queues = {}
+        # Times until which no requests are made, keyed to server and account
+        self.paused = {}
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+        # Metrics
+        self.granted = 0
+        self.total_wait = 0.0
+        self.longest_wait = 0.0
+        self.max_depth = 0
+
+    def acquire(self, url, priority=INTERACTIVE, deadline=None,
+                account=None):
+        """
+        Wait until a request for 'url' may be made, and count it against the
+        quotas of 'account' (such as an API key) for its server. Raises
+        FetchTimeoutError if it couldn't be made by 'deadline' (a time.time()
+        value), or within max_wait.
+        """
+        event = threading.Event()
+        ticket = self.join(url, priority, deadline, event.set, account)
+        try:
+            while True:
+                delay = self.dispatch(ticket)
+                if delay is None:
+                    return
+                event.wait(delay)
+                event.clear()
+        except BaseException:
+            self.leave(ticket)
+            raise
+
+    def join(self, url, priority=INTERACTIVE, deadline=None, wake=None,
+             account=None):
+        """
+        Queue a request for 'url', returning a Ticket for it. 'wake' is
+        called (from any thread) when the request is granted by another
+        caller's dispatch.
+        """
+        if self.max_wait is not None:
+            latest = time.time() + self.max_wait
+            deadline = latest if deadline is None else min(deadline, latest)
+        ticket = Ticket(_key(url, account), url, deadline, wake)
+        with self.lock:
+            queue = self.queues.setdefault(ticket.key, [])
+            heapq.heappush(queue, (priority, next(self.order), ticket))
+            self.max_depth = max(self.max_depth, self.depth(locked=True))
+        return ticket
+
+    def dispatch(self, ticket):
+        """
+        Grant queued requests for the server and account of 'ticket' as
+        quotas allow.
+        Returns None if 'ticket' has been granted; otherwise the number of
+        seconds to wait before calling dispatch again. Raises
+        FetchTimeoutError if the ticket can't be granted by its deadline.
+        """
+        with self.lock:
+            queue = self.queues[ticket.key]
+            delay = 0
+            while queue:
+                delay = self._delay(ticket.key)
+                if delay > 0:
+                    break
+                granted = heapq.heappop(queue)[2]
+                self._take(granted)
+                if granted is not ticket and granted.wake is not None:
+                    granted.wake()
+            if ticket.granted:
+                return None
+        if ticket.deadline is not None and \
+                time.time() + delay > ticket.deadline:
+            raise FetchTimeoutError("Rate limit would delay request beyond " +
+                                    "deadline: " + ticket.url)
+        return delay
+
+    def pause(self, url, seconds=None, account=None):
+        """
+        Use up the quotas of 'account' for the server of 'url', as after a 429
+        response, and make no requests for it for 'seconds' (if given).
+        """
+        key = _key(url, account)
+        with self.lock:
+            self._delay(key)
+            for bucket in self.buckets[key]:
+                bucket[0] = min(bucket[0], 0.0)
+            if seconds is not None:
+                self.paused[key] = max(self.paused.get(key, 0),
+                                       time.time() + seconds)
+
+    def leave(self, ticket):
+        """ Remove 'ticket' from its queue, if it hasn't been granted """
+        with self.lock:
+            queue = self.queues.get(ticket.key, [])
+            entries = [e for e in queue if e[2] is not ticket]
+            if len(entries) != len(queue):
+                heapq.heapify(entries)
+                self.queues[ticket.key] = entries
+
+    def depth(self, priority=None, locked=False):
+        """
+        Return number of requests waiting, or only those of the given
+        'priority'.
+        """
+        if not locked:
+            with self.lock:
+                return self.depth(priority, True)
+        return sum([len([e for e in queue
+                         if priority is None or e[0] == priority])
+                    for queue in self.queues.values()])
+
+    def stats(self):
+        """
+        Return dict of metrics: the number of requests waiting ("depth") and
+        the most there have been ("max_depth"), the number of requests made
+        ("granted"), and their mean and longest wait in seconds ("mean_wait"
+        and "max_wait").
+        """
+        with self.lock:
+            return {
+                "depth": self.depth(locked=True),
+                "max_depth": self.max_depth,
+                "granted": self.granted,
+                "mean_wait": self.total_wait / self.granted if self.granted
+                else 0.0,
+                "max_wait": self.longest_wait,
+            }
+
+    def _delay(self, key):
+        """ Refill buckets for 'key'; return seconds until a token is free """
+        now = time.time()
+        buckets = self.buckets.get(key)
+        if buckets is None:
+            buckets = self.buckets[key] = [[float(n), now]
+                                           for (n, s) in self.limits]
+        delay = max(0, self.paused.get(key, 0) - now)
+        for ((n, seconds), bucket) in zip(self.limits, buckets):
+            bucket[0] = min(n, bucket[0] + (now - bucket[1]) * n / seconds)
+            bucket[1] = now
+            if bucket[0] < 1:
+                delay = max(delay, (1 - bucket[0]) * seconds / n)
+        return delay
+
+    def _take(self, ticket):
+        for bucket in self.buckets[ticket.key]:
+            bucket[0] -= 1
+        ticket.granted = True
+        wait = time.time() - ticket.start
+        self.granted += 1
+        self.total_wait += wait
+        self.longest_wait = max(self.longest_wait, wait)
+
+
+class RateLimitedTransport(object):
+    """
+    Transport making requests with another transport once 'rate_limiter' (a
+    RateLimiter) allows them.
+    """
+
+    def __init__(self, transport, rate_limiter):
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+
+    def get(self, url, headers={}, deadline=None, priority=None):
+        """ As for transport.HTTPTransport.get """
+        if priority is None:
+            priority = INTERACTIVE
+        account = headers.get("Authorization")
+        self.rate_limiter.acquire(url, priority, deadline, account)
+        try:
+            return self.transport.get(url, headers, deadline, priority)
+        except HTTPStatusError as e:
+            if e.status == 429:
+                self.rate_limiter.pause(url, retry_after(e), account)
+            raise
+
+
+class Ticket(object):
+    """ A request waiting in a RateLimiter queue """
+
+    def __init__(self, key, url, deadline=None, wake=None):
+        self.key = key
+        self.url = url
+        self.deadline = deadline
+        self.wake = wake
+        self.granted = False
+        self.start = time.time()
+
+
+def _key(url, account=None):
+    """ Key of the quotas for 'url', with 'account' hashed if given """
+    parts = urlsplit(url)
+    if account is not None:
+        account = hashlib.sha256(account.encode("utf-8")).hexdigest()
+    return (parts.scheme, parts.hostname, parts.port, account)
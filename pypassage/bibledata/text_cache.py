@@ -2,6 +2,8 @@
 Class(es) to cache bible passage text
 """
 from collections import defaultdict
+import threading
+import time
 
 
 class SimpleCache:
@@ -10,13 +12,17 @@ class SimpleCache:
     clears oldest items as API limits are violated.
     """
 
-    def __init__(self, consecutive_verse_limit=None, book_specific_limits={}):
+    def __init__(self, consecutive_verse_limit=None, book_specific_limits={},
+                 max_age=None):
         """
         Initialise SimpleCache object
         'consecutive_verse_limit' is an integer representing the maximum
         number of consecutive verses that may be cached anywhere in the bible
         'book_specific_limits' is a dict keyed to book number that returns the
         maximum number of verses that may be cached from specific books
+        'max_age' is the number of seconds after which cached text expires, or
+        None for text that never expires. Expired text is kept (within the
+        limits above) and may still be had from get_stale.
         """
         # User-defined limits
         if consecutive_verse_limit is None:
@@ -29,6 +35,11 @@ class SimpleCache:
         # Actual lengths of verses cached  is self.lengths, a dict of lists
         # containing (length, key) tuples; keyed to book_n.
         self.lengths = defaultdict(lambda: [])
+        self.max_age = max_age
+        # Time each key was cached, for max_age
+        self.times = {}
+        # Texts may be cached from several threads at once
+        self.lock = threading.Lock()
 
     def __setitem__(self, key, value):
         """
@@ -39,13 +50,23 @@ class SimpleCache:
         (book_n, passage_length, passage_text) = value
         if passage_length > self.absolute_limit:
             return None
-        self.lengths[book_n].append((passage_length, key))
-        self.cache[key] = (book_n, passage_length, passage_text)
-        # Check total length and discard oldest if necessary
-        while sum([x[0] for x in self.lengths[book_n]]) >\
-                self.book_limits.get(book_n, 1000):
-            (l, k) = self.lengths[book_n].pop(0)
-            del self.cache[k]
+        with self.lock:
+            if key in self.cache:
+                if not self._expired(key):
+                    # Already cached (e.g. fetched by two threads at once)
+                    return None
+                # Replace expired text
+                old = self.cache.pop(key)
+                self.lengths[old[0]].remove((old[1], key))
+            self.lengths[book_n].append((passage_length, key))
+            self.cache[key] = (book_n, passage_length, passage_text)
+            self.times[key] = time.time()
+            # Check total length and discard oldest if necessary
+            while sum([x[0] for x in self.lengths[book_n]]) >\
+                    self.book_limits.get(book_n, 1000):
+                (l, k) = self.lengths[book_n].pop(0)
+                del self.cache[k]
+                self.times.pop(k, None)
 
     def __getitem__(self, key):
         """
@@ -57,6 +78,73 @@ class SimpleCache:
     def get(self, key, alternative=None):
         """
         Return tuple of (book_n, passage_length, passage_text) if it exists for
-        this 'key'; otherwise return 'alternative'
+        this 'key' and hasn't expired; otherwise return 'alternative'
+        """
+        value = self.cache.get(key)
+        if value is None or self._expired(key):
+            return alternative
+        return value
+
+    def get_stale(self, key, alternative=None):
+        """
+        As for get, but also returning text that has expired
         """
         return self.cache.get(key, alternative)
+
+    def _expired(self, key):
+        return self.max_age is not None and \
+            self.times.get(key, 0) + self.max_age <= time.time()
+
+
+class NegativeCache(object):
+    """
+    Short-lived record of requests that have failed, so that repeating a
+    failed request fails straight away rather than waiting on the network
+    again. Errors are kept for 'ttl' seconds.
+
+    Copies of errors are kept and returned, without the tracebacks of where
+    they were raised, so that raising a cached error doesn't keep the frames
+    of every caller that has raised it alive.
+    """
+
+    def __init__(self, ttl=10, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Dict of (expiry_time, error) tuples keyed to request
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def __setitem__(self, key, error):
+        """ Record that the request 'key' failed with 'error' """
+        now = time.time()
+        with self.lock:
+            if len(self.errors) >= self.max_entries:
+                # Discard expired entries, or if none have expired, all of them
+                self.errors = dict([(k, v) for (k, v) in self.errors.items()
+                                    if v[0] > now])
+                if len(self.errors) >= self.max_entries:
+                    self.errors.clear()
+            self.errors[key] = (now + self.ttl, _copy_error(error))
+
+    def get(self, key, alternative=None):
+        """
+        Return a new copy of the error from a recent failure of request 'key';
+        otherwise return 'alternative'
+        """
+        entry = self.errors.get(key)
+        if entry is None or entry[0] <= time.time():
+            return alternative
+        return _copy_error(entry[1])
+
+    def clear(self):
+        """ Forget all failures """
+        with self.lock:
+            self.errors.clear()
+
+
+def _copy_error(error):
+    """ Return copy of exception 'error', without its traceback """
+    copied = error.__class__.__new__(error.__class__)
+    copied.args = error.args
+    copied.__dict__.update(error.__dict__)
+    return copied
@@ -0,0 +1,139 @@
+"""
+Per-verse word and character counts, allowing the size of a passage's text to
+be estimated (and passages truncated to a given size) without fetching it.
+
+No counts are distributed with this module, as they are derived from
+copyrighted text. Tables can be built from verse texts with
+TextSizeTable.from_texts, saved with TextSizeTable.save, and loaded again with
+TextSizeTable.load. A loaded table may be made the default for a translation by
+setting it as the size_table of the corresponding bibledata module; e.g.
+    pypassage.bibledata.esv.size_table = TextSizeTable.load("esv.sizes")
+
+File format: the 4-byte signature b"PPTS", a version byte (1), a little-endian
+unsigned 32-bit verse count n, then n little-endian unsigned 16-bit word counts
+followed by n little-endian unsigned 16-bit character counts; one per verse
+ordinal (see Passage.ordinal_range).
+"""
+from array import array
+from bisect import bisect_right
+import struct
+import sys
+
+SIGNATURE = b"PPTS"
+VERSION = 1
+_HEADER = struct.Struct("<4sBI")
+
+
+class TextSizeTable(object):
+    """
+    Cumulative word and character counts, indexed by verse ordinal. The size of
+    any passage, or the longest passage fitting within a size limit, is found
+    in O(1) or O(log n) time respectively.
+    """
+
+    def __init__(self, word_counts, char_counts):
+        """
+        Initialise from sequences of per-verse word and character counts,
+        indexed by verse ordinal.
+        """
+        if len(word_counts) != len(char_counts):
+            raise ValueError("word_counts and char_counts must be the same "
+                             "length")
+        self.word_counts = array('H', word_counts)
+        self.char_counts = array('H', char_counts)
+        self.cumulative_words = _cumulative(self.word_counts)
+        self.cumulative_chars = _cumulative(self.char_counts)
+
+    def __len__(self):
+        """ Return number of verses in table """
+        return len(self.word_counts)
+
+    @classmethod
+    def from_texts(cls, texts):
+        """
+        Build table from a sequence of verse texts, indexed by verse ordinal.
+        Words are counted as whitespace-separated tokens.
+        """
+        word_counts = []
+        char_counts = []
+        for text in texts:
+            word_counts.append(len(text.split()))
+            char_counts.append(len(text))
+        return cls(word_counts, char_counts)
+
+    @classmethod
+    def load(cls, f):
+        """ Load table from a filename or binary file object """
+        if not hasattr(f, "read"):
+            with open(f, "rb") as fileobj:
+                return cls.load(fileobj)
+        header = f.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise ValueError("Not a text size table: file too short")
+        (signature, version, n) = _HEADER.unpack(header)
+        if signature != SIGNATURE:
+            raise ValueError("Not a text size table: bad signature")
+        if version != VERSION:
+            raise ValueError("Unsupported text size table version " +
+                             str(version))
+        counts = array('H')
+        if hasattr(counts, "frombytes"):
+            counts.frombytes(f.read(4 * n))
+        else:  # Python 2
+            counts.fromstring(f.read(4 * n))
+        if len(counts) != 2 * n:
+            raise ValueError("Text size table is truncated")
+        if sys.byteorder != "little":
+            counts.byteswap()
+        return cls(counts[:n], counts[n:])
+
+    def save(self, f):
+        """ Save table to a filename or binary file object """
+        if not hasattr(f, "write"):
+            with open(f, "wb") as fileobj:
+                return self.save(fileobj)
+        f.write(_HEADER.pack(SIGNATURE, VERSION, len(self)))
+        counts = self.word_counts + self.char_counts
+        if sys.byteorder != "little":
+            counts.byteswap()
+        if hasattr(counts, "tobytes"):
+            f.write(counts.tobytes())
+        else:  # Python 2
+            f.write(counts.tostring())
+
+    def words(self, start, end):
+        """
+        Return number of words from verse ordinal start to end inclusive
+        """
+        return self.cumulative_words[end + 1] - self.cumulative_words[start]
+
+    def chars(self, start, end):
+        """
+        Return number of characters from verse ordinal start to end inclusive
+        """
+        return self.cumulative_chars[end + 1] - self.cumulative_chars[start]
+
+    def last_within(self, start, end, max_words=None, max_chars=None):
+        """
+        Return the last verse ordinal e (start - 1 <= e <= end) such that
+        verses start to e fit within both max_words and max_chars. Returns
+        start - 1 if not even the first verse fits.
+        """
+        last = end
+        for (limit, cumulative) in ((max_words, self.cumulative_words),
+                                    (max_chars, self.cumulative_chars)):
+            if limit is not None:
+                i = bisect_right(cumulative, cumulative[start] + limit,
+                                 start, last + 2)
+                last = min(last, i - 2)
+        return last
+
+
+def _cumulative(counts):
+    """ Return array of running totals, starting with 0 """
+    cumulative = array('L', [0])
+    total = 0
+    for n in counts:
+        total += n
+        cumulative.append(total)
+    return cumulative
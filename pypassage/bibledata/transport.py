@@ -0,0 +1,536 @@
+"""
+HTTP transports used to fetch passage text.
+
+A transport has a get(url, headers, deadline, priority) function returning a
+Response tuple of (status, headers, body), and raising a TextFetchError (a
+subclass of IOError) for network errors and for responses without a 2xx
+status. If 'deadline' (a time.time() value) is given, FetchTimeoutError is
+raised rather than waiting beyond it. 'priority' orders requests waiting for
+a rate limit (see rate_limit.py); transports that don't wait ignore it.
+
+HTTPTransport keeps connections open between requests, so that a series of
+requests to the same server only pays for one TCP and TLS handshake.
+RetryTransport and CircuitBreakerTransport wrap another transport, retrying
+requests that fail and failing fast while a server is down. HedgingTransport
+sends a second request if the first is unusually slow, and
+rate_limit.RateLimitedTransport keeps requests within quotas. By default, ESV
+passage text is fetched with:
+    CircuitBreakerTransport(RetryTransport(
+        RateLimitedTransport(HTTPTransport(), esv.default_rate_limiter)))
+so that every attempt counts against the API's quotas.
+The transport for a translation may be changed by setting the
+default_transport of the corresponding bibledata module, or per request with
+the 'transport' argument of get_passage_text; e.g.
+    pypassage.bibledata.esv.default_transport = HTTPTransport(timeout=5)
+
+StubTransport makes no network requests at all, for use in tests and
+benchmarks.
+"""
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import json
+import math
+import random
+import socket
+import threading
+import time
+import zlib
+try:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:  # Python 2
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urlsplit, parse_qs
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_IDLE = 4
+HEDGE_WORKERS = 16
+RETRY_STATUSES = (429, 502, 503, 504)
+
+Response = namedtuple("Response", "status headers body")
+
+
+class TextFetchError(IOError):
+    """ Base class of errors fetching passage text """
+    pass
+
+
+class NetworkError(TextFetchError):
+    """ Raised when a server can't be reached, or the connection fails """
+    pass
+
+
+class FetchTimeoutError(NetworkError):
+    """ Raised when a server takes too long to respond """
+    pass
+
+
+class HTTPStatusError(TextFetchError):
+    """ Raised for HTTP responses without a 2xx status """
+
+    def __init__(self, status, url, body=b"", headers={}):
+        TextFetchError.__init__(self, "HTTP status " + str(status) + " from " +
+                                url)
+        self.status = status
+        self.url = url
+        self.body = body
+        self.headers = headers
+
+
+class InvalidResponseError(TextFetchError, ValueError):
+    """ Raised when a response can't be understood """
+    pass
+
+
+class CircuitOpenError(TextFetchError):
+    """
+    Raised without making a request while a server is considered down; see
+    CircuitBreakerTransport.
+    """
+    pass
+
+
+class HTTPTransport(object):
+    """
+    HTTP and HTTPS transport based on http.client, keeping persistent
+    connections to each server for reuse by later requests. Safe to use from
+    several threads at once; each thread gets a connection of its own.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=DEFAULT_MAX_IDLE,
+                 gzip=True, proxy=None, context=None):
+        """
+        Initialise transport.
+
+        Arguments:
+        timeout -- seconds to wait for a connection or response
+        max_idle -- maximum number of open connections to keep for each server
+            while not in use
+        gzip -- if True, responses are requested with gzip compression
+        proxy -- URL of an HTTP proxy (e.g. "http://proxy:3128") to send
+            requests through; HTTPS requests are tunnelled with CONNECT.
+        context -- ssl.SSLContext for HTTPS connections
+        """
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.gzip = gzip
+        self.proxy = urlsplit(proxy) if proxy else None
+        self.context = context
+        # Connections not in use, as lists keyed to (scheme, host, port)
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def get(self, url, headers={}, deadline=None, priority=None):
+        """
+        Make HTTP GET request for 'url', returning Response tuple. Waits no
+        longer than the transport's timeout, nor beyond 'deadline'. Raises
+        HTTPStatusError for non-2xx responses, NetworkError (or
+        FetchTimeoutError) for network errors, and InvalidResponseError for
+        responses that can't be decoded.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        if self.proxy and parts.scheme == "http":
+            path = url
+        else:
+            path = (parts.path or "/") + ("?" + parts.query if parts.query
+                                          else "")
+        headers = dict(headers)
+        if self.gzip:
+            headers.setdefault("Accept-Encoding", "gzip")
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = min(timeout, remaining(deadline, url))
+        (connection, reused) = self._connection(key)
+        while True:
+            try:
+                # Timeout applies to connecting, and to each read
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (HTTPException, socket.error) as e:
+                connection.close()
+                if reused and not isinstance(e, socket.timeout):
+                    # The server closed an idle connection; try a new one
+                    (connection, reused) = (self._new_connection(key), False)
+                    continue
+                if isinstance(e, socket.timeout):
+                    raise FetchTimeoutError("Timed out fetching " + url)
+                raise NetworkError(repr(e))
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        if (response.getheader("Content-Encoding") or "").lower() == "gzip":
+            try:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            except zlib.error as e:
+                raise InvalidResponseError("Invalid gzip response: " + str(e))
+        headers = dict(response.getheaders())
+        if not 200 <= response.status < 300:
+            raise HTTPStatusError(response.status, url, body, headers)
+        return Response(response.status, headers, body)
+
+    def close(self):
+        """ Close all idle connections """
+        with self.lock:
+            idle = [c for connections in self.idle.values()
+                    for c in connections]
+            self.idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def _connection(self, key):
+        """ Return tuple of (connection, reused) for a server """
+        with self.lock:
+            if self.idle[key]:
+                return (self.idle[key].pop(), True)
+        return (self._new_connection(key), False)
+
+    def _new_connection(self, key):
+        (scheme, host, port) = key
+        if scheme not in ("http", "https"):
+            raise NetworkError("Unsupported URL scheme: " + str(scheme))
+        kwargs = {"timeout": self.timeout}
+        if scheme == "https":
+            (cls, default_port) = (HTTPSConnection, 443)
+            if self.context is not None:
+                kwargs["context"] = self.context
+        else:
+            (cls, default_port) = (HTTPConnection, 80)
+        if self.proxy is None:
+            return cls(host, port or default_port, **kwargs)
+        connection = cls(self.proxy.hostname, self.proxy.port or 80, **kwargs)
+        if scheme == "https":
+            connection.set_tunnel(host, port or default_port)
+        return connection
+
+    def _release(self, key, connection):
+        """ Keep a connection for reuse, or close it if enough are kept """
+        with self.lock:
+            if len(self.idle[key]) < self.max_idle:
+                self.idle[key].append(connection)
+                return
+        connection.close()
+
+
+class RetryTransport(object):
+    """
+    Transport that retries failed requests made with another transport, after
+    exponentially increasing, randomised ("full jitter") delays. Network
+    errors and responses with a status in 'statuses' are retried; others are
+    raised straight away.
+    """
+
+    def __init__(self, transport, attempts=3, backoff=0.5, max_backoff=8,
+                 statuses=RETRY_STATUSES):
+        """
+        Initialise transport.
+
+        Arguments:
+        transport -- transport to make requests with
+        attempts -- maximum number of requests for each call to get
+        backoff -- maximum delay before the first retry, in seconds; doubled
+            for each later retry. Delays are chosen at random between zero and
+            the maximum, so that clients don't retry in step.
+        max_backoff -- limit on the maximum delay, in seconds; also limits
+            delays asked for by a server's Retry-After header.
+        statuses -- HTTP statuses to retry
+        """
+        self.transport = transport
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def get(self, url, headers={}, deadline=None, priority=None):
+        """
+        As for HTTPTransport.get. No retry is made if it couldn't start
+        before 'deadline'.
+        """
+        attempt = 1
+        while True:
+            try:
+                return self.transport.get(url, headers, deadline, priority)
+            except TextFetchError as e:
+                if attempt >= self.attempts or not self.retryable(e):
+                    raise
+                delay = self.delay(attempt, e)
+                if deadline is not None and time.time() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def retryable(self, error):
+        """ Return True if a request that raised 'error' may be retried """
+        if isinstance(error, HTTPStatusError):
+            return error.status in self.statuses
+        return isinstance(error, NetworkError)
+
+    def delay(self, attempt, error=None):
+        """ Return seconds to wait before retrying after 'attempt' attempts """
+        seconds = retry_after(error)
+        if seconds is not None:
+            return min(seconds, self.max_backoff)
+        return random.uniform(0, min(self.backoff * 2 ** (attempt - 1),
+                                     self.max_backoff))
+
+
+class CircuitBreakerTransport(object):
+    """
+    Transport that stops making requests to a server (raising
+    CircuitOpenError instead) after 'threshold' consecutive failures, so that
+    callers fail fast while it is down. After 'reset_timeout' seconds, one
+    trial request is let through; if it succeeds, requests resume, and if not,
+    the server is given another 'reset_timeout' seconds.
+
+    Network errors, 5xx responses and unexpected exceptions from the
+    underlying transport count as failures; other errors (such as 404
+    responses) don't. Nor do timeouts where the caller gave a deadline, as the
+    deadline may be shorter than the server usually takes.
+    """
+
+    def __init__(self, transport, threshold=5, reset_timeout=30):
+        self.transport = transport
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        # State of each server, as lists of [failures, opened_at, trial]
+        # keyed to (scheme, host, port)
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers={}, deadline=None, priority=None):
+        """ As for HTTPTransport.get """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        self.before(key)
+        # Always record an outcome, so that a trial request can't be left
+        # holding the circuit half-open
+        outcome = self.release
+        try:
+            response = self.transport.get(url, headers, deadline, priority)
+            outcome = self.success
+            return response
+        except TextFetchError as e:
+            if isinstance(e, FetchTimeoutError) and deadline is not None:
+                outcome = self.release
+            elif isinstance(e, NetworkError) or \
+                    isinstance(e, HTTPStatusError) and e.status >= 500:
+                outcome = self.failure
+            else:
+                outcome = self.success
+            raise
+        except Exception:
+            outcome = self.failure
+            raise
+        finally:
+            outcome(key)
+
+    def is_open(self, key):
+        """
+        Return True if requests to a server, given as a (scheme, host, port)
+        tuple, are currently failing fast.
+        """
+        with self.lock:
+            circuit = self.circuits.get(key)
+            return circuit is not None and circuit[1] is not None and \
+                time.time() < circuit[1] + self.reset_timeout
+
+    def before(self, key):
+        """
+        Raise CircuitOpenError if a request to server 'key' can't be made
+        """
+        with self.lock:
+            circuit = self.circuits.setdefault(key, [0, None, False])
+            if circuit[1] is None:
+                return
+            if circuit[2] or time.time() < circuit[1] + self.reset_timeout:
+                raise CircuitOpenError(
+                    "Not requesting from " + str(key[1]) + " for " +
+                    str(self.reset_timeout) + "s after " +
+                    str(circuit[0]) + " consecutive failures")
+            # Let one trial request through
+            circuit[2] = True
+
+    def release(self, key):
+        """ Allow another trial request, without counting this one """
+        with self.lock:
+            self.circuits.setdefault(key, [0, None, False])[2] = False
+
+    def success(self, key):
+        with self.lock:
+            self.circuits[key] = [0, None, False]
+
+    def failure(self, key):
+        with self.lock:
+            circuit = self.circuits.setdefault(key, [0, None, False])
+            circuit[0] += 1
+            circuit[2] = False
+            if circuit[0] >= self.threshold:
+                circuit[1] = time.time()
+
+
+class HedgingTransport(object):
+    """
+    Transport that sends a second ("hedged") request if the first hasn't
+    finished within the 'percentile' percentile of recent response times,
+    and uses whichever response arrives first. This cuts the slowest
+    responses short at the cost of a few more requests.
+
+    Until 'min_samples' responses have been timed, requests are only hedged
+    after 'initial_delay' seconds (if given). Requests are made from a pool of
+    'workers' threads; the slower of two requests is left to finish in the
+    background.
+    """
+
+    def __init__(self, transport, percentile=95, min_samples=20,
+                 initial_delay=None, samples=100, workers=HEDGE_WORKERS):
+        self.transport = transport
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.samples = deque(maxlen=samples)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.requests = 0
+        self.hedged = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, headers={}, deadline=None, priority=None):
+        """ As for HTTPTransport.get """
+        futures = [self._submit(url, headers, deadline, priority)]
+        delay = self.hedge_delay()
+        if delay is not None:
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.time()))
+            if not wait(futures, delay)[0] and \
+                    (deadline is None or time.time() < deadline):
+                futures.append(self._submit(url, headers, deadline,
+                                            priority))
+                with self.lock:
+                    self.hedged += 1
+        errors = []
+        pending = set(futures)
+        while pending:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            (done, pending) = wait(pending, timeout,
+                                   return_when=FIRST_COMPLETED)
+            if not done:
+                raise FetchTimeoutError("Timed out fetching " + url)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    def hedge_delay(self):
+        """
+        Return seconds after which a request is hedged, or None if requests
+        aren't currently hedged.
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        i = int(math.ceil(self.percentile / 100.0 * len(samples))) - 1
+        return samples[max(0, min(i, len(samples) - 1))]
+
+    def _submit(self, url, headers, deadline, priority):
+        with self.lock:
+            self.requests += 1
+        return self.pool.submit(self._get, url, headers, deadline, priority)
+
+    def _get(self, url, headers, deadline, priority):
+        start = time.time()
+        response = self.transport.get(url, headers, deadline, priority)
+        with self.lock:
+            self.samples.append(time.time() - start)
+        return response
+
+
+class StubTransport(object):
+    """
+    Transport that answers requests itself rather than using the network; for
+    tests and benchmarks. Requests are recorded in 'requests' as (url,
+    headers) tuples.
+    """
+
+    def __init__(self, respond=None, delay=0):
+        """
+        Initialise transport. 'respond' is a function taking (url, headers)
+        and returning a (status, body) or (status, body, response_headers)
+        tuple, or raising TextFetchError; by
+        default, each reference in the 'q' parameter of the URL (separated
+        by semicolons) is given the text "Text of <reference>" in ESV API
+        format. Each request takes at least 'delay' seconds.
+        """
+        self.respond = respond or echo_passages
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers={}, deadline=None, priority=None):
+        """ As for HTTPTransport.get """
+        with self.lock:
+            self.requests.append((url, dict(headers)))
+        if deadline is not None and time.time() + self.delay > deadline:
+            time.sleep(remaining(deadline, url))
+            raise FetchTimeoutError("Timed out fetching " + url)
+        if self.delay:
+            time.sleep(self.delay)
+        response = self.respond(url, headers)
+        (status, body) = response[:2]
+        response_headers = response[2] if len(response) > 2 else {}
+        if not 200 <= status < 300:
+            raise HTTPStatusError(status, url, body, response_headers)
+        return Response(status, response_headers, body)
+
+
+def retry_after(error):
+    """
+    Return seconds given by the Retry-After header of an HTTPStatusError's
+    response, or None.
+    """
+    value = dict([(k.lower(), v) for (k, v) in getattr(
+        error, "headers", {}).items()]).get("retry-after", "")
+    if value.isdigit():
+        return float(value)
+    return None
+
+
+def deadline_after(timeout=None, deadline=None):
+    """
+    Return the deadline (a time.time() value) 'timeout' seconds from now, or
+    'deadline' if that is sooner; None if neither is given.
+    """
+    if timeout is None:
+        return deadline
+    if deadline is None:
+        return time.time() + timeout
+    return min(deadline, time.time() + timeout)
+
+
+def remaining(deadline, url=""):
+    """
+    Return seconds left until 'deadline', raising FetchTimeoutError if it has
+    passed.
+    """
+    left = deadline - time.time()
+    if left <= 0:
+        raise FetchTimeoutError("Deadline passed before fetching " + url)
+    return left
+
+
+def echo_passages(url, headers):
+    """
+    Return (status, body) of an ESV API response giving each reference in the
+    'q' parameter of 'url' the text "Text of <reference>".
+    """
+    refs = parse_qs(urlsplit(url).query)["q"][0].split(";")
+    body = json.dumps({"passages": ["Text of " + r for r in refs]})
+    return (200, body.encode("utf-8"))
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar storage for very large collections of passages
+"""
+from array import array
+
+from .reference import Passage, PassageCollection, bible_data
+from .reference import coalesce_ranges, intersect_ranges, subtract_ranges
+from .reference import collection_reference_string, passage_from_ordinals
+from .reference import memoised_string
+from . import reference
+from .styles import default_style
+from .reference import _ranges_of
+
+TYPECODE = 'i'
+
+
+class PassageArray(object):
+    """
+    Collection of passages stored as two packed arrays of start and end verse
+    ordinals (see Passage.ordinal_range), using 8 bytes per passage. Passage
+    objects are only created when a passage is accessed.
+
+    PassageArray supports the same reference string, set and sequence
+    functions as PassageCollection. Only valid passages can be stored.
+    """
+
+    def __init__(self, passages=None, translation="ESV"):
+        """
+        Initialise PassageArray from a Passage or an iterable of Passage
+        objects (such as a PassageCollection). As with PassageCollection, any
+        other items are ignored.
+        """
+        self.translation = translation
+        self.bd = bible_data(translation)
+        self.starts = array(TYPECODE)
+        self.ends = array(TYPECODE)
+        if passages is not None:
+            self.extend(passages)
+
+    @classmethod
+    def from_arrays(cls, starts, ends, translation="ESV"):
+        """
+        Build PassageArray from sequences of start and end verse ordinals,
+        without creating any Passage objects.
+        """
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be the same length")
+        result = cls(translation=translation)
+        result.starts = array(TYPECODE, starts)
+        result.ends = array(TYPECODE, ends)
+        n = result.bd.number_verses_in_bible
+        for (s, e) in zip(result.starts, result.ends):
+            if s < 0 or e >= n or e < s:
+                raise ValueError("Invalid verse ordinal range " +
+                                 str((s, e)))
+        return result
+
+    @classmethod
+    def from_ranges(cls, ranges, translation="ESV"):
+        """ Build PassageArray from an iterable of (start, end) ordinals """
+        result = cls(translation=translation)
+        for (s, e) in ranges:
+            result.starts.append(s)
+            result.ends.append(e)
+        return result
+
+    def arrays(self):
+        """
+        Return (starts, ends) tuple of ordinal arrays; as accepted by the
+        similarity functions.
+        """
+        return (self.starts, self.ends)
+
+    def ordinal_ranges(self):
+        """ Return list of (start, end) verse-ordinal tuples """
+        return list(zip(self.starts, self.ends))
+
+    def append(self, passage):
+        """ Add a passage to the end of the collection """
+        if isinstance(passage, Passage) and passage.is_valid():
+            (start, end) = passage.ordinal_range()
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def extend(self, passages):
+        """
+        Extend the collection with a Passage, PassageArray or iterable of
+        Passage objects
+        """
+        if isinstance(passages, PassageArray):
+            self.starts.extend(passages.starts)
+            self.ends.extend(passages.ends)
+        else:
+            for (start, end) in _ranges_of([p for p in _iterable(passages)
+                                            if isinstance(p, Passage)]):
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def insert(self, i, passage):
+        """ Insert passage at a given position """
+        if isinstance(passage, Passage) and passage.is_valid():
+            (start, end) = passage.ordinal_range()
+            self.starts.insert(i, start)
+            self.ends.insert(i, end)
+
+    def to_collection(self):
+        """ Return PassageCollection of the passages in this collection """
+        return PassageCollection(list(self))
+
+    def reference_string(self, abbreviated=False, dash="-", style=None):
+        """
+        x.reference_string() <==> str(x)
+        Return string representation of passage references. As for Passage
+        objects, 'style' may be given and strings are cached.
+        """
+        if style is None:
+            style = default_style(abbreviated, dash)
+        return memoised_string(self, style, collection_reference_string, self,
+                               style)
+
+    def _reference_key(self, style):
+        if len(self) > reference.REFERENCE_CACHE_MAX_PASSAGES:
+            return None
+        return (PassageArray, self.bd, _bytes(self.starts),
+                _bytes(self.ends), style)
+
+    def normalize(self):
+        """
+        Return new PassageArray in bible order, with overlapping and adjacent
+        passages merged. See PassageCollection.normalize.
+        """
+        return self._from_ranges(coalesce_ranges(self.ordinal_ranges()))
+
+    def union(self, other):
+        """
+        Return normalised PassageArray of all verses that are in this
+        collection or in 'other' (a Passage or collection of passages).
+        """
+        return self._from_ranges(coalesce_ranges(
+            self.ordinal_ranges() + _ranges_of(other)))
+
+    def intersection(self, other):
+        """
+        Return normalised PassageArray of all verses that are in both this
+        collection and 'other' (a Passage or collection of passages).
+        """
+        return self._from_ranges(intersect_ranges(
+            coalesce_ranges(self.ordinal_ranges()),
+            coalesce_ranges(_ranges_of(other))))
+
+    def difference(self, other):
+        """
+        Return normalised PassageArray of all verses that are in this
+        collection but not in 'other' (a Passage or collection of passages).
+        """
+        return self._from_ranges(subtract_ranges(
+            coalesce_ranges(self.ordinal_ranges()),
+            coalesce_ranges(_ranges_of(other))))
+
+    def contains(self, other):
+        """
+        Return True if every verse of 'other' (a Passage or collection of
+        passages) is in this collection.
+        """
+        return not subtract_ranges(coalesce_ranges(_ranges_of(other)),
+                                   coalesce_ranges(self.ordinal_ranges()))
+
+    def total_verses(self):
+        """
+        Return number of distinct verses in this collection; verses that
+        appear in more than one passage are only counted once.
+        """
+        return sum([e - s + 1 for (s, e) in
+                    coalesce_ranges(self.ordinal_ranges())])
+
+    def _from_ranges(self, ranges):
+        return self.from_ranges(ranges, self.translation)
+
+    def __len__(self):
+        """
+        x.__len__() <==> len(x)
+        Return number of passages in collection.
+        """
+        return len(self.starts)
+
+    def __getitem__(self, key):
+        """
+        x.__getitem__(i) <==> x[i]
+        Return i-th passage as a Passage object, or for a slice, a new
+        PassageArray.
+        """
+        if isinstance(key, slice):
+            result = self.__class__(translation=self.translation)
+            result.starts = self.starts[key]
+            result.ends = self.ends[key]
+            return result
+        return passage_from_ordinals(self.starts[key], self.ends[key],
+                                     self.translation)
+
+    def __iter__(self):
+        """
+        x.__iter__() <==> iter(x)
+        Generate Passage objects for each passage in turn.
+        """
+        for (start, end) in zip(self.starts, self.ends):
+            yield passage_from_ordinals(start, end, self.translation)
+
+    def __contains__(self, passage):
+        """
+        x.__contains__(p) <==> p in x
+        Return True if passage 'p' is one of the passages in this collection.
+        To check whether verses are covered by the collection, use contains.
+        """
+        if not isinstance(passage, Passage) or not passage.is_valid():
+            return False
+        (start, end) = passage.ordinal_range()
+        return any(s == start and e == end
+                   for (s, e) in zip(self.starts, self.ends))
+
+    def __eq__(self, other):
+        if isinstance(other, PassageArray):
+            return self.starts == other.starts and self.ends == other.ends
+        if isinstance(other, PassageCollection):
+            return len(self) == len(other) and all(
+                a == b for (a, b) in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __add__(self, other):
+        """
+        x.__add__(y) <==> x + y
+        Return new PassageArray of the passages in both collections.
+        """
+        if not isinstance(other, (Passage, PassageCollection, PassageArray)):
+            return NotImplemented
+        result = self[:]
+        result.extend(other)
+        return result
+
+    def __radd__(self, other):
+        """
+        x.__radd__(y) <==> y + x
+        Return new PassageArray of the passages in both collections.
+        """
+        if not isinstance(other, (Passage, PassageCollection)):
+            return NotImplemented
+        result = self.__class__(other, self.translation)
+        result.extend(self)
+        return result
+
+    def __str__(self):
+        """
+        x.__str__() <==> str(x)
+        Return passage string
+        """
+        return self.reference_string()
+
+    def __unicode__(self):
+        """
+        x.__unicode__() <==> unicode(x)
+        Return unicode version of passage string. Uses en-dash for ranges.
+        """
+        return self.reference_string(dash=u"–")
+
+    def abbr(self):
+        """
+        Return abbreviated passage string
+        """
+        return self.reference_string(abbreviated=True)
+
+    def uabbr(self):
+        """
+        Return unicode-type abbreviated passage string. Uses en-dash for
+        ranges.
+        """
+        return self.reference_string(abbreviated=True, dash=u"–")
+
+    def __repr__(self):
+        """
+        x.__repr__() <==> x
+        """
+        return "PassageArray(" + ", ".join([repr(x) for x in self]) + ")"
+
+
+def _bytes(values):
+    if hasattr(values, "tobytes"):
+        return values.tobytes()
+    return values.tostring()  # Python 2
+
+
+def _iterable(passages):
+    if isinstance(passages, Passage):
+        return [passages]
+    return passages
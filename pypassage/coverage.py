@@ -0,0 +1,141 @@
+"""
+Aggregating how many times each verse, chapter and book appears across large
+numbers of passages (e.g. how often each has been preached on or read)
+"""
+from array import array
+try:
+    from itertools import accumulate
+except ImportError:  # Python 2
+    def accumulate(iterable):
+        total = 0
+        for x in iterable:
+            total += x
+            yield total
+
+from .reference import Passage, bible_data
+
+AGGREGATES = {"sum": sum, "min": min, "max": max}
+
+try:
+    array('q')
+    COUNT_TYPECODE = 'q'
+except ValueError:  # Python 2
+    COUNT_TYPECODE = 'l'
+
+
+class Coverage(object):
+    """
+    Counts of how many times each verse has been covered by the passages added
+    to it.
+
+    Adding a passage is O(1): only a difference array over verse ordinals is
+    updated (+count at the first verse, -count after the last). Per-verse
+    counts are then computed with a single prefix-sum pass when first
+    requested.
+    Coverage objects built from separate shards of data may be combined with
+    merge (or +).
+    """
+
+    def __init__(self, passages=None, translation="ESV"):
+        """
+        Initialise Coverage, optionally adding a Passage, PassageCollection or
+        other iterable of Passage objects to it.
+        """
+        self.translation = translation
+        self.bd = bible_data(translation)
+        self.diff = array(COUNT_TYPECODE, [0]) * \
+            (self.bd.number_verses_in_bible + 1)
+        self._verse_counts = None
+        if passages is not None:
+            self.add(passages)
+
+    def add(self, passages, count=1):
+        """
+        Add a Passage, PassageCollection or other iterable of Passage objects,
+        'count' times over.
+        """
+        if isinstance(passages, Passage):
+            passages = [passages]
+        for passage in passages:
+            (start, end) = passage.ordinal_range()
+            self.add_range(start, end, count)
+
+    def add_range(self, start, end, count=1):
+        """ Add verses from ordinal 'start' to ordinal 'end' inclusive """
+        self.diff[start] += count
+        self.diff[end + 1] -= count
+        self._verse_counts = None
+
+    def merge(self, other):
+        """ Add counts from another Coverage object to this one """
+        if len(other.diff) != len(self.diff):
+            raise ValueError("Cannot merge coverage of different translations")
+        diff = self.diff
+        for (i, d) in enumerate(other.diff):
+            if d:
+                diff[i] += d
+        self._verse_counts = None
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        """
+        x.__add__(y) <==> x + y
+        Return new Coverage combining counts of both objects.
+        """
+        if not isinstance(other, Coverage):
+            return NotImplemented
+        result = self.__class__(translation=self.translation)
+        result.diff[:] = self.diff
+        return result.merge(other)
+
+    def verse_counts(self):
+        """
+        Return array of counts for every verse, indexed by verse ordinal (see
+        Passage.ordinal_range).
+        """
+        if self._verse_counts is None:
+            self._verse_counts = array(COUNT_TYPECODE,
+                                       accumulate(self.diff[:-1]))
+        return self._verse_counts
+
+    def counts(self, per_book=False, per_chapter=False, aggregate="sum"):
+        """
+        Return per-chapter counts as a dictionary keyed to (book_n, chapter)
+        if per_chapter=True, or per-book counts as a dictionary keyed to
+        book_n if per_book=True.
+
+        'aggregate' determines how the counts for each verse are combined:
+        "sum" gives the total number of verses read; "min" the number of times
+        the whole chapter or book has been covered; and "max" the number of
+        times any part of it has been.
+        """
+        if aggregate not in AGGREGATES:
+            raise ValueError("aggregate must be one of " +
+                             ", ".join(sorted(AGGREGATES)))
+        function = AGGREGATES[aggregate]
+        if per_chapter:
+            keys = self.bd.chapter_list
+            starts = self.bd.chapter_start_ordinals
+        elif per_book:
+            keys = sorted(self.bd.book_start_ordinals)
+            starts = [self.bd.book_start_ordinals[k] for k in keys]
+        else:
+            raise ValueError("One of per_book or per_chapter must be True")
+        verse_counts = self.verse_counts()
+        ends = starts[1:] + [self.bd.number_verses_in_bible]
+        return dict([(key, function(verse_counts[start:end]))
+                     for (key, start, end) in zip(keys, starts, ends)])
+
+    def count(self, passage, aggregate="sum"):
+        """
+        Return counts over the verses of a single Passage, combined as per
+        'aggregate' (see counts).
+        """
+        (start, end) = passage.ordinal_range()
+        return AGGREGATES[aggregate](self.verse_counts()[start:end + 1])
+
+    def __repr__(self):
+        return "Coverage(total=" + str(sum(self.verse_counts())) + ")"
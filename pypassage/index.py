@@ -0,0 +1,329 @@
+"""
+Interval index for answering overlap, stabbing and containment queries over
+large numbers of passages
+"""
+from bisect import bisect_left, bisect_right
+import math
+import numbers
+
+# Weight balance of the tree. When an add makes the tree deeper than
+# log(n)/log(1/BALANCE) nodes, the smallest subtree on the new node's path
+# with a child holding more than BALANCE of its nodes is rebuilt (as in a
+# scapegoat tree).
+BALANCE = 0.7
+
+
+class PassageIndex(object):
+    """
+    Centred interval tree over integer passage ranges.
+
+    Passages are stored as inclusive (start, end) integer ranges. By default
+    these are the integers given by Passage.setint() (e.g. Gen 3:5 is
+    1003005), which are also what the opt/django models store; any other
+    encoding that preserves verse order may be used with from_arrays() instead.
+
+    Each entry is stored against a key. Keys default to the position at which
+    the passage was added, but may be any hashable value (such as a database
+    primary key). Queries return lists of keys.
+
+    Stabbing and overlap queries run in O(log n + k) time, where k is the
+    number of matching entries. Insertion and deletion are O(log n + m), where
+    m is the number of entries stored at the tree node that the interval
+    belongs to; insertion is amortised, as subtrees are rebuilt to keep the
+    tree balanced however entries are added (e.g. in sorted order).
+    """
+
+    def __init__(self, passages=None):
+        """
+        Initialise index, optionally bulk-loading it from an iterable of
+        Passage objects (or a PassageCollection). Keys are assigned in order,
+        starting at 0.
+        """
+        self.ranges = {}
+        self.root = None
+        self.next_key = 0
+        if passages is not None:
+            starts = []
+            ends = []
+            for passage in passages:
+                (start, end) = passage_bounds(passage)
+                starts.append(start)
+                ends.append(end)
+            self.build(starts, ends)
+
+    @classmethod
+    def from_arrays(cls, starts, ends, keys=None):
+        """
+        Build index in bulk from parallel sequences (lists, arrays or similar)
+        of start and end integers. If 'keys' is not given, entries are keyed to
+        their position in the sequences.
+        """
+        index = cls()
+        index.build(starts, ends, keys)
+        return index
+
+    def build(self, starts, ends, keys=None):
+        """
+        Replace contents of index with the given ranges, building a balanced
+        tree in O(n log n) time. If the ranges are invalid, ValueError is
+        raised and the index is left unchanged.
+        """
+        if len(starts) != len(ends):
+            raise ValueError("starts and ends must be the same length")
+        if keys is None:
+            keys = range(len(starts))
+        elif len(keys) != len(starts):
+            raise ValueError("keys must be the same length as starts and ends")
+        ranges = {}
+        for (key, start, end) in zip(keys, starts, ends):
+            if end < start:
+                raise ValueError("Range for key " + repr(key) +
+                                 " ends before it starts")
+            ranges[key] = (int(start), int(end))
+        if len(ranges) != len(starts):
+            raise ValueError("Duplicate keys provided")
+        items = sorted(ranges.items(), key=lambda x: x[1][0])
+        self.root = self._build_node(items)
+        self.ranges = ranges
+        self.next_key = len(starts)
+
+    def _build_node(self, items):
+        """
+        Build subtree from list of (key, (start, end)) items that are sorted by
+        start.
+        """
+        if not items:
+            return None
+        node = _Node(items[len(items)//2][1][0])
+        left = []
+        right = []
+        here = []
+        for item in items:
+            (start, end) = item[1]
+            if end < node.center:
+                left.append(item)
+            elif start > node.center:
+                right.append(item)
+            else:
+                here.append(item)
+        node.start_keys = [r[0] for (k, r) in here]
+        node.start_ids = [k for (k, r) in here]
+        here.sort(key=lambda x: -x[1][1])
+        node.end_keys = [-r[1] for (k, r) in here]
+        node.end_ids = [k for (k, r) in here]
+        node.left = self._build_node(left)
+        node.right = self._build_node(right)
+        node.size = 1 + _size(node.left) + _size(node.right)
+        return node
+
+    def add(self, passage, key=None):
+        """
+        Add a Passage object (or a (start, end) tuple of integers) to the
+        index, returning the key it has been stored against.
+        """
+        if key is None:
+            key = self.next_key
+            while key in self.ranges:
+                key += 1
+            self.next_key = key + 1
+        elif key in self.ranges:
+            raise KeyError("Key " + repr(key) + " already in index")
+        (start, end) = passage_bounds(passage)
+        if end < start:
+            raise ValueError("Range ends before it starts")
+        self.ranges[key] = (start, end)
+        path = []
+        node = self.root
+        while node is not None and (end < node.center or start > node.center):
+            path.append(node)
+            node = node.left if end < node.center else node.right
+        created = node is None
+        if created:
+            node = _Node(start)
+            if not path:
+                self.root = node
+            elif end < path[-1].center:
+                path[-1].left = node
+            else:
+                path[-1].right = node
+            for parent in path:
+                parent.size += 1
+        i = bisect_right(node.start_keys, start)
+        node.start_keys.insert(i, start)
+        node.start_ids.insert(i, key)
+        i = bisect_right(node.end_keys, -end)
+        node.end_keys.insert(i, -end)
+        node.end_ids.insert(i, key)
+        if created and \
+                len(path) > math.log(self.root.size) / -math.log(BALANCE):
+            self._rebalance(path, node)
+        return key
+
+    def _rebalance(self, path, node):
+        """
+        Rebuild the lowest subtree on 'path' (the ancestors of 'node', from
+        the root) that is out of balance.
+        """
+        i = len(path) - 1
+        while i > 0 and node.size <= BALANCE * path[i].size:
+            node = path[i]
+            i -= 1
+        old = path[i]
+        keys = []
+        stack = [old]
+        while stack:
+            n = stack.pop()
+            if n is not None:
+                keys.extend(n.start_ids)
+                stack.extend((n.left, n.right))
+        new = self._build_node(sorted([(k, self.ranges[k]) for k in keys],
+                                      key=lambda x: x[1][0]))
+        if i == 0:
+            self.root = new
+        elif path[i - 1].left is old:
+            path[i - 1].left = new
+        else:
+            path[i - 1].right = new
+        for parent in path[:i]:
+            parent.size += new.size - old.size
+
+    def remove(self, key):
+        """ Remove the entry stored against 'key'; KeyError if absent """
+        (start, end) = self.ranges.pop(key)
+        node = self.root
+        while node is not None:
+            if end < node.center:
+                node = node.left
+            elif start > node.center:
+                node = node.right
+            else:
+                _remove_sorted(node.start_keys, node.start_ids, start, key)
+                _remove_sorted(node.end_keys, node.end_ids, -end, key)
+                return
+        raise Exception("Error: Index is inconsistent; could not find " +
+                        repr(key) + " in tree.")
+
+    def __delitem__(self, key):
+        self.remove(key)
+
+    def __getitem__(self, key):
+        """ Return (start, end) integers stored against 'key' """
+        return self.ranges[key]
+
+    def __contains__(self, key):
+        return key in self.ranges
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def stabbing(self, point):
+        """
+        Return keys of all entries that contain 'point'. 'point' may be an
+        integer or a Passage object; for a Passage, entries overlapping any
+        part of it are returned (which for a single verse is the same thing).
+        """
+        if not isinstance(point, numbers.Integral):
+            return self.overlapping(point)
+        return self._overlapping(point, point)
+
+    def overlapping(self, passage):
+        """
+        Return keys of all entries that share at least one verse with the given
+        Passage object or (start, end) tuple.
+        """
+        (start, end) = passage_bounds(passage)
+        return self._overlapping(start, end)
+
+    def containing(self, passage):
+        """
+        Return keys of all entries that contain the whole of the given Passage
+        object or (start, end) tuple.
+        """
+        (start, end) = passage_bounds(passage)
+        return [k for k in self._overlapping(start, start)
+                if self.ranges[k][1] >= end]
+
+    def within(self, passage):
+        """
+        Return keys of all entries that lie wholly inside the given Passage
+        object or (start, end) tuple.
+        """
+        (start, end) = passage_bounds(passage)
+        return [k for k in self._overlapping(start, end)
+                if self.ranges[k][0] >= start and self.ranges[k][1] <= end]
+
+    def _overlapping(self, start, end):
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if end < node.center:
+                # Entries here all end at or after center; they overlap iff
+                # they start at or before the end of the query
+                i = bisect_right(node.start_keys, end)
+                results.extend(node.start_ids[:i])
+                stack.append(node.left)
+            elif start > node.center:
+                # Entries here all start at or before center; they overlap iff
+                # they end at or after the start of the query
+                i = bisect_right(node.end_keys, -start)
+                results.extend(node.end_ids[:i])
+                stack.append(node.right)
+            else:
+                # Query contains center, and so overlaps every entry here
+                results.extend(node.start_ids)
+                stack.append(node.left)
+                stack.append(node.right)
+        return results
+
+
+class _Node(object):
+    """
+    Internal-use tree node. Holds all intervals containing 'center', both
+    sorted by start and sorted by (descending) end.
+    """
+    __slots__ = ("center", "start_keys", "start_ids", "end_keys", "end_ids",
+                 "left", "right", "size")
+
+    def __init__(self, center):
+        self.center = center
+        self.start_keys = []
+        self.start_ids = []
+        # Negated ends, so that both lists may be searched with bisect
+        self.end_keys = []
+        self.end_ids = []
+        self.left = None
+        self.right = None
+        # Number of nodes in this subtree
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _remove_sorted(keys, ids, value, key):
+    """ Remove 'key' from 'ids', using sorted 'keys' list to locate it """
+    i = bisect_left(keys, value)
+    while ids[i] != key:
+        i += 1
+    del keys[i]
+    del ids[i]
+
+
+def passage_bounds(passage):
+    """
+    Return (start, end) integers for a Passage object, as per Passage.setint(),
+    or return the supplied tuple if given a (start, end) pair.
+    """
+    if isinstance(passage, tuple):
+        return (int(passage[0]), int(passage[1]))
+    return (passage.start_book_n * 10**6 + passage.start_chapter * 10**3 +
+            passage.start_verse,
+            passage.end_book_n * 10**6 + passage.end_chapter * 10**3 +
+            passage.end_verse)
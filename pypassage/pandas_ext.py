@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+pandas support: a "passage" dtype for Series and DataFrame columns, and a
+.passage accessor for vectorised operations on them. Requires pandas; this
+module is not imported by pypassage itself.
+
+For example:
+>>> import pypassage.pandas_ext
+>>> s = pandas.Series([Passage('Rom',8), Passage('Jn',3,16)], dtype="passage")
+>>> s.passage.str()
+0     Romans 8
+1    John 3:16
+dtype: object
+>>> s[s.passage.overlaps(Passage('Rom',8,28))].passage.book
+0    45
+dtype: Int64
+
+Values are stored as two arrays of start and end verse ordinals (see
+Passage.ordinal_range), with -1 marking missing values, so sorting, grouping
+and the accessor's functions never need to create Passage objects. Only ESV
+versification is supported.
+"""
+import numpy
+import pandas
+from pandas.api.extensions import ExtensionArray, ExtensionDtype
+from pandas.api.extensions import register_extension_dtype
+from pandas.api.extensions import register_series_accessor, take
+from pandas.api.indexers import check_array_indexer
+
+from .reference import Passage, PassageCollection, bible_data
+from .reference import passage_from_ordinals, passages_from_string
+
+TRANSLATION = "ESV"
+_bd = bible_data(TRANSLATION)
+_book_starts = numpy.array(sorted(_bd.book_start_ordinals.values()),
+                           dtype=numpy.int64)
+
+
+@register_extension_dtype
+class PassageDtype(ExtensionDtype):
+    """ pandas dtype for Passage values; available as dtype="passage" """
+    name = "passage"
+    type = Passage
+    kind = "O"
+
+    @classmethod
+    def construct_array_type(cls):
+        return PassageExtensionArray
+
+
+class PassageExtensionArray(ExtensionArray):
+    """
+    pandas ExtensionArray of passages, backed by arrays of start and end verse
+    ordinals.
+    """
+
+    def __init__(self, starts, ends, copy=False):
+        """
+        Initialise from arrays of start and end verse ordinals; -1 in 'starts'
+        marks a missing value.
+        """
+        convert = numpy.array if copy else numpy.asarray
+        self.starts = convert(starts, dtype=numpy.int64)
+        self.ends = convert(ends, dtype=numpy.int64)
+        if self.starts.shape != self.ends.shape or self.starts.ndim != 1:
+            raise ValueError("starts and ends must be 1-dimensional arrays " +
+                             "of the same length")
+
+    @classmethod
+    def from_arrays(cls, starts, ends):
+        """ Build array from sequences of start and end verse ordinals """
+        return cls(starts, ends, copy=True)
+
+    @classmethod
+    def from_collection(cls, passages):
+        """
+        Build array from a PassageCollection, PassageArray or other sequence
+        of Passage objects.
+        """
+        return cls._from_sequence(passages)
+
+    def to_collection(self):
+        """ Return PassageCollection of the non-missing passages """
+        return PassageCollection([p for p in self if isinstance(p, Passage)])
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        if hasattr(scalars, "arrays"):
+            # PassageArray
+            (starts, ends) = scalars.arrays()
+            return cls(starts, ends, copy=True)
+        n = len(scalars)
+        starts = numpy.full(n, -1, dtype=numpy.int64)
+        ends = numpy.full(n, -1, dtype=numpy.int64)
+        for (i, value) in enumerate(scalars):
+            if isinstance(value, str):
+                parsed = passages_from_string(value)
+                if not isinstance(parsed, Passage):
+                    raise ValueError("Cannot parse passage reference " +
+                                     repr(value))
+                value = parsed
+            if isinstance(value, Passage):
+                if value.is_valid():
+                    (starts[i], ends[i]) = value.ordinal_range()
+            elif not pandas.isna(value):
+                raise TypeError("Cannot convert " + repr(value) +
+                                " to a passage")
+        return cls(starts, ends)
+
+    @classmethod
+    def _from_sequence_of_strings(cls, strings, dtype=None, copy=False):
+        return cls._from_sequence(strings, dtype, copy)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls(*_decode(values))
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        return cls(numpy.concatenate([a.starts for a in to_concat]),
+                   numpy.concatenate([a.ends for a in to_concat]))
+
+    @property
+    def dtype(self):
+        return PassageDtype()
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.ends.nbytes
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, numpy.integer)):
+            if self.starts[item] < 0:
+                return self.dtype.na_value
+            return passage_from_ordinals(int(self.starts[item]),
+                                         int(self.ends[item]), TRANSLATION)
+        item = check_array_indexer(self, item)
+        return self.__class__(self.starts[item], self.ends[item])
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, PassageExtensionArray):
+            if isinstance(value, Passage) or pandas.api.types.is_scalar(value):
+                value = [value]
+            value = self._from_sequence(value)
+        key = check_array_indexer(self, key)
+        if len(value) == 1:
+            self.starts[key] = value.starts[0]
+            self.ends[key] = value.ends[0]
+        else:
+            self.starts[key] = value.starts
+            self.ends[key] = value.ends
+
+    def __array__(self, dtype=None, copy=None):
+        # Built item by item, as numpy would otherwise treat each Passage as a
+        # sequence of verses
+        result = numpy.empty(len(self), dtype=object)
+        for (i, value) in enumerate(self):
+            result[i] = value
+        return result
+
+    def __eq__(self, other):
+        if isinstance(other, (pandas.Series, pandas.Index,
+                              pandas.DataFrame)):
+            return NotImplemented
+        if isinstance(other, Passage):
+            (start, end) = other.ordinal_range()
+            return (self.starts == start) & (self.ends == end)
+        if pandas.api.types.is_scalar(other):
+            return numpy.zeros(len(self), dtype=bool)
+        if not isinstance(other, PassageExtensionArray):
+            other = self._from_sequence(other)
+        return (self.starts == other.starts) & (self.ends == other.ends) & \
+            (self.starts >= 0)
+
+    def isna(self):
+        return self.starts < 0
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        (fill_start, fill_end) = (-1, -1)
+        if allow_fill and isinstance(fill_value, Passage):
+            (fill_start, fill_end) = fill_value.ordinal_range()
+        starts = take(self.starts, indices, allow_fill=allow_fill,
+                      fill_value=fill_start)
+        ends = take(self.ends, indices, allow_fill=allow_fill,
+                    fill_value=fill_end)
+        return self.__class__(starts, ends)
+
+    def copy(self):
+        return self.__class__(self.starts, self.ends, copy=True)
+
+    def unique(self):
+        # Passage objects aren't hashable, so the encoded ordinals are used
+        return self._from_factorized(
+            pandas.unique(_encode(self.starts, self.ends)), self)
+
+    def _values_for_factorize(self):
+        return (_encode(self.starts, self.ends), -1)
+
+    def _values_for_argsort(self):
+        # Bible order of start verse, then end verse
+        return _encode(self.starts, self.ends)
+
+    def _formatter(self, boxed=False):
+        return str
+
+
+@register_series_accessor("passage")
+class PassageAccessor(object):
+    """ Vectorised functions for Series of dtype "passage" """
+
+    def __init__(self, series):
+        if not isinstance(series.dtype, PassageDtype):
+            raise AttributeError("Can only use .passage accessor with " +
+                                 "passage values")
+        self.series = series
+        self.array = series.array
+
+    def str(self, abbreviated=False, dash="-", style=None):
+        """
+        Return Series of reference strings, optionally in a given
+        styles.ReferenceStyle. Each distinct passage is only rendered once.
+        """
+        (codes, uniques) = pandas.factorize(self.array)
+        strings = numpy.empty(len(uniques), dtype=object)
+        for (i, p) in enumerate(uniques):
+            strings[i] = p.reference_string(abbreviated, dash, style)
+        result = numpy.full(len(codes), numpy.nan, dtype=object)
+        present = codes >= 0
+        result[present] = strings[codes[present]]
+        return self._series(result)
+
+    def abbr(self, dash="-"):
+        """ Return Series of abbreviated reference strings """
+        return self.str(abbreviated=True, dash=dash)
+
+    def len(self):
+        """ Return Series of the number of verses in each passage """
+        return self._series(pandas.arrays.IntegerArray(
+            self.array.ends - self.array.starts + 1, self.array.isna()))
+
+    def overlaps(self, passage):
+        """
+        Return boolean Series of whether each passage shares any verses with
+        'passage'.
+        """
+        (start, end) = passage.ordinal_range()
+        return self._series((self.array.starts <= end) &
+                            (self.array.ends >= start) &
+                            ~self.array.isna())
+
+    @property
+    def book(self):
+        """ Series of the book number that each passage starts in """
+        book_n = numpy.searchsorted(_book_starts, self.array.starts,
+                                    side="right")
+        return self._series(pandas.arrays.IntegerArray(
+            book_n.astype(numpy.int64), self.array.isna()))
+
+    def to_collection(self):
+        """ Return PassageCollection of the non-missing passages """
+        return self.array.to_collection()
+
+    def _series(self, values):
+        return pandas.Series(values, index=self.series.index,
+                             name=self.series.name)
+
+
+# === Internal functions ===
+def _encode(starts, ends):
+    """ Encode start and end ordinals as a single sortable integer """
+    return numpy.where(starts < 0, -1,
+                       starts * _bd.number_verses_in_bible + ends)
+
+
+def _decode(values):
+    values = numpy.asarray(values, dtype=numpy.int64)
+    missing = values < 0
+    starts = numpy.where(missing, -1, values // _bd.number_verses_in_bible)
+    ends = numpy.where(missing, -1, values % _bd.number_verses_in_bible)
+    return (starts, ends)
@@ -0,0 +1,196 @@
+"""
+Reading plans: splitting passages into a number of parts of near-equal length
+"""
+from bisect import bisect_left
+import heapq
+
+from .reference import Passage, PassageCollection, bible_data
+from .reference import coalesce_ranges, passage_from_ordinals
+from .reference import split_ranges
+
+
+def reading_plan(passages, parts, align="verse", cross_books=True,
+                 translation="ESV"):
+    """
+    Split a Passage or PassageCollection into 'parts' consecutive passages of
+    near-equal numbers of verses, returning them as a PassageCollection.
+
+    Arguments:
+    align -- "verse" to split anywhere, or "chapter" to only split at the
+        start of a chapter.
+    cross_books -- if False, no part will run over the end of a book.
+
+    Where a collection is given, its passages are first merged and put in
+    bible order (see PassageCollection.normalize), and parts never span the
+    gap between two passages.
+
+    For example, reading Romans in a week:
+    >>> str(reading_plan(Passage('Rom'), 7, align="chapter"))
+    'Romans 1-2, 3-4, 5-7, 8-9, 10-11, 12-14, 15-16'
+    """
+    return PassageCollection([
+        passage_from_ordinals(s, e, translation) for (s, e) in
+        plan_ranges(passages, parts, align, cross_books, translation)])
+
+
+def plan_ranges(passages, parts, align="verse", cross_books=True,
+                translation="ESV"):
+    """
+    As for reading_plan, but returning a list of (start, end) verse-ordinal
+    tuples rather than Passage objects.
+    """
+    if align not in ("verse", "chapter"):
+        raise ValueError("align must be 'verse' or 'chapter'")
+    bd = bible_data(translation)
+    if isinstance(passages, Passage):
+        passages = [passages]
+    segments = coalesce_ranges([p.ordinal_range() for p in passages])
+    if not cross_books:
+        segments = split_ranges(segments,
+                                sorted(bd.book_start_ordinals.values()))
+    if not segments:
+        return []
+
+    # Positions at which each segment may be split
+    if align == "chapter":
+        boundaries = [_boundaries_within(s, e, bd.chapter_start_ordinals)
+                      for (s, e) in segments]
+    else:
+        boundaries = [None] * len(segments)
+    caps = []
+    for ((s, e), b) in zip(segments, boundaries):
+        caps.append(e - s + 1 if b is None else len(b) + 1)
+
+    if align == "verse":
+        # Allocate parts to segments, then split each segment evenly
+        allocation = _allocate([e - s + 1 for (s, e) in segments], parts, caps)
+        ranges = []
+        for ((s, e), n) in zip(segments, allocation):
+            cuts = [s + ((e - s + 1) * i + n // 2) // n for i in range(1, n)]
+            ranges.extend(zip([s] + cuts, [c - 1 for c in cuts] + [e]))
+        return ranges
+
+    # Split into whole chapters, with the smallest possible longest part
+    _check_parts(len(segments), sum(caps), parts)
+    units = [_lengths(s, e, b) for ((s, e), b) in zip(segments, boundaries)]
+    limit = _min_max_part(units, parts)
+    minimums = [_min_parts(u, limit) for u in units]
+    allocation = _allocate([e - s + 1 for (s, e) in segments], parts, caps,
+                           minimums)
+    ranges = []
+    for ((s, e), b, u, n) in zip(segments, boundaries, units, allocation):
+        cuts = [([s] + b)[i] for i in _cuts(u, n, limit)]
+        ranges.extend(zip([s] + cuts, [c - 1 for c in cuts] + [e]))
+    return ranges
+
+
+# === Internal functions ===
+def _boundaries_within(start, end, positions):
+    """ Return sorted positions p such that start < p <= end """
+    return positions[bisect_left(positions, start + 1):
+                     bisect_left(positions, end + 1)]
+
+
+def _check_parts(minimum, maximum, parts):
+    if parts < minimum:
+        raise ValueError(
+            "Cannot split into " + str(parts) + " parts; passages must be " +
+            "split into at least " + str(minimum) + " parts")
+    if parts > maximum:
+        raise ValueError(
+            "Cannot split into " + str(parts) + " parts; passages can be " +
+            "split into at most " + str(maximum) + " parts")
+
+
+def _allocate(lengths, parts, caps, minimums=None):
+    """
+    Allocate 'parts' parts between segments of the given lengths, so as to
+    minimise the length of the longest part. Each segment gets at least one
+    part (or its entry in 'minimums'), and no more than its cap.
+    """
+    _check_parts(len(lengths), sum(caps), parts)
+    allocation = list(minimums or [1] * len(lengths))
+    heap = [(-float(l) / allocation[i], i) for (i, l) in enumerate(lengths)
+            if allocation[i] < caps[i]]
+    heapq.heapify(heap)
+    for _ in range(parts - sum(allocation)):
+        (_, i) = heapq.heappop(heap)
+        allocation[i] += 1
+        if allocation[i] < caps[i]:
+            heapq.heappush(heap, (-float(lengths[i]) / allocation[i], i))
+    return allocation
+
+
+def _lengths(start, end, boundaries):
+    """ Return lengths of the pieces of start..end split at 'boundaries' """
+    edges = [start] + list(boundaries) + [end + 1]
+    return [b - a for (a, b) in zip(edges, edges[1:])]
+
+
+def _min_parts(units, limit):
+    """
+    Return the fewest parts that a sequence of unit lengths can be split
+    into, with no part longer than 'limit'.
+    """
+    parts = 1
+    total = 0
+    for u in units:
+        if total + u > limit:
+            parts += 1
+            total = 0
+        total += u
+    return parts
+
+
+def _min_max_part(segments, parts):
+    """
+    Return the smallest possible length of the longest part, when splitting
+    each sequence of unit lengths in 'segments' into at least one part, and
+    into 'parts' parts in all. Binary search on the length, as the fewest
+    parts needed falls as the length allowed rises.
+    """
+    lo = max([max(u) for u in segments])
+    hi = max([sum(u) for u in segments])
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sum([_min_parts(u, mid) for u in segments]) <= parts:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _cuts(units, n, limit):
+    """
+    Return indices into 'units' at which to split them into 'n' parts, none
+    longer than 'limit', with each cut as close to an even split as that
+    allows.
+    """
+    # Fewest parts needed for units[i:], as the greedy split from the end
+    suffix = [0] * (len(units) + 1)
+    total = 0
+    for i in range(len(units) - 1, -1, -1):
+        if i == len(units) - 1 or total + units[i] > limit:
+            suffix[i] = suffix[i + 1] + 1
+            total = 0
+        else:
+            suffix[i] = suffix[i + 1]
+        total += units[i]
+    cuts = []
+    cur = 0
+    remaining = float(sum(units))
+    for k in range(n - 1, 0, -1):
+        # k parts are left after this one
+        target = remaining / (k + 1)
+        (best, length, total) = (None, None, 0)
+        for j in range(cur + 1, len(units) - k + 1):
+            total += units[j - 1]
+            if total > limit:
+                break
+            if suffix[j] <= k and (best is None or
+                                   abs(total - target) < abs(length - target)):
+                (best, length) = (j, total)
+        cuts.append(best)
+        cur = best
+        remaining -= length
+    return cuts
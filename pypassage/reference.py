@@ -1,11 +1,35 @@
 # -*- coding: utf-8 -*-
 from . import bibledata
-from collections import defaultdict
+from .bibledata.transport import deadline_after
+from .styles import default_style
+from array import array
+from bisect import bisect_right
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from operator import itemgetter
 from builtins import int  # subclass of long on Py2
 import warnings
 import re
 
+# Cache of rendered reference strings, keyed to passage fields, abbreviated
+# and dash. It is emptied whenever it reaches REFERENCE_CACHE_SIZE strings; set
+# REFERENCE_CACHE_SIZE to 0 to disable caching. Collections of more than
+# REFERENCE_CACHE_MAX_PASSAGES passages aren't cached, as building their keys
+# costs as much as rendering them, and the keys would hold a copy of every
+# passage.
+REFERENCE_CACHE_SIZE = 100000
+REFERENCE_CACHE_MAX_PASSAGES = 100
+reference_cache = {}
+
+# Number of passages fetched at once by PassageCollection.text
+DEFAULT_TEXT_WORKERS = 4
+
+# Text of a passage, as returned by PassageCollection.texts. If the text could
+# not be fetched, 'text' and 'truncated' are None and 'error' is the exception
+# raised.
+TextResult = namedtuple("TextResult", "passage text truncated error")
+
 ## Long term ##
 # Implement string parsing
 
@@ -22,6 +46,7 @@ class Passage(object):
         'book' may be a name (e.g. "Genesis"), a standard abbreviation (e.g.
         "Gen") or an integer (i.e. Genesis = 1, Revelation = 66).
         """
+        self.translation = translation
         self.bd = bd = bible_data(translation)
 
         # Check book start
@@ -96,52 +121,48 @@ class Passage(object):
         valid when it is instantiated, it may have been made invalid at a later
         time.
         """
-        # Does start book exist?
-        if isinstance(self.start_book_n, int):
-            if self.start_book_n > 66 or self.start_book_n < 1:
-                return False
-        else:
-            return False
-        # What about end book?
-        if isinstance(self.end_book_n, int):
-            if self.end_book_n < self.start_book_n or self.end_book_n > 66:
-                return False
-        else:
+        bd = self.bd
+        start_book_n = self.start_book_n
+        start_chapter = self.start_chapter
+        start_verse = self.start_verse
+        end_book_n = self.end_book_n
+        end_chapter = self.end_chapter
+        end_verse = self.end_verse
+        # Are books, chapters and verses all integers?
+        if not isinstance(start_book_n, int) or not \
+                isinstance(end_book_n, int) or not \
+                isinstance(start_chapter, int) or not \
+                isinstance(start_verse, int) or not \
+                isinstance(end_chapter, int) or not \
+                isinstance(end_verse, int):
             return False
-        # Are start_chapter, start_verse, end_chapter, and end_verse all
-        # integers?
-        if not isinstance(self.start_chapter, int) or not \
-                isinstance(self.start_verse, int) or not \
-                isinstance(self.end_chapter, int) or not \
-                isinstance(self.end_verse, int):
+        # Do start and end books exist?
+        if start_book_n < 1 or end_book_n < start_book_n or end_book_n > 66:
             return False
         # Do start/end chapter/verse exist?
-        if self.start_chapter < 1 or self.start_verse < 1\
-                or self.end_chapter < 1 or self.end_verse < 1:
+        if start_chapter < 1 or start_verse < 1\
+                or end_chapter < 1 or end_verse < 1:
             return False
-        if self.bd.number_chapters[self.start_book_n] < self.start_chapter:
+        if bd.number_chapters[start_book_n] < start_chapter:
             return False
-        if self.bd.number_chapters[self.end_book_n] < self.end_chapter:
+        if bd.number_chapters[end_book_n] < end_chapter:
             return False
-        if self.bd.last_verses[self.start_book_n, self.start_chapter] <\
-                self.start_verse:
+        if bd.last_verses[start_book_n, start_chapter] < start_verse:
             return False
-        if self.bd.last_verses[self.end_book_n, self.end_chapter] <\
-                self.end_verse:
+        if bd.last_verses[end_book_n, end_chapter] < end_verse:
             return False
         # Is end after start?
-        if self.start_book_n == self.end_book_n:
-            if self.start_chapter > self.end_chapter:
+        if start_book_n == end_book_n:
+            if start_chapter > end_chapter:
                 return False
-            elif self.start_chapter == self.end_chapter:
-                if self.end_verse < self.start_verse:
+            elif start_chapter == end_chapter:
+                if end_verse < start_verse:
                     return False
         # Are either start or end verses missing verses?
-        if self.start_verse in self.bd.missing_verses.get(
-                (self.start_book_n, self.start_chapter), []):
+        if start_verse in bd.missing_verses.get(
+                (start_book_n, start_chapter), ()):
             return False
-        if self.end_verse in self.bd.missing_verses.get(
-                (self.end_book_n, self.end_chapter), []):
+        if end_verse in bd.missing_verses.get((end_book_n, end_chapter), ()):
             return False
         # Everything checked; return True
         return True
@@ -259,7 +280,8 @@ class Passage(object):
             self.end_verse == self.bd.last_verses[
                 self.end_book_n, self.end_chapter])
 
-    def truncate(self, number_verses=None, proportion_of_book=None):
+    def truncate(self, number_verses=None, proportion_of_book=None,
+                 max_words=None, max_chars=None, size_table=None):
         """
         Return truncated version of passage if longer than given restraints,
         or else return self.
@@ -268,6 +290,10 @@ class Passage(object):
         number_verses -- Maximum number of verses that passage may be
         proportion_of_book -- Maximum proportion of book that passage may be;
             measured in terms of number of verses.
+        max_words -- Maximum number of words that passage may be
+        max_chars -- Maximum number of characters that passage may be
+        size_table -- TextSizeTable used for max_words and max_chars; defaults
+            to the translation's size_table (see bibledata.text_size).
 
         For example:
         >>> Passage('Gen').truncate(number_verses=150)
@@ -298,6 +324,12 @@ class Passage(object):
                     break
             if v < limit:
                 limit = v
+        if max_words != None or max_chars != None:
+            table = self._size_table(size_table)
+            (start, end) = self.ordinal_range()
+            v = table.last_within(start, end, max_words, max_chars) - start + 1
+            if v < limit:
+                limit = v
         if current_length <= limit:
             # No need to shorten; return as-is.
             return self
@@ -305,47 +337,14 @@ class Passage(object):
             # Check that we're non-negative
             if limit < 1:
                 return None
-            # We need to shorten this passage. Iterate through chapters until
-            # we've reached our quota of verses.
-            n = 0
-            for book_n in range(self.start_book_n, self.end_book_n+1):
-                if book_n == self.start_book_n:
-                    start_chapter = self.start_chapter
-                else:
-                    start_chapter = 1
-                if book_n == self.end_book_n:
-                    end_chapter = self.end_chapter
-                else:
-                    end_chapter = self.bd.number_chapters[book_n]
-                for chapter in range(start_chapter, end_chapter+1):
-                    if book_n == self.start_book_n and chapter ==\
-                            self.start_chapter:
-                        start_verse = self.start_verse
-                    else:
-                        start_verse = 1
-                    if book_n == self.end_book_n and chapter ==\
-                            self.end_chapter:
-                        end_verse = self.end_verse
-                    else:
-                        end_verse = self.bd.last_verses[book_n, chapter]
-                    valid_verses = [v for v in range(start_verse, end_verse+1)
-                                    if v not in self.bd.missing_verses.get(
-                                        (book_n, chapter), [])]
-                    if n + len(valid_verses) >= limit:
-                        return Passage(
-                            self.start_book_n,
-                            self.start_chapter,
-                            self.start_verse,
-                            chapter,
-                            valid_verses[limit-n-1],
-                            book_n)
-                    else:
-                        n += len(valid_verses)
-            # If we've got through the loop and haven't returned a Passage
-            # object, something's gone amiss.
-            raise Exception(
-                "Error: Could not truncate passage. Got to end_verse and " +
-                "still hadn't reached current_length.")
+            # We need to shorten this passage; it ends 'limit' verses from
+            # its start
+            (start, end) = self.ordinal_range()
+            (end_book_n, end_chapter, end_verse) = ordinal_verse(
+                self.bd, start + limit - 1)
+            return Passage(self.start_book_n, self.start_chapter,
+                           self.start_verse, end_chapter, end_verse,
+                           end_book_n, self.translation)
 
     def extend(self, number_verses=None, proportion_of_book=None):
         """
@@ -395,72 +394,38 @@ class Passage(object):
                 end_chapter,
                 end_verse).truncate(number_verses=limit)
 
-    def reference_string(self, abbreviated=False, dash="-"):
-        """ Return string representation of passage reference. """
+    def reference_string(self, abbreviated=False, dash="-", style=None):
+        """
+        Return string representation of passage reference. If 'style' (a
+        styles.ReferenceStyle) is given, 'abbreviated' and 'dash' are ignored.
+        Strings are cached, so rendering the same passage again is cheap; see
+        clear_reference_cache.
+        """
+        if style is None:
+            style = default_style(abbreviated, dash)
+        if REFERENCE_CACHE_SIZE <= 0:
+            return self._reference_string(style)
+        # Cache lookup is inlined here (rather than using memoised_string) as
+        # this is by far the most common case
+        key = self._reference_key(style)
+        try:
+            result = reference_cache.get(key)
+        except TypeError:
+            # Unhashable (and therefore invalid) passage fields; not cached
+            return self._reference_string(style)
+        if result is None:
+            result = cache_string(key, self._reference_string(style))
+        return result
+
+    def _reference_key(self, style):
+        return (self.bd, self.start_book_n, self.start_chapter,
+                self.start_verse, self.end_book_n, self.end_chapter,
+                self.end_verse, style)
+
+    def _reference_string(self, style):
         if not self.is_valid():
             return 'Invalid passage'
-        # Create string
-        if self.start_book_n == self.end_book_n:
-            # Single-book passage
-            book_n = self.start_book_n
-            if self.bd.number_chapters[book_n] == 1:
-                # Single-chapter book
-                book = book_name(self.bd, book_n, abbreviated)
-                if self.start_verse == self.end_verse:
-                    return book + " " + str(self.start_verse)
-                elif self.start_verse == 1 and self.end_verse ==\
-                        self.bd.last_verses[book_n, 1]:
-                    return book
-                else:
-                    return book + " " + str(self.start_verse) + dash +\
-                        str(self.end_verse)
-            else:
-                # Multi-chapter book
-                if self.start_chapter == self.end_chapter:
-                    if book_n == 19:
-                        book = book_name(self.bd, book_n, abbreviated, True)
-                    else:
-                        book = book_name(self.bd, book_n, abbreviated)
-                    if self.start_verse == self.end_verse:
-                        return book + " " + str(self.start_chapter) + ":" +\
-                            str(self.start_verse)
-                    elif self.start_verse == 1 and self.end_verse ==\
-                            self.bd.last_verses[book_n, self.start_chapter]:
-                        return book + " " + str(self.start_chapter)
-                    else:
-                        return book + " " + str(self.start_chapter) + ":" +\
-                            str(self.start_verse) + dash + str(self.end_verse)
-                else:
-                    book = book_name(self.bd, book_n, abbreviated)
-                    if self.start_verse == 1 and self.end_verse ==\
-                            self.bd.last_verses[book_n, self.end_chapter]:
-                        if self.start_chapter == 1 and self.end_chapter ==\
-                                self.bd.number_chapters[book_n]:
-                            return book
-                        else:
-                            return book + " " + str(self.start_chapter) +\
-                                dash + str(self.end_chapter)
-                    else:
-                        return book + " " + str(self.start_chapter) + ":" +\
-                            str(self.start_verse) + dash +\
-                            str(self.end_chapter) + ":" + str(self.end_verse)
-        else:
-            first_book = book_name(self.bd, self.start_book_n, abbreviated)
-            last_book = book_name(self.bd, self.end_book_n, abbreviated)
-            if self.start_verse == 1 and self.end_verse ==\
-                    self.bd.last_verses[self.end_book_n, self.end_chapter]:
-                if self.end_chapter == self.bd.number_chapters[self.end_book_n]:
-                    # Whole books
-                    return first_book + dash + last_book
-                else:
-                    # Whole chapter reference
-                    return first_book + " " + str(self.start_chapter) + dash +\
-                        last_book + " " + str(self.end_chapter)
-            else:
-                return first_book + " " + str(self.start_chapter) + ":" +\
-                    str(self.start_verse) +\
-                    dash + last_book + " " + \
-                    str(self.end_chapter) + ":" + str(self.end_verse)
+        return style.render(self)
 
     def osis_reference(self):
         """
@@ -472,13 +437,146 @@ class Passage(object):
             bibledata.osis.normative_book_names[self.end_book_n] +\
             "." + str(self.end_chapter) + "." + str(self.end_verse)
 
+    def ordinal_range(self):
+        """
+        Return (start, end) tuple of verse ordinals for this passage; i.e. the
+        positions of its first and last verses within the whole bible, counting
+        from 0 and skipping missing verses. Consecutive verses always have
+        consecutive ordinals, so the passage has end - start + 1 verses.
+        """
+        return (verse_ordinal(self.bd, self.start_book_n, self.start_chapter,
+                              self.start_verse),
+                verse_ordinal(self.bd, self.end_book_n, self.end_chapter,
+                              self.end_verse))
+
+    def number_words(self, size_table=None):
+        """
+        Return number of words in this passage's text, as given by
+        'size_table' or the translation's size_table (see bibledata.text_size).
+        """
+        (start, end) = self.ordinal_range()
+        return self._size_table(size_table).words(start, end)
+
+    def number_characters(self, size_table=None):
+        """
+        Return number of characters in this passage's text, as given by
+        'size_table' or the translation's size_table (see bibledata.text_size).
+        """
+        (start, end) = self.ordinal_range()
+        return self._size_table(size_table).chars(start, end)
+
+    def _size_table(self, size_table):
+        if size_table is None:
+            size_table = getattr(self.bd, "size_table", None)
+        if size_table is None:
+            raise ValueError("No text size table available; pass size_table " +
+                             "or set one for this translation")
+        return size_table
+
+    def iter_chapters(self):
+        """
+        Generate (book_n, chapter) tuples for each chapter that this passage
+        includes any part of, in order.
+        """
+        first = self.bd.chapter_index[self.start_book_n, self.start_chapter]
+        last = self.bd.chapter_index[self.end_book_n, self.end_chapter]
+        for i in range(first, last + 1):
+            yield self.bd.chapter_list[i]
+
+    def iter_verses(self, ordinals=False):
+        """
+        Generate (book_n, chapter, verse) tuples for each verse in this
+        passage, in order and skipping missing verses. If ordinals=True, verse
+        ordinals (see Passage.ordinal_range) are generated instead.
+        """
+        if ordinals:
+            (start, end) = self.ordinal_range()
+            for ordinal in range(start, end + 1):
+                yield ordinal
+            return
+        for (book_n, chapter) in self.iter_chapters():
+            if book_n == self.start_book_n and chapter == self.start_chapter:
+                first = self.start_verse
+            else:
+                first = 1
+            if book_n == self.end_book_n and chapter == self.end_chapter:
+                last = self.end_verse
+            else:
+                last = self.bd.last_verses[book_n, chapter]
+            missing = self.bd.missing_verses.get((book_n, chapter), [])
+            for verse in range(first, last + 1):
+                if verse not in missing:
+                    yield (book_n, chapter, verse)
+
+    def verses_array(self):
+        """
+        Return array('I') of the ordinals of every verse in this passage, for
+        joining against per-verse data.
+        """
+        (start, end) = self.ordinal_range()
+        return array('I', range(start, end + 1))
+
+    def chunks(self, max_verses, align="verse"):
+        """
+        Generate consecutive sub-passages of at most 'max_verses' verses that
+        together make up this passage; such as for complying with limits on the
+        number of verses per request.
+
+        If align="chapter", chunks finish at the end of a chapter wherever
+        possible; chapters longer than max_verses are split between verses.
+
+        For example:
+        >>> [str(p) for p in Passage('Eph').chunks(50, align="chapter")]
+        ['Ephesians 1-2', 'Ephesians 3', 'Ephesians 4', 'Ephesians 5',
+            'Ephesians 6']
+        """
+        (start, end) = self.ordinal_range()
+        for (s, e) in chunk_ranges(self.bd, start, end, max_verses, align):
+            yield passage_from_ordinals(s, e, self.translation)
+
     def text(self, **kwargs):
         """
         Return the Bible text for this passage, AND a boolean indicating
-        whether passage was shortened to comply with API conditions.
+        whether passage was shortened to comply with API conditions. Raises
+        bibledata.transport.TextFetchError if the text can't be fetched
+        (unless raise_errors=False is given).
+
+        'timeout' (seconds) or 'deadline' (a time.time() value) limit how
+        long to wait for the text; see bibledata.esv.get_passage_text.
         """
         return self.bd.get_passage_text(self, **kwargs)
 
+    def iter_text(self, size="chapter", workers=DEFAULT_TEXT_WORKERS,
+                  **kwargs):
+        """
+        Generate the Bible text for this passage in pieces, in order, as soon
+        as each is available; such as for sending the start of a long passage
+        to a client before the rest has been fetched.
+
+        'size' is "chapter" to fetch a chapter at a time, or a number of
+        verses. Pieces are fetched up to 'workers' at a time, ahead of the
+        one being generated, and separated by the blank line that the API
+        puts between passages (given as a piece of its own). The passage is
+        truncated as for text, and a passage that is already cached whole is
+        given as a single piece. Other arguments are as for text; a 'timeout'
+        applies to the whole passage, not to each piece.
+
+        Returns a TextPieces iterator, whose 'truncated' attribute is as for
+        text.
+        """
+        kwargs = with_deadline(kwargs)
+        (parts, truncated) = text_parts(self, size, kwargs)
+        jobs = [(j > 0, p) for (j, p) in enumerate(parts)]
+        return TextPieces(iter_fetched(jobs, workers, kwargs), truncated)
+
+    def atext(self, **kwargs):
+        """
+        Coroutine version of text, for use with asyncio; see the aio module.
+        Concurrent requests for the same text share one HTTP request.
+        """
+        from .aio import get_passage_text
+        return get_passage_text(self, **kwargs)
+
     def __str__(self):
         """
         x.__str__() <==> str(x)
@@ -510,6 +608,61 @@ class Passage(object):
         """
         return int(self.number_verses())
 
+    def __getitem__(self, key):
+        """
+        x.__getitem__(i) <==> x[i]
+        Return i-th verse of passage as a single-verse Passage. A slice (such
+        as x[10:20]) always gives a Passage for the corresponding sub-passage,
+        or None if it contains no verses; as truncate does for a passage
+        truncated to nothing.
+        """
+        (start, end) = self.ordinal_range()
+        length = end - start + 1
+        if isinstance(key, slice):
+            (first, stop, step) = key.indices(length)
+            if step != 1:
+                raise ValueError("Passage slices cannot have a step")
+            if stop <= first:
+                return None
+            return passage_from_ordinals(start + first, start + stop - 1,
+                                         self.translation)
+        if key < 0:
+            key += length
+        if key < 0 or key >= length:
+            raise IndexError("Passage index out of range")
+        return passage_from_ordinals(start + key, start + key,
+                                     self.translation)
+
+    def __iter__(self):
+        """
+        x.__iter__() <==> iter(x)
+        Generate each verse of passage as a single-verse Passage.
+        """
+        for (book_n, chapter, verse) in self.iter_verses():
+            yield Passage(book_n, chapter, verse, translation=self.translation)
+
+    def __contains__(self, item):
+        """
+        x.__contains__(y) <==> y in x
+        Return True if 'item' (a Passage, or a (book_n, chapter, verse) tuple)
+        lies wholly within this passage.
+        """
+        if isinstance(item, Passage):
+            if not item.is_valid():
+                return False
+            (start, end) = item.ordinal_range()
+        elif isinstance(item, tuple) and len(item) == 3:
+            (book_n, chapter, verse) = item
+            if verse in self.bd.missing_verses.get((book_n, chapter), []) or\
+                    verse < 1 or verse > self.bd.last_verses.get(
+                        (book_n, chapter), 0):
+                return False
+            start = end = verse_ordinal(self.bd, book_n, chapter, verse)
+        else:
+            return False
+        (self_start, self_end) = self.ordinal_range()
+        return self_start <= start and end <= self_end
+
     def __repr__(self):
         """
         x.__repr__() <==> x
@@ -584,91 +737,181 @@ class PassageCollection(list):
                         passages.append(item)
         super(PassageCollection, self).__init__(passages)
 
-    def reference_string(self, abbreviated=False, dash="-"):
+    def reference_string(self, abbreviated=False, dash="-", style=None):
         """
         x.reference_string() <==> str(x)
-        Return string representation of passage references.
+        Return string representation of passage references. As for Passage
+        objects, 'style' may be given and strings are cached.
         """
-        # First checking easy options.
-        if len(self) == 0:
-            return ""
-        if len(self) == 1:
-            return str(self[0])
-
-        # Filtering out any invalid passages
-        passagelist = [p for p in self if p.is_valid()]
-        if len(passagelist) == 0:
-            return "Invalid passages"
-
-        # Group any consecutive single-book passages within same book
-        groups = []
-        i = 0
-        while i < len(passagelist):
-            group_start = i
-            book = passagelist[i].start_book_n
-            if passagelist[i].start_book_n == passagelist[i].end_book_n:
-                # Single-book passage. Find all other single-book passages
-                # within the same book
-                while i+1 < len(passagelist) and\
-                    passagelist[i+1].start_book_n == book and\
-                    passagelist[i+1].end_book_n == book:
-                    i += 1
-            group_end = i
-            groups.append(passagelist[group_start:group_end+1])
-            i += 1
+        if style is None:
+            style = default_style(abbreviated, dash)
+        return memoised_string(self, style, collection_reference_string, self,
+                               style)
 
-        # Create strings for each group (of consecutive passages within the
-        # same book)
-        group_strings = []
-        for group in groups:
-            if len(group) == 1:
-                group_strings.append(group[0].reference_string(abbreviated))
-                continue
-            else:
-                if group[0].start_book_n != group[0].end_book_n:
-                    raise Exception(
-                        "Error: Could not generate reference string. Multi-" +
-                        "book passage group but len(group) != 1.")
-            if group[0].bd.number_chapters[group[0].start_book_n] == 1:
-                # Group of reference(s) from a single-chapter book
-                parts = []
-                for p in group:
-                    if p.start_verse == p.end_verse:
-                        parts.append(str(p.start_verse))
-                    else:
-                        parts.append(str(p.start_verse) +
-                                     dash + str(p.end_verse))
-                book = book_name(
-                    group[0].bd, group[0].start_book_n, abbreviated)
-                group_strings.append(book + " " + ", ".join(parts))
-            else:
-                # Group of references from multi-chapter book
-                if (len(group) == 1 and group[0].complete_book() == 1.0):
-                    # Special case where there is only one reference in bunch,
-                    # and that reference is for a whole book.
-                    group_strings.append(
-                        book_name(group[0].bd,
-                        group[0].start_book_n,
-                        abbreviated))
-                else:
-                    # For readability and simplicity, this part of the algorithm
-                    # is within the MCBGroup class
-                    bunched = MCBGroup()
-                    for p in group:
-                        bunched.add(p)
-                    group_strings.append(
-                        bunched.reference_string(abbreviated, dash))
+    def _reference_key(self, style):
+        if len(self) > REFERENCE_CACHE_MAX_PASSAGES:
+            return None
+        return (PassageCollection, style) + tuple(
+            [p._reference_key(None) for p in self])
 
-        # Return completed string
-        return "; ".join(group_strings)
+    def ordinal_ranges(self):
+        """
+        Return list of (start, end) verse-ordinal tuples for the valid passages
+        in this collection, in collection order.
+        """
+        return [p.ordinal_range() for p in self if p.is_valid()]
 
-    def text(self, **kwargs):
+    def normalize(self):
+        """
+        Return new PassageCollection in bible order, with overlapping and
+        adjacent passages merged. Passages either side of a missing verse, or
+        either side of a chapter or book boundary, count as adjacent.
+
+        For example:
+        >>> PassageCollection(Passage('Rom',1,8,1,20), Passage('Rom',1,1,1,10),
+        ...     Passage('Rom',1,21)).normalize()
+        PassageCollection(Passage(book=45, start_chapter=1, start_verse=1,
+            end_book=45, end_chapter=1, end_verse=21))
+        """
+        return self._from_ranges(coalesce_ranges(self.ordinal_ranges()))
+
+    def union(self, other):
+        """
+        Return normalised PassageCollection of all verses that are in this
+        collection or in 'other' (a Passage or PassageCollection).
         """
-        Return the Bible text for these passages, AND a boolean indicating
-        whether passage was shortened to comply with API conditions.
+        return self._from_ranges(coalesce_ranges(
+            self.ordinal_ranges() + _ranges_of(other)))
+
+    def intersection(self, other):
+        """
+        Return normalised PassageCollection of all verses that are in both this
+        collection and 'other' (a Passage or PassageCollection).
+        """
+        return self._from_ranges(intersect_ranges(
+            coalesce_ranges(self.ordinal_ranges()),
+            coalesce_ranges(_ranges_of(other))))
+
+    def difference(self, other):
+        """
+        Return normalised PassageCollection of all verses that are in this
+        collection but not in 'other' (a Passage or PassageCollection).
+        """
+        return self._from_ranges(subtract_ranges(
+            coalesce_ranges(self.ordinal_ranges()),
+            coalesce_ranges(_ranges_of(other))))
+
+    def contains(self, other):
+        """
+        Return True if every verse of 'other' (a Passage or PassageCollection)
+        is in this collection.
+        """
+        return not subtract_ranges(coalesce_ranges(_ranges_of(other)),
+                                   coalesce_ranges(self.ordinal_ranges()))
+
+    def total_verses(self):
+        """
+        Return number of distinct verses in this collection; verses that
+        appear in more than one passage are only counted once.
+        """
+        return sum([e - s + 1 for (s, e) in
+                    coalesce_ranges(self.ordinal_ranges())])
+
+    def __getitem__(self, key):
+        """
+        x.__getitem__(i) <==> x[i]
+        As for list, but slices are returned as PassageCollection objects.
         """
-        return "\n\n".join(
-            [p.bd.get_passage_text(self, **kwargs) for p in self])
+        if isinstance(key, slice):
+            return PassageCollection(list.__getitem__(self, key))
+        return list.__getitem__(self, key)
+
+    def __getslice__(self, i, j):
+        # Python 2 only
+        return self.__getitem__(slice(i, j))
+
+    def _from_ranges(self, ranges):
+        """ Return PassageCollection built from list of ordinal ranges """
+        translation = self[0].translation if self else "ESV"
+        return PassageCollection([passage_from_ordinals(s, e, translation)
+                                  for (s, e) in ranges])
+
+    def chunks(self, max_verses, align="verse"):
+        """
+        Generate sub-passages of at most 'max_verses' verses for each passage
+        in the collection in turn. See Passage.chunks.
+        """
+        for passage in self:
+            for chunk in passage.chunks(max_verses, align):
+                yield chunk
+
+    def text(self, workers=DEFAULT_TEXT_WORKERS, batch=True,
+             raise_errors=True, **kwargs):
+        """
+        Return the Bible text for these passages (separated by blank lines),
+        AND a boolean indicating whether any passage was shortened to comply
+        with API conditions. Passages are fetched concurrently; see texts.
+        Raises the error of the first passage that couldn't be fetched, unless
+        raise_errors=False is given.
+        """
+        return join_texts(self.texts(workers, batch, **kwargs), raise_errors)
+
+    def texts(self, workers=DEFAULT_TEXT_WORKERS, batch=True, **kwargs):
+        """
+        Fetch the Bible text for each passage, using up to 'workers' threads
+        at once. Returns list of TextResult tuples of (passage, text,
+        truncated, error), in collection order; errors are not raised. Other
+        arguments are as for Passage.text; a 'timeout' applies to the
+        collection as a whole, so passages not fetched in time give a
+        FetchTimeoutError.
+
+        If 'batch' is True, passages are packed into as few API requests as
+        the API limits allow (see bibledata.esv.batch_passages). Passages in a
+        request that fails are fetched again one at a time, so that errors are
+        reported for the passages that caused them.
+        """
+        kwargs = with_deadline(kwargs)
+        if batch:
+            jobs = text_batches(self, kwargs)
+        else:
+            jobs = [[p] for p in self]
+        if workers <= 1 or len(jobs) <= 1:
+            results = [fetch_texts(j, kwargs) for j in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as \
+                    pool:
+                results = list(pool.map(lambda j: fetch_texts(j, kwargs),
+                                        jobs))
+        return [r for job_results in results for r in job_results]
+
+    def iter_text(self, size="chapter", workers=DEFAULT_TEXT_WORKERS,
+                  **kwargs):
+        """
+        Generate the Bible text for these passages in pieces, in order, with
+        pieces and passages separated by blank lines. See Passage.iter_text.
+        """
+        kwargs = with_deadline(kwargs)
+        jobs = []
+        truncated = False
+        for passage in self:
+            (parts, passage_truncated) = text_parts(passage, size, kwargs)
+            jobs.extend([(len(jobs) + j > 0, p) for (j, p) in
+                         enumerate(parts)])
+            truncated = truncated or passage_truncated
+        return TextPieces(iter_fetched(jobs, workers, kwargs), truncated)
+
+    def atext(self, **kwargs):
+        """
+        Coroutine version of text, for use with asyncio; passages are fetched
+        concurrently. See the aio module.
+        """
+        from .aio import collection_text
+        return collection_text(self, **kwargs)
+
+    def atexts(self, **kwargs):
+        """ Coroutine version of texts, for use with asyncio """
+        from .aio import collection_texts
+        return collection_texts(self, **kwargs)
 
     def __add__(self, other):
         """
@@ -831,6 +1074,31 @@ class PassageDelta(object):
             repr(self.passage_start)+")"
 
 
+class TextPieces(object):
+    """
+    Iterator over pieces of Bible text, as returned by iter_text. 'truncated'
+    is a boolean indicating whether the passage (or any passage of a
+    collection) was shortened to comply with API conditions; it is known
+    before any text is fetched.
+    """
+
+    def __init__(self, pieces, truncated):
+        self.pieces = pieces
+        self.truncated = truncated
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.pieces)
+
+    next = __next__  # Python 2
+
+    def close(self):
+        """ Stop fetching pieces that haven't been generated yet """
+        self.pieces.close()
+
+
 def get_passage_text(passage, **kwargs):
     """ Get text of supplied Passage object """
     warnings.warn("Deprecated function; use Passage.text or " +
@@ -839,6 +1107,49 @@ def get_passage_text(passage, **kwargs):
     return bible_data(translation).get_passage_text(passage, **kwargs)
 
 
+def passage_from_ordinals(start, end, translation="ESV"):
+    """
+    Return Passage object running from verse ordinal 'start' to verse ordinal
+    'end' (inclusive). See Passage.ordinal_range.
+    """
+    bd = bible_data(translation)
+    (start_book_n, start_chapter, start_verse) = ordinal_verse(bd, start)
+    (end_book_n, end_chapter, end_verse) = ordinal_verse(bd, end)
+    return Passage(start_book_n, start_chapter, start_verse, end_chapter,
+                   end_verse, end_book_n, translation)
+
+
+def render_many(collections, abbreviated=False, dash="-", style=None):
+    """
+    Return list of reference strings for an iterable of Passage,
+    PassageCollection or PassageArray objects, in the given style. This is a
+    convenience rather than a faster way of rendering: each collection is
+    rendered as by its reference_string function, except that a collection
+    that appears more than once in 'collections' is only rendered once.
+    """
+    if style is None:
+        style = default_style(abbreviated, dash)
+    rendered = {}
+    results = []
+    for collection in collections:
+        key = collection._reference_key(style)
+        try:
+            result = rendered.get(key) if key is not None else None
+        except TypeError:
+            result = key = None
+        if result is None:
+            result = collection.reference_string(style=style)
+            if key is not None:
+                rendered[key] = result
+        results.append(result)
+    return results
+
+
+def clear_reference_cache():
+    """ Empty the cache of rendered reference strings """
+    reference_cache.clear()
+
+
 # === Internal functions ===
 def book_name(bible_data, book_n, abbreviated=False, single_psalm=False):
     """ Return full or abbreviated book name. """
@@ -866,6 +1177,379 @@ def book_total_verses(bible_data, start_book_n, end_book_n=None):
     return total_verses
 
 
+def verse_ordinal(bible_data, book_n, chapter, verse):
+    """
+    Return position of given verse within the whole bible, counting from 0 and
+    skipping missing verses.
+    """
+    ordinal = bible_data.chapter_start_ordinals[
+        bible_data.chapter_index[book_n, chapter]] + verse - 1
+    for missing in bible_data.missing_verses.get((book_n, chapter), []):
+        if missing < verse:
+            ordinal -= 1
+    return ordinal
+
+
+def ordinal_verse(bible_data, ordinal):
+    """
+    Return (book_n, chapter, verse) tuple corresponding to the given verse
+    ordinal. Inverse of verse_ordinal.
+    """
+    if ordinal < 0 or ordinal >= bible_data.number_verses_in_bible:
+        raise InvalidPassageException(
+            "Verse ordinal " + str(ordinal) + " out of range")
+    i = bisect_right(bible_data.chapter_start_ordinals, ordinal) - 1
+    (book_n, chapter) = bible_data.chapter_list[i]
+    verse = ordinal - bible_data.chapter_start_ordinals[i] + 1
+    for missing in bible_data.missing_verses.get((book_n, chapter), []):
+        if missing <= verse:
+            verse += 1
+    return (book_n, chapter, verse)
+
+
+def coalesce_ranges(ranges):
+    """
+    Return sorted list of (start, end) ordinal ranges, with overlapping and
+    adjacent ranges merged.
+    """
+    merged = []
+    for (start, end) in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_ranges(ranges, positions):
+    """
+    Split ordinal ranges so that none of them contain any of the (sorted)
+    ordinals in 'positions', except at their start. For example, splitting at
+    bible_data.chapter_start_ordinals gives ranges within single chapters.
+    """
+    result = []
+    for (start, end) in ranges:
+        i = bisect_right(positions, start)
+        while i < len(positions) and positions[i] <= end:
+            result.append((start, positions[i] - 1))
+            start = positions[i]
+            i += 1
+        result.append((start, end))
+    return result
+
+
+def chunk_ranges(bible_data, start, end, max_verses, align="verse"):
+    """
+    Generate consecutive (start, end) ordinal ranges of at most 'max_verses'
+    verses, covering ordinals 'start' to 'end'. If align="chapter", ranges
+    finish at the end of a chapter wherever possible.
+    """
+    if max_verses < 1:
+        raise ValueError("max_verses must be at least 1")
+    if align not in ("verse", "chapter"):
+        raise ValueError("align must be 'verse' or 'chapter'")
+    chapter_starts = bible_data.chapter_start_ordinals
+    while start <= end:
+        last = start + max_verses - 1
+        if last >= end:
+            last = end
+        elif align == "chapter":
+            # Finish before the last chapter start that would fit
+            i = bisect_right(chapter_starts, last + 1) - 1
+            if chapter_starts[i] > start:
+                last = chapter_starts[i] - 1
+        yield (start, last)
+        start = last + 1
+
+
+def intersect_ranges(a, b):
+    """
+    Return intersection of two lists of ordinal ranges, each of which has
+    already been coalesced (see coalesce_ranges).
+    """
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start <= end:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def subtract_ranges(a, b):
+    """
+    Return ranges of 'a' with those in 'b' removed, where both are lists of
+    ordinal ranges that have already been coalesced (see coalesce_ranges).
+    """
+    result = []
+    j = 0
+    for (start, end) in a:
+        while j < len(b) and b[j][1] < start:
+            j += 1
+        k = j
+        while k < len(b) and b[k][0] <= end:
+            if b[k][0] > start:
+                result.append((start, b[k][0] - 1))
+            start = max(start, b[k][1] + 1)
+            k += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def fetch_text(passage, kwargs):
+    """ Return TextResult for a passage, fetched with Passage.text """
+    try:
+        (text, truncated) = passage.bd.get_passage_text(
+            passage, **dict(kwargs, raise_errors=True))
+        return TextResult(passage, text, truncated, None)
+    except (IOError, ValueError, KeyError) as e:
+        # Network and HTTP errors, or an invalid response
+        return TextResult(passage, None, None, e)
+
+
+def fetch_texts(passages, kwargs):
+    """
+    Return list of TextResult tuples for a list of passages, fetched with a
+    single request where possible; see PassageCollection.texts.
+    """
+    if len(passages) == 1:
+        return [fetch_text(passages[0], kwargs)]
+    try:
+        return [TextResult(p, text, truncated, None) for (p, (text, truncated))
+                in zip(passages, passages[0].bd.get_passages_text(
+                    passages, **dict(kwargs, raise_errors=True)))]
+    except (IOError, ValueError, KeyError):
+        return [fetch_text(p, kwargs) for p in passages]
+
+
+def text_parts(passage, size, kwargs):
+    """
+    Return tuple of (parts, truncated): the list of the sub-passages of
+    'passage' (truncated to API limits) that iter_text fetches in turn, and
+    whether 'passage' was truncated. 'size' is "chapter" or a number of
+    verses.
+    """
+    bd = passage.bd
+    trun_pass = bd.api_truncate(passage, kwargs.get("split", False))
+    truncated = trun_pass is not passage
+    if len(trun_pass) <= bd.API_CONSECUTIVE_VERSES and \
+            bd.cached_text(trun_pass, **kwargs) is not None:
+        return ([trun_pass], truncated)
+    (start, end) = trun_pass.ordinal_range()
+    if size == "chapter":
+        ranges = split_ranges([(start, end)], bd.chapter_start_ordinals)
+    else:
+        ranges = chunk_ranges(bd, start, end, size)
+    return ([passage_from_ordinals(s, e, passage.translation)
+             for (s, e) in ranges], truncated)
+
+
+def iter_fetched(jobs, workers, kwargs):
+    """
+    Generate text for a list of (separate, passage) tuples in order, fetching
+    up to 'workers' passages ahead with a thread pool. If 'separate' is true,
+    the translation's PASSAGE_SEPARATOR is generated before the passage's
+    text.
+    """
+    if workers <= 1:
+        for (separate, passage) in jobs:
+            if separate:
+                yield passage.bd.PASSAGE_SEPARATOR
+            yield passage.bd.get_passage_text(passage, **kwargs)[0]
+        return
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    jobs = iter(jobs)
+    try:
+        for (separate, passage) in islice(jobs, workers):
+            pending.append((separate, passage, pool.submit(
+                passage.bd.get_passage_text, passage, **kwargs)))
+        while pending:
+            (separate, passage, future) = pending.popleft()
+            # Keep the pool busy while this piece is being generated
+            for (s, p) in islice(jobs, 1):
+                pending.append((s, p, pool.submit(
+                    p.bd.get_passage_text, p, **kwargs)))
+            if separate:
+                yield passage.bd.PASSAGE_SEPARATOR
+            yield future.result()[0]
+    finally:
+        # Generator finished or closed early
+        for (separate, passage, future) in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def text_batches(passages, kwargs):
+    """
+    Return list of lists of passages that may be fetched together by
+    fetch_texts, in order. Passages are only batched with neighbouring
+    passages of the same translation.
+    """
+    batches = []
+    i = 0
+    while i < len(passages):
+        bd = passages[i].bd
+        j = i + 1
+        while j < len(passages) and passages[j].bd is bd:
+            j += 1
+        run = passages[i:j]
+        if hasattr(bd, "batch_passages"):
+            batches.extend([[run[k] for k in indices]
+                            for indices in bd.batch_passages(run, **kwargs)])
+        else:
+            batches.extend([[p] for p in run])
+        i = j
+    return batches
+
+
+def with_deadline(kwargs):
+    """
+    Return text 'kwargs' with any 'timeout' replaced by the equivalent
+    'deadline', so that every request made with them shares one deadline.
+    """
+    if kwargs.get("timeout") is None:
+        return kwargs
+    kwargs = dict(kwargs)
+    kwargs["deadline"] = deadline_after(kwargs.pop("timeout"),
+                                        kwargs.get("deadline"))
+    return kwargs
+
+
+def join_texts(results, raise_errors=True):
+    """
+    Return tuple of (text, truncated) for a list of TextResult tuples, with
+    texts separated by blank lines. If 'raise_errors' is True, the first
+    error is raised; otherwise FETCH_ERROR_TEXT is used in its place.
+    """
+    if raise_errors:
+        for r in results:
+            if r.error is not None:
+                raise r.error
+    text = "\n\n".join([
+        r.passage.bd.FETCH_ERROR_TEXT if r.error else r.text
+        for r in results])
+    return (text, any([r.truncated for r in results]))
+
+
+def memoised_string(owner, style, function, *args):
+    """
+    Return function(*args): the reference string of 'owner' (a Passage or
+    collection) in the given style, using the reference string cache entry for
+    it if there is one. Owners whose _reference_key is None aren't cached.
+    """
+    if REFERENCE_CACHE_SIZE <= 0:
+        return function(*args)
+    try:
+        key = owner._reference_key(style)
+        if key is None:
+            # Too large to cache
+            return function(*args)
+        result = reference_cache.get(key)
+    except TypeError:
+        # Unhashable (and therefore invalid) passage fields; not cached
+        return function(*args)
+    if result is None:
+        result = cache_string(key, function(*args))
+    return result
+
+
+def cache_string(key, result):
+    """
+    Store 'result' in the reference string cache against 'key', emptying the
+    cache first if it is full. Returns 'result'.
+    """
+    if len(reference_cache) >= REFERENCE_CACHE_SIZE:
+        reference_cache.clear()
+    reference_cache[key] = result
+    return result
+
+
+def collection_reference_string(passages, style):
+    """
+    Return string representation of a sequence of passage references in the
+    given ReferenceStyle; see PassageCollection.reference_string.
+    """
+    # First checking easy options.
+    if len(passages) == 0:
+        return ""
+    if len(passages) == 1:
+        return passages[0].reference_string(style=style)
+
+    # Filtering out any invalid passages
+    passagelist = [p for p in passages if p.is_valid()]
+    if len(passagelist) == 0:
+        return "Invalid passages"
+    if not style.compact:
+        return style.book_list_separator.join(
+            [style.render(p) for p in passagelist])
+
+    # Group any consecutive single-book passages within same book
+    groups = []
+    i = 0
+    while i < len(passagelist):
+        group_start = i
+        book = passagelist[i].start_book_n
+        if passagelist[i].start_book_n == passagelist[i].end_book_n:
+            # Single-book passage. Find all other single-book passages
+            # within the same book
+            while i+1 < len(passagelist) and\
+                passagelist[i+1].start_book_n == book and\
+                passagelist[i+1].end_book_n == book:
+                i += 1
+        group_end = i
+        groups.append(passagelist[group_start:group_end+1])
+        i += 1
+
+    # Create strings for each group (of consecutive passages within the
+    # same book)
+    group_strings = []
+    for group in groups:
+        if len(group) == 1:
+            group_strings.append(style.render(group[0]))
+            continue
+        else:
+            if group[0].start_book_n != group[0].end_book_n:
+                raise Exception(
+                    "Error: Could not generate reference string. Multi-" +
+                    "book passage group but len(group) != 1.")
+        if group[0].bd.number_chapters[group[0].start_book_n] == 1:
+            # Group of reference(s) from a single-chapter book
+            parts = [style.verses(p) for p in group]
+            group_strings.append(style.book(
+                group[0].start_book_n, style.list_separator.join(parts)))
+        else:
+            # Group of references from multi-chapter book. For readability and
+            # simplicity, this part of the algorithm is within the MCBGroup
+            # class
+            bunched = MCBGroup()
+            for p in group:
+                bunched.add(p)
+            group_strings.append(bunched.reference_string(style=style))
+
+    # Return completed string
+    return style.book_list_separator.join(group_strings)
+
+
+def _ranges_of(passages):
+    """
+    Return list of ordinal ranges for a Passage or for the valid passages in an
+    iterable of Passages.
+    """
+    if isinstance(passages, Passage):
+        passages = [passages]
+    if hasattr(passages, "ordinal_ranges"):
+        return passages.ordinal_ranges()
+    return [p.ordinal_range() for p in passages if p.is_valid()]
+
+
 def delta_chapter(chapter_difference, current_book_n, current_chapter,
                   current_verse, bible_data, finishes_at_end_of_chapter=False):
     new_chapter = current_chapter + chapter_difference
@@ -1001,38 +1685,12 @@ class MCBGroup(object):
             self.last_full_chapter_loc = -1
         self.order += 1
 
-    def reference_string(self, abbreviated, dash):
+    def reference_string(self, abbreviated=False, dash="-", style=None):
         if self.order == 0:
             # No passages have been added to bunch; return blank.
             return ""
-
-        # Helper functions
-        def full_ch_ref(reference, verse_encountered):
-            # Chapter string for references that are one or many full chapters
-            if verse_encountered:
-                if reference.start_chapter == reference.end_chapter:
-                    return str(reference.start_chapter) + ":" +\
-                        str(reference.start_verse) + dash +\
-                        str(reference.end_verse)
-                else:
-                    return str(reference.start_chapter) + ":" +\
-                        str(reference.start_verse) + dash +\
-                        str(reference.end_chapter) + ":" +\
-                        str(reference.end_verse)
-            else:
-                if reference.start_chapter == reference.end_chapter:
-                    return str(reference.start_chapter)
-                else:
-                    return str(reference.start_chapter) + dash +\
-                        str(reference.end_chapter)
-
-        def verses_only(reference):
-            # Verse string
-            if reference.start_verse == reference.end_verse:
-                return str(reference.start_verse)
-            else:
-                return str(reference.start_verse) + dash +\
-                    str(reference.end_verse)
+        if style is None:
+            style = default_style(abbreviated, dash)
 
         # List of passage bunches, sorted by order-of-addition
         ordered_bunches = sorted(list(self.bunches.items()), key=itemgetter(0))
@@ -1042,36 +1700,25 @@ class MCBGroup(object):
         verse_encountered = False
         for order, bunch in ordered_bunches:
             if self.full_chapter_bunch[order]:
-                # All passages in this bunch are for full chapters
-                textual_bunches.append(
-                    ", ".join([full_ch_ref(x, verse_encountered) for x
-                               in bunch]))
+                # All passages in this bunch are for full chapters. Once a
+                # verse reference has been given, chapters are given with
+                # verse numbers too, to avoid ambiguity.
+                if verse_encountered:
+                    textual_bunches.append(style.list_separator.join(
+                        [style.chapter_verses(x) for x in bunch]))
+                else:
+                    textual_bunches.append(style.list_separator.join(
+                        [style.chapters(x) for x in bunch]))
             else:
-                # Not a full-chapter bunch.
+                # Not a full-chapter bunch. NB: a bunch with only one passage
+                # may be over two or more chapters; otherwise it is
+                # guaranteed (via self.add() algorithm) to be within the same
+                # chapter.
                 verse_encountered = True
-                if len(bunch) == 1:
-                    # NB: this bunch may be over two or more chapters
-                    if bunch[0].start_chapter == bunch[0].end_chapter:
-                        textual_bunches.append(
-                            str(bunch[0].start_chapter) + ":" +
-                            verses_only(bunch[0]))
-                    else:
-                        textual_bunches.append(
-                            str(bunch[0].start_chapter) + ":" +
-                            str(bunch[0].start_verse) + dash +
-                            str(bunch[0].end_chapter) + ":" +
-                            str(bunch[0].end_verse))
-                else:
-                    # Guaranteed (via self.add() algorithm) to be within same
-                    # chapter
-                    textual_bunches.append(", ".join(
-                        [str(bunch[0].start_chapter) + ":" + verses_only(x) for
-                            x in bunch]))
-        if abbreviated:
-            book = bibledata.book_names[self.start_book_n][2]
-        else:
-            book = bibledata.book_names[self.start_book_n][1]
-        return book + " " + ", ".join(textual_bunches)
+                textual_bunches.append(style.list_separator.join(
+                    [style.chapter_verses(x) for x in bunch]))
+        return style.book(self.start_book_n,
+                          style.list_separator.join(textual_bunches))
 
 
 def check_reference(bd, start_book_n, start_chapter=None, start_verse=None,
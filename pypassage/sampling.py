@@ -0,0 +1,149 @@
+"""
+Random sampling of verses and fixed-length passages
+"""
+from bisect import bisect_right
+import random
+
+from .reference import Passage, PassageCollection, bible_data
+from .reference import coalesce_ranges, passage_from_ordinals
+from .reference import split_ranges
+
+BOUNDARIES = ("chapter", "book", None)
+
+
+class VerseSampler(object):
+    """
+    Draws random verses, or random passages of a fixed number of verses, from
+    the whole bible or from a given set of passages.
+
+    Every verse is equally likely to be picked unless 'weights' are given.
+    Each draw takes O(log n) time, using cumulative verse counts; missing
+    verses are never picked.
+    """
+
+    def __init__(self, within=None, weights=None, seed=None,
+                 translation="ESV"):
+        """
+        Initialise VerseSampler.
+
+        Arguments:
+        within -- Passage or PassageCollection to draw from; defaults to the
+            whole bible.
+        weights -- dict keyed to book_n giving the relative weight of each
+            verse in that book; books not in the dict have a weight of 1. For
+            example, {19: 5} makes each psalm verse five times as likely. A
+            passage is weighted by the book of its first verse; weights don't
+            stop passages spanning books when boundary=None.
+        seed -- seed for the sampler's random number generator.
+        """
+        self.translation = translation
+        self.bd = bible_data(translation)
+        self.random = random.Random(seed)
+        if within is None:
+            ranges = [(0, self.bd.number_verses_in_bible - 1)]
+        else:
+            if isinstance(within, Passage):
+                within = [within]
+            ranges = coalesce_ranges([p.ordinal_range() for p in within])
+        self.weights = weights or {}
+        self.ranges = ranges
+        # Cumulative weights of valid starting positions, keyed to
+        # (length, boundary)
+        self.tables = {}
+
+    def verse(self, seed=None):
+        """
+        Return a random verse as a single-verse Passage. If 'seed' is given,
+        the same verse is always returned for that seed.
+        """
+        return self.verses(1, seed)[0]
+
+    def verses(self, n, seed=None):
+        """ Return PassageCollection of 'n' random verses """
+        return self.passages(n, 1, None, seed)
+
+    def passage(self, length, boundary="chapter", seed=None):
+        """
+        Return random Passage of 'length' verses. If boundary="chapter" the
+        passage will not span two chapters; if boundary="book" it will not span
+        two books; and if boundary=None it may span anything (but will never
+        include verses outside the sampler's passages).
+        """
+        return self.passages(1, length, boundary, seed)[0]
+
+    def passages(self, n, length, boundary="chapter", seed=None):
+        """
+        Return PassageCollection of 'n' random passages of 'length' verses; see
+        passage.
+        """
+        return PassageCollection([
+            passage_from_ordinals(s, s + length - 1, self.translation)
+            for s in self.starts(n, length, boundary, seed)])
+
+    def starts(self, n, length=1, boundary="chapter", seed=None):
+        """
+        Return list of 'n' random starting verse ordinals for passages of
+        'length' verses; see passage.
+        """
+        if boundary not in BOUNDARIES:
+            raise ValueError("boundary must be 'chapter', 'book' or None")
+        if length < 1:
+            raise ValueError("length must be at least 1")
+        rng = self.random if seed is None else random.Random(seed)
+        (ranges, cumulative, weights) = self._table(length, boundary)
+        total = cumulative[-1]
+        if total <= 0:
+            raise ValueError("No passages of " + str(length) +
+                             " verses are available")
+        results = []
+        for _ in range(n):
+            if self.weights:
+                x = rng.random() * total
+            else:
+                x = rng.randrange(total)
+            i = bisect_right(cumulative, x)
+            if i >= len(ranges):
+                # Floating point rounding at the very top of the range
+                i = len(ranges) - 1
+                x = cumulative[i] - weights[i]
+            offset = int((x - cumulative[i] + weights[i] *
+                          (ranges[i][1] - ranges[i][0] + 1)) / weights[i])
+            results.append(ranges[i][0] + offset)
+        return results
+
+    def _table(self, length, boundary):
+        """
+        Return (ranges, cumulative, weights) for sampling starting positions:
+        ranges of valid starting ordinals, the cumulative weight up to and
+        including each range, and the weight per position in each range.
+        """
+        key = (length, boundary)
+        if key not in self.tables:
+            ranges = self.ranges
+            if boundary == "chapter":
+                ranges = split_ranges(ranges, self.bd.chapter_start_ordinals)
+            elif boundary == "book":
+                ranges = split_ranges(ranges, sorted(
+                    self.bd.book_start_ordinals.values()))
+            starts = [(s, e - length + 1) for (s, e) in ranges
+                      if e - s + 1 >= length]
+            if self.weights:
+                # Weights are per book of the first verse, so no range of
+                # starting positions may span two books
+                starts = split_ranges(starts, sorted(
+                    self.bd.book_start_ordinals.values()))
+            cumulative = []
+            weights = []
+            total = 0
+            for (s, e) in starts:
+                if self.weights:
+                    book_n = self.bd.chapter_list[bisect_right(
+                        self.bd.chapter_start_ordinals, s) - 1][0]
+                    weight = self.weights.get(book_n, 1)
+                else:
+                    weight = 1
+                total += weight * (e - s + 1)
+                cumulative.append(total)
+                weights.append(weight)
+            self.tables[key] = (starts, cumulative or [0], weights)
+        return self.tables[key]
@@ -0,0 +1,201 @@
+"""
+Similarity between large numbers of passages, measured by how many verses they
+share.
+
+Passages are handled as arrays of start and end verse ordinals (see
+Passage.ordinal_range), so that no per-pair Python objects are created.
+Functions accept either a sequence of Passage objects, or a (starts, ends)
+tuple of such arrays as returned by passage_arrays.
+
+Available metrics are:
+    "jaccard" -- shared verses / verses in either passage
+    "overlap" -- shared verses / verses in the shorter passage
+    "distance" -- number of verses from the end of one passage to the start of
+        the other, or 0 if they overlap (so adjacent passages are 1 apart)
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+
+from .index import PassageIndex
+from .reference import Passage
+
+try:
+    import numpy
+except ImportError:  # NumPy is only needed for dense matrices
+    numpy = None
+
+METRICS = ("jaccard", "overlap", "distance")
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def passage_arrays(passages):
+    """
+    Return (starts, ends) tuple of array('l') verse ordinals for a sequence of
+    Passage objects.
+    """
+    starts = array('l')
+    ends = array('l')
+    for passage in passages:
+        (start, end) = passage.ordinal_range()
+        starts.append(start)
+        ends.append(end)
+    return (starts, ends)
+
+
+def score(a, b, metric="jaccard"):
+    """ Return similarity metric for two (start, end) ordinal ranges """
+    _check_metric(metric)
+    return _score(a[0], a[1], b[0], b[1], metric)
+
+
+def overlap_matrix(a, b=None, metric="jaccard", dense=False,
+                   block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Return matrix of similarity scores between every passage in 'a' and every
+    passage in 'b'. If 'b' is not given, passages in 'a' are compared with
+    each other.
+
+    By default the matrix is sparse and is returned as a (rows, columns,
+    scores) tuple of arrays, listing only pairs of passages that share at
+    least one verse; these can be passed directly to
+    scipy.sparse.coo_matrix((scores, (rows, columns))). When comparing 'a' with
+    itself, pairs of a passage with itself are left out. The "distance" metric
+    is non-zero for almost every pair, so is only available as a dense matrix.
+
+    If dense=True, a NumPy array of shape (len(a), len(b)) is returned,
+    computed 'block_size' rows at a time.
+    """
+    _check_metric(metric)
+    (a_starts, a_ends) = _arrays(a)
+    same = b is None
+    (b_starts, b_ends) = (a_starts, a_ends) if same else _arrays(b)
+    if dense:
+        return _dense_matrix(a_starts, a_ends, b_starts, b_ends, metric,
+                             block_size)
+    if metric == "distance":
+        raise ValueError("The distance metric requires dense=True")
+    index = PassageIndex.from_arrays(b_starts, b_ends)
+    rows = array('l')
+    columns = array('l')
+    scores = array('d')
+    for i in range(len(a_starts)):
+        (s, e) = (a_starts[i], a_ends[i])
+        for j in sorted(index.overlapping((s, e))):
+            if same and i == j:
+                continue
+            rows.append(i)
+            columns.append(j)
+            scores.append(_score(s, e, b_starts[j], b_ends[j], metric))
+    return (rows, columns, scores)
+
+
+def top_k(a, b=None, k=10, metric="jaccard"):
+    """
+    Return list containing, for each passage in 'a', a list of up to 'k'
+    (index, score) tuples for the most similar passages in 'b'; best first.
+    If 'b' is not given, passages in 'a' are compared with each other (and
+    not with themselves).
+
+    For the jaccard and overlap metrics only passages sharing at least one
+    verse are included. For the distance metric the k nearest passages are
+    always returned.
+    """
+    _check_metric(metric)
+    (a_starts, a_ends) = _arrays(a)
+    same = b is None
+    (b_starts, b_ends) = (a_starts, a_ends) if same else _arrays(b)
+    index = PassageIndex.from_arrays(b_starts, b_ends)
+    if metric == "distance":
+        # Orderings of b by start and by end, for finding nearest neighbours
+        # either side of each passage in a
+        by_start = sorted(range(len(b_starts)), key=lambda j: b_starts[j])
+        sorted_starts = [b_starts[j] for j in by_start]
+        by_end = sorted(range(len(b_ends)), key=lambda j: b_ends[j])
+        sorted_ends = [b_ends[j] for j in by_end]
+    results = []
+    for i in range(len(a_starts)):
+        (s, e) = (a_starts[i], a_ends[i])
+        candidates = [(_score(s, e, b_starts[j], b_ends[j], metric), j)
+                      for j in index.overlapping((s, e))
+                      if not (same and i == j)]
+        if metric == "distance":
+            # Up to k (+1 if i itself might be found) passages after the end
+            # and before the start
+            extra = k + 1 if same else k
+            first = bisect_right(sorted_starts, e)
+            for j in by_start[first:first + extra]:
+                if not (same and i == j):
+                    candidates.append((b_starts[j] - e, j))
+            last = bisect_left(sorted_ends, s)
+            for j in by_end[max(0, last - extra):last]:
+                if not (same and i == j):
+                    candidates.append((s - b_ends[j], j))
+            best = heapq.nsmallest(k, candidates)
+        else:
+            best = heapq.nlargest(k, candidates, key=lambda x: (x[0], -x[1]))
+        results.append([(j, v) for (v, j) in best])
+    return results
+
+
+# === Internal functions ===
+def _check_metric(metric):
+    if metric not in METRICS:
+        raise ValueError("Unknown metric " + repr(metric) + "; must be one " +
+                         "of " + ", ".join(METRICS))
+
+
+def _arrays(passages):
+    """ Return (starts, ends) for sequence of Passages or (starts, ends) """
+    if isinstance(passages, tuple) and len(passages) == 2 and \
+            not isinstance(passages[0], Passage):
+        if len(passages[0]) != len(passages[1]):
+            raise ValueError("starts and ends must be the same length")
+        return passages
+    return passage_arrays(passages)
+
+
+def _score(a_start, a_end, b_start, b_end, metric):
+    shared = min(a_end, b_end) - max(a_start, b_start) + 1
+    if metric == "distance":
+        return max(0, b_start - a_end, a_start - b_end)
+    if shared <= 0:
+        return 0.0
+    a_length = a_end - a_start + 1
+    b_length = b_end - b_start + 1
+    if metric == "jaccard":
+        return float(shared) / (a_length + b_length - shared)
+    else:
+        return float(shared) / min(a_length, b_length)
+
+
+def _dense_matrix(a_starts, a_ends, b_starts, b_ends, metric, block_size):
+    if numpy is None:
+        raise ImportError("NumPy is required for dense similarity matrices")
+    a_starts = numpy.asarray(a_starts, dtype=numpy.int64)
+    a_ends = numpy.asarray(a_ends, dtype=numpy.int64)
+    b_starts = numpy.asarray(b_starts, dtype=numpy.int64)[numpy.newaxis, :]
+    b_ends = numpy.asarray(b_ends, dtype=numpy.int64)[numpy.newaxis, :]
+    b_lengths = b_ends - b_starts + 1
+    if metric == "distance":
+        result = numpy.empty((len(a_starts), b_starts.shape[1]),
+                             dtype=numpy.int64)
+    else:
+        result = numpy.empty((len(a_starts), b_starts.shape[1]),
+                             dtype=numpy.float64)
+    for first in range(0, len(a_starts), block_size):
+        s = a_starts[first:first + block_size, numpy.newaxis]
+        e = a_ends[first:first + block_size, numpy.newaxis]
+        block = result[first:first + block_size]
+        if metric == "distance":
+            numpy.maximum(numpy.maximum(b_starts - e, s - b_ends), 0,
+                          out=block)
+            continue
+        shared = numpy.minimum(e, b_ends) - numpy.maximum(s, b_starts) + 1
+        numpy.maximum(shared, 0, out=shared)
+        if metric == "jaccard":
+            denominator = (e - s + 1) + b_lengths - shared
+        else:
+            denominator = numpy.minimum(e - s + 1, b_lengths)
+        numpy.divide(shared, denominator, out=block)
+    return result
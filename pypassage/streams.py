@@ -0,0 +1,203 @@
+"""
+Iterator-based set operations over sorted streams of passages, and an external
+merge sort for putting very large streams into order using bounded memory.
+
+Streams are iterables of inclusive (start, end) verse-ordinal tuples (see
+Passage.ordinal_range), sorted by start. Use to_ranges and to_passages to
+convert from and to Passage objects. Nothing is held in memory beyond the
+current item of each stream, so these functions can be chained over inputs of
+any size. For example, to find which parts of a reading plan have not yet been
+read:
+    unread = difference(to_ranges(plan), external_sort(to_ranges(log)))
+"""
+from array import array
+from heapq import merge as _heapq_merge
+import tempfile
+
+from .reference import passage_from_ordinals
+
+# Array typecode used to pack ranges into temporary files
+RUN_TYPECODE = 'i'
+# Default number of ranges held in memory (and written to each temporary run)
+# by external_sort
+DEFAULT_RUN_SIZE = 1000000
+# Number of ranges read from each temporary run at a time
+READ_BLOCK_SIZE = 8192
+
+
+def to_ranges(passages):
+    """ Yield (start, end) verse-ordinal tuples for an iterable of Passages """
+    for passage in passages:
+        yield passage.ordinal_range()
+
+
+def to_passages(ranges, translation="ESV"):
+    """ Yield Passage objects for an iterable of verse-ordinal ranges """
+    for (start, end) in ranges:
+        yield passage_from_ordinals(start, end, translation)
+
+
+def merge(*streams):
+    """
+    Yield all ranges from the given sorted streams, in sorted order (k-way
+    merge).
+    """
+    return _heapq_merge(*[_checked(s) for s in streams])
+
+
+def coalesce(stream):
+    """
+    Yield ranges from a sorted stream with overlapping and adjacent ranges
+    merged.
+    """
+    stream = iter(_checked(stream))
+    for (start, end) in stream:
+        break
+    else:
+        return
+    for (s, e) in stream:
+        if s <= end + 1:
+            if e > end:
+                end = e
+        else:
+            yield (start, end)
+            (start, end) = (s, e)
+    yield (start, end)
+
+
+def union(*streams):
+    """ Yield coalesced union of the given sorted streams """
+    return coalesce(merge(*streams))
+
+
+def intersection(*streams):
+    """
+    Yield coalesced ranges of verses present in every one of the given sorted
+    streams.
+    """
+    if not streams:
+        return iter(())
+    result = coalesce(streams[0])
+    for stream in streams[1:]:
+        result = _intersect_two(result, coalesce(stream))
+    return result
+
+
+def difference(stream, *others):
+    """
+    Yield coalesced ranges of verses in the sorted 'stream' that are not in
+    any of the 'others' sorted streams.
+    """
+    if not others:
+        return coalesce(stream)
+    return _subtract(coalesce(stream), union(*others))
+
+
+def external_sort(ranges, run_size=DEFAULT_RUN_SIZE, dir=None):
+    """
+    Yield the given ranges (in any order) sorted by start, holding at most
+    'run_size' ranges in memory at once. Sorted runs of ranges are packed into
+    anonymous temporary files (in directory 'dir', if given) and then merged.
+    Values must fit within a C int; both verse ordinals and Passage.setint()
+    integers do.
+    """
+    runs = []
+    try:
+        buffer = []
+        for item in ranges:
+            buffer.append(item)
+            if len(buffer) >= run_size:
+                runs.append(_write_run(buffer, dir))
+                buffer = []
+        if not runs:
+            # Everything fits in memory; no need for temporary files
+            buffer.sort()
+            for item in buffer:
+                yield item
+            return
+        if buffer:
+            runs.append(_write_run(buffer, dir))
+            buffer = []
+        for item in _heapq_merge(*[_read_run(f) for f in runs]):
+            yield item
+    finally:
+        for f in runs:
+            f.close()
+
+
+# === Internal functions ===
+def _checked(stream):
+    """ Pass through stream, raising ValueError if it is not sorted """
+    last = None
+    for item in stream:
+        if last is not None and item[0] < last:
+            raise ValueError("Stream is not sorted: range starting " +
+                             str(item[0]) + " came after " + str(last))
+        last = item[0]
+        yield item
+
+
+def _intersect_two(a, b):
+    a = iter(a)
+    b = iter(b)
+    try:
+        (a_start, a_end) = next(a)
+        (b_start, b_end) = next(b)
+        while True:
+            start = max(a_start, b_start)
+            end = min(a_end, b_end)
+            if start <= end:
+                yield (start, end)
+            if a_end < b_end:
+                (a_start, a_end) = next(a)
+            else:
+                (b_start, b_end) = next(b)
+    except StopIteration:
+        return
+
+
+def _subtract(a, b):
+    b = iter(b)
+    current = next(b, None)
+    for (start, end) in a:
+        while current is not None and current[1] < start:
+            current = next(b, None)
+        while current is not None and current[0] <= end:
+            if current[0] > start:
+                yield (start, current[0] - 1)
+            start = max(start, current[1] + 1)
+            if current[1] > end:
+                break
+            current = next(b, None)
+        if start <= end:
+            yield (start, end)
+
+
+def _write_run(buffer, dir):
+    """ Sort buffer and write it to a temporary file as packed integers """
+    buffer.sort()
+    packed = array(RUN_TYPECODE)
+    for (start, end) in buffer:
+        packed.append(start)
+        packed.append(end)
+    f = tempfile.TemporaryFile(dir=dir)
+    packed.tofile(f)
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    """ Yield ranges from a temporary file written by _write_run """
+    while True:
+        block = array(RUN_TYPECODE)
+        try:
+            block.fromfile(f, 2 * READ_BLOCK_SIZE)
+        except EOFError:
+            # Partial final block; whatever could be read has been appended
+            pass
+        if not block:
+            return
+        for i in range(0, len(block), 2):
+            yield (block[i], block[i+1])
+        if len(block) < 2 * READ_BLOCK_SIZE:
+            return
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+House styles for reference strings.
+
+A ReferenceStyle is compiled once into a string template for each shape of
+passage (single verse, verse range, whole chapter, whole book, etc.), so that
+rendering a passage only needs to pick a template and fill in its numbers.
+Styles are passed as the 'style' argument of Passage.reference_string and
+PassageCollection.reference_string; for example:
+>>> Passage('Jn',3,16).reference_string(style=OSIS)
+'John.3.16'
+>>> PassageCollection(Passage('Jn',3,16), Passage('Jn',4)).reference_string(
+...     style=DOTTED)
+'Jn 3.16, 4.1-54'
+"""
+from .bibledata import book_names, osis, usfm
+
+NAMES = {
+    "full": dict([(n, names[1]) for (n, names) in book_names.items()]),
+    "abbreviated": dict([(n, names[2]) for (n, names) in book_names.items()]),
+    "osis": osis.normative_book_names,
+    "usfm": usfm.book_ids,
+}
+
+
+class ReferenceStyle(object):
+    """
+    Specification of how reference strings are written, compiled into
+    templates when initialised.
+    """
+
+    def __init__(self, names="full", dash="-", chapter_separator=":",
+                 book_separator=" ", list_separator=", ",
+                 book_list_separator="; ", single_psalm=True, compact=True,
+                 repeat_book=False):
+        """
+        Initialise and compile style.
+
+        Arguments:
+        names -- "full" (e.g. "John"), "abbreviated" ("Jn"), "osis" ("John"),
+            "usfm" ("JHN"), or a dict keyed to book_n giving book names (books
+            not in the dict use their full names).
+        dash -- string between the start and end of a range
+        chapter_separator -- string between chapter and verse numbers
+        book_separator -- string between book name and chapter number
+        list_separator -- string between passages from the same book
+        book_list_separator -- string between passages from different books
+        single_psalm -- if True, full names use "Psalm" rather than "Psalms"
+            for passages within a single psalm.
+        compact -- if True, whole chapters and books are given without verse
+            numbers (e.g. "John 3" rather than "John 3:1-36"), chapter
+            numbers are left out for single-chapter books, and consecutive
+            passages from the same book share one book name. If False, every
+            passage is given in full.
+        repeat_book -- if True, the book name is repeated at the end of every
+            range (e.g. "John.3.16-John.3.18").
+        """
+        if not isinstance(names, dict):
+            if names not in NAMES:
+                raise ValueError("names must be a dict or one of " +
+                                 ", ".join(sorted(NAMES)))
+            single_psalm = single_psalm and names == "full"
+            names = NAMES[names]
+        self.dash = dash
+        self.chapter_separator = chapter_separator
+        self.book_separator = book_separator
+        self.list_separator = list_separator
+        self.book_list_separator = book_list_separator
+        self.compact = compact
+        self.repeat_book = repeat_book
+
+        # Book names as lists indexed by book_n; chapter_names is used for
+        # passages within a single chapter
+        self.names = [None] + [names.get(n, NAMES["full"][n])
+                               for n in range(1, 67)]
+        self.chapter_names = list(self.names)
+        if single_psalm:
+            self.chapter_names[19] = "Psalm"
+
+        # Templates. Arguments are the book name followed by chapter and verse
+        # numbers, as appropriate.
+        (b, c, d) = (_escape(book_separator), _escape(chapter_separator),
+                     _escape(dash))
+        self.t_verse = "%s" + b + "%d" + c + "%d"
+        self.t_verses = "%s" + b + "%d" + c + "%d" + d + "%d"
+        self.t_chapter = "%s" + b + "%d"
+        self.t_chapters = "%s" + b + "%d" + d + "%d"
+        self.t_span = "%s" + b + "%d" + c + "%d" + d + "%d" + c + "%d"
+        self.t_books = "%s" + d + "%s"
+        self.t_book_chapters = "%s" + b + "%d" + d + "%s" + b + "%d"
+        self.t_book_span = "%s" + b + "%d" + c + "%d" + d + "%s" + b + "%d" + \
+            c + "%d"
+        # Templates without book names (for lists of passages from one book)
+        self.t_verse_only = "%d"
+        self.t_verses_only = "%d" + d + "%d"
+        self.t_chapter_verse = "%d" + c + "%d"
+        self.t_chapter_verses = "%d" + c + "%d" + d + "%d"
+        self.t_chapters_only = "%d" + d + "%d"
+        self.t_span_only = "%d" + c + "%d" + d + "%d" + c + "%d"
+
+        self.render = self._compile_render()
+
+    def _compile_render(self):
+        """
+        Return function rendering a valid Passage in this style. Templates and
+        names are bound as closure variables, for speed.
+        """
+        names = self.names
+        chapter_names = self.chapter_names
+        (t_verse, t_verses, t_chapter, t_chapters, t_span, t_books,
+         t_book_chapters, t_book_span) = (
+            self.t_verse, self.t_verses, self.t_chapter, self.t_chapters,
+            self.t_span, self.t_books, self.t_book_chapters, self.t_book_span)
+        repeat_book = self.repeat_book
+
+        def render_full(passage):
+            book_n = passage.start_book_n
+            end_book_n = passage.end_book_n
+            c = passage.start_chapter
+            v = passage.start_verse
+            ec = passage.end_chapter
+            ev = passage.end_verse
+            if book_n != end_book_n or repeat_book and (c != ec or v != ev):
+                return t_book_span % (names[book_n], c, v, names[end_book_n],
+                                      ec, ev)
+            elif c != ec:
+                return t_span % (names[book_n], c, v, ec, ev)
+            elif v != ev:
+                return t_verses % (chapter_names[book_n], c, v, ev)
+            else:
+                return t_verse % (chapter_names[book_n], c, v)
+
+        def render_compact(passage):
+            bd = passage.bd
+            book_n = passage.start_book_n
+            end_book_n = passage.end_book_n
+            c = passage.start_chapter
+            v = passage.start_verse
+            ec = passage.end_chapter
+            ev = passage.end_verse
+            if book_n == end_book_n:
+                if bd.number_chapters[book_n] == 1:
+                    # Single-chapter book; verse numbers only
+                    if v == ev:
+                        return t_chapter % (names[book_n], v)
+                    elif v == 1 and ev == bd.last_verses[book_n, 1]:
+                        return names[book_n]
+                    else:
+                        return t_chapters % (names[book_n], v, ev)
+                elif c == ec:
+                    if v == ev:
+                        return t_verse % (chapter_names[book_n], c, v)
+                    elif v == 1 and ev == bd.last_verses[book_n, c]:
+                        return t_chapter % (chapter_names[book_n], c)
+                    else:
+                        return t_verses % (chapter_names[book_n], c, v, ev)
+                elif v == 1 and ev == bd.last_verses[book_n, ec]:
+                    if c == 1 and ec == bd.number_chapters[book_n]:
+                        return names[book_n]
+                    else:
+                        return t_chapters % (names[book_n], c, ec)
+                else:
+                    return t_span % (names[book_n], c, v, ec, ev)
+            elif v == 1 and ev == bd.last_verses[end_book_n, ec]:
+                if ec == bd.number_chapters[end_book_n]:
+                    # Whole books
+                    return t_books % (names[book_n], names[end_book_n])
+                else:
+                    return t_book_chapters % (names[book_n], c,
+                                              names[end_book_n], ec)
+            else:
+                return t_book_span % (names[book_n], c, v, names[end_book_n],
+                                      ec, ev)
+
+        if self.compact:
+            return render_compact
+        return render_full
+
+    def verses(self, passage):
+        """
+        Return verse numbers of a passage within a single chapter, without
+        book name or chapter number.
+        """
+        if passage.start_verse == passage.end_verse:
+            return self.t_verse_only % passage.start_verse
+        return self.t_verses_only % (passage.start_verse, passage.end_verse)
+
+    def chapter_verses(self, passage):
+        """
+        Return chapter and verse numbers of a passage, without book name.
+        """
+        if passage.start_chapter != passage.end_chapter:
+            return self.t_span_only % (passage.start_chapter,
+                                       passage.start_verse,
+                                       passage.end_chapter, passage.end_verse)
+        if passage.start_verse == passage.end_verse:
+            return self.t_chapter_verse % (passage.start_chapter,
+                                           passage.start_verse)
+        return self.t_chapter_verses % (passage.start_chapter,
+                                        passage.start_verse, passage.end_verse)
+
+    def chapters(self, passage):
+        """
+        Return chapter numbers of a passage of whole chapters, without book
+        name.
+        """
+        if passage.start_chapter == passage.end_chapter:
+            return self.t_verse_only % passage.start_chapter
+        return self.t_chapters_only % (passage.start_chapter,
+                                       passage.end_chapter)
+
+    def book(self, book_n, verses):
+        """ Return book name followed by chapter and verse string """
+        return self.names[book_n] + self.book_separator + verses
+
+
+def default_style(abbreviated=False, dash="-"):
+    """
+    Return the (compiled, and shared) style used by reference_string for the
+    given 'abbreviated' and 'dash' arguments.
+    """
+    try:
+        return _default_styles[abbreviated, dash]
+    except KeyError:
+        style = _default_styles[abbreviated, dash] = ReferenceStyle(
+            "abbreviated" if abbreviated else "full", dash)
+        return style
+
+
+# === Internal functions ===
+_default_styles = {}
+
+
+def _escape(s):
+    return s.replace("%", "%%")
+
+
+# === Predefined styles ===
+STANDARD = default_style()
+ABBREVIATED = default_style(abbreviated=True)
+EN_DASH = default_style(dash=u"–")
+ABBREVIATED_EN_DASH = default_style(abbreviated=True, dash=u"–")
+DOTTED = ReferenceStyle("abbreviated", chapter_separator=".")
+NO_SPACE = ReferenceStyle("abbreviated", book_separator="",
+                          list_separator=",", book_list_separator=";")
+OSIS = ReferenceStyle("osis", book_separator=".", chapter_separator=".",
+                      list_separator=" ", book_list_separator=" ",
+                      compact=False, repeat_book=True)
+USFM = ReferenceStyle("usfm", compact=False)
@@ -0,0 +1,275 @@
+"""
+Compact sets of verses, such as for tracking which verses a reader has read
+"""
+import binascii
+
+from .reference import Passage, PassageCollection, bible_data
+from .reference import passage_from_ordinals
+
+# Header bytes for VerseSet.compress formats
+FORMAT_BITMAP = b"\x00"
+FORMAT_RUNS = b"\x01"
+
+
+class VerseSet(object):
+    """
+    Set of verses, stored as a bitmap with one bit per verse in the bible (bit
+    i of the bitmap is verse ordinal i; see Passage.ordinal_range). The ESV
+    bitmap is under 4KB; VerseSet.compress gives a much smaller run-length
+    encoded form for storage.
+    """
+
+    def __init__(self, passages=None, translation="ESV"):
+        """
+        Initialise VerseSet, optionally adding a Passage, PassageCollection or
+        other iterable of Passage objects to it.
+        """
+        self.translation = translation
+        self.bd = bible_data(translation)
+        self.bits = bytearray((self.bd.number_verses_in_bible + 7) // 8)
+        if passages is not None:
+            self.add(passages)
+
+    def add(self, passages):
+        """
+        Add all verses of a Passage, PassageCollection, or other iterable of
+        Passage objects to set.
+        """
+        for (start, end) in _ranges_of(passages):
+            self.add_range(start, end)
+
+    def remove(self, passages):
+        """
+        Remove all verses of a Passage, PassageCollection, or other iterable of
+        Passage objects from set.
+        """
+        for (start, end) in _ranges_of(passages):
+            self.add_range(start, end, False)
+
+    def add_range(self, start, end, value=True):
+        """
+        Add (or, if value=False, remove) all verses from verse ordinal 'start'
+        to verse ordinal 'end' inclusive.
+        """
+        if start < 0 or end >= self.bd.number_verses_in_bible:
+            raise ValueError("Verse ordinals out of range")
+        first_byte = start >> 3
+        last_byte = end >> 3
+        first_mask = (0xFF << (start & 7)) & 0xFF
+        last_mask = 0xFF >> (7 - (end & 7))
+        if first_byte == last_byte:
+            masks = [(first_byte, first_mask & last_mask)]
+        else:
+            masks = [(first_byte, first_mask), (last_byte, last_mask)]
+            # Whole bytes in between
+            fill = b"\xff" if value else b"\x00"
+            self.bits[first_byte+1:last_byte] = fill * (last_byte-first_byte-1)
+        for (i, mask) in masks:
+            if value:
+                self.bits[i] |= mask
+            else:
+                self.bits[i] &= ~mask & 0xFF
+
+    def ranges(self):
+        """ Yield (start, end) verse-ordinal tuples for each run of verses """
+        n = self._int()
+        position = 0
+        while n:
+            zeros = (n & -n).bit_length() - 1
+            n >>= zeros
+            position += zeros
+            ones = (n ^ (n + 1)).bit_length() - 1
+            yield (position, position + ones - 1)
+            n >>= ones
+            position += ones
+
+    def passages(self):
+        """
+        Return PassageCollection of the passages in this set, in bible order.
+        """
+        return PassageCollection([
+            passage_from_ordinals(s, e, self.translation)
+            for (s, e) in self.ranges()])
+
+    def number_verses(self, per_book=False, per_chapter=False):
+        """
+        Return number of verses in set as an integer, or if per_book=True, as a
+        dictionary keyed to book_n, or if per_chapter=True, as a dictionary
+        keyed to (book_n, chapter).
+        """
+        n = self._int()
+        if per_chapter:
+            starts = self.bd.chapter_start_ordinals
+            keys = self.bd.chapter_list
+        elif per_book:
+            keys = sorted(self.bd.book_start_ordinals)
+            starts = [self.bd.book_start_ordinals[k] for k in keys]
+        else:
+            return _popcount(n)
+        counts = {}
+        ends = starts[1:] + [self.bd.number_verses_in_bible]
+        for (key, start, end) in zip(keys, starts, ends):
+            counts[key] = _popcount((n >> start) & ((1 << (end - start)) - 1))
+        return counts
+
+    def coverage(self, per_book=False, per_chapter=False):
+        """
+        Return proportion of bible represented by this set, or if
+        per_book=True, a dictionary of proportions keyed to book_n, or if
+        per_chapter=True, a dictionary of proportions keyed to
+        (book_n, chapter).
+        """
+        if per_chapter:
+            counts = self.number_verses(per_chapter=True)
+            starts = self.bd.chapter_start_ordinals + \
+                [self.bd.number_verses_in_bible]
+            return dict([(key, float(counts[key]) / (starts[i+1] - starts[i]))
+                         for (i, key) in enumerate(self.bd.chapter_list)])
+        elif per_book:
+            counts = self.number_verses(per_book=True)
+            return dict([
+                (book_n, float(n) / self.bd.number_verses_in_book[book_n])
+                for (book_n, n) in counts.items()])
+        else:
+            return float(self.number_verses()) / \
+                self.bd.number_verses_in_bible
+
+    def compress(self):
+        """
+        Return compact bytes representation of set, suitable for storage.
+        Consecutive runs of verses are stored as variable-length integers,
+        falling back to a plain bitmap where that is smaller.
+        """
+        runs = bytearray(FORMAT_RUNS)
+        last_end = -1
+        for (start, end) in self.ranges():
+            _write_varint(runs, start - last_end - 1)
+            _write_varint(runs, end - start)
+            last_end = end
+            if len(runs) > len(self.bits):
+                return FORMAT_BITMAP + bytes(self.bits)
+        return bytes(runs)
+
+    @classmethod
+    def decompress(cls, data, translation="ESV"):
+        """ Return VerseSet from bytes created by VerseSet.compress """
+        verse_set = cls(translation=translation)
+        data = bytearray(data)
+        header = data[0:1]
+        if header == FORMAT_BITMAP:
+            if len(data) - 1 != len(verse_set.bits):
+                raise ValueError("Bitmap is the wrong length")
+            verse_set.bits[:] = data[1:]
+        elif header == FORMAT_RUNS:
+            i = 1
+            last_end = -1
+            while i < len(data):
+                (gap, i) = _read_varint(data, i)
+                (length, i) = _read_varint(data, i)
+                start = last_end + 1 + gap
+                last_end = start + length
+                verse_set.add_range(start, last_end)
+        else:
+            raise ValueError("Unrecognised VerseSet format")
+        return verse_set
+
+    def copy(self):
+        """ Return copy of this set """
+        verse_set = self.__class__(translation=self.translation)
+        verse_set.bits[:] = self.bits
+        return verse_set
+
+    def _int(self):
+        """ Return bitmap as an integer, with bit i being verse ordinal i """
+        if hasattr(int, "from_bytes"):
+            return int.from_bytes(bytes(self.bits), "little")
+        # Python 2
+        return int(binascii.hexlify(bytes(self.bits[::-1])) or b"0", 16)
+
+    def _from_int(self, n):
+        verse_set = self.__class__(translation=self.translation)
+        if hasattr(n, "to_bytes"):
+            verse_set.bits[:] = n.to_bytes(len(self.bits), "little")
+        else:  # Python 2
+            verse_set.bits[:] = binascii.unhexlify(
+                "%0*x" % (2 * len(self.bits), n))[::-1]
+        return verse_set
+
+    def union(self, other):
+        """ Return VerseSet of verses in either this set or 'other' """
+        return self._from_int(self._int() | other._int())
+
+    def intersection(self, other):
+        """ Return VerseSet of verses in both this set and 'other' """
+        return self._from_int(self._int() & other._int())
+
+    def difference(self, other):
+        """ Return VerseSet of verses in this set but not in 'other' """
+        return self._from_int(self._int() & ~other._int())
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __contains__(self, passage):
+        """
+        x.__contains__(y) <==> y in x
+        Return True if every verse of the given Passage is in this set.
+        """
+        n = self._int()
+        for (start, end) in _ranges_of(passage):
+            mask = ((1 << (end - start + 1)) - 1) << start
+            if n & mask != mask:
+                return False
+        return True
+
+    def __len__(self):
+        """
+        x.__len__() <==> len(x)
+        Return number of verses in set.
+        """
+        return self.number_verses()
+
+    def __eq__(self, other):
+        if not isinstance(other, VerseSet):
+            return False
+        return self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "VerseSet(" + repr(self.passages()) + ")"
+
+
+# === Internal functions ===
+def _ranges_of(passages):
+    """ Return ordinal ranges for a Passage or iterable of Passages """
+    if isinstance(passages, Passage):
+        passages = [passages]
+    return [p.ordinal_range() for p in passages]
+
+
+def _popcount(n):
+    return bin(n).count("1")
+
+
+def _write_varint(buffer, n):
+    """ Append non-negative integer to bytearray as a LEB128 varint """
+    while n >= 0x80:
+        buffer.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buffer.append(n)
+
+
+def _read_varint(data, i):
+    """ Return (integer, next index) for LEB128 varint at data[i] """
+    n = 0
+    shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (n, i)
+        shift += 7
@@ -7,7 +7,11 @@ setup(
 	version = '1.3',
 	install_requires=[
           'future',
+          'futures; python_version<"3"',
       ],
+	extras_require={
+          'pandas': ['pandas'],
+      },
 	author = 'Cameron Oliver',
 	author_email = 'cameron.oliver@gmail.com',
 	url = 'https://github.com/col16/pypassage',
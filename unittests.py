@@ -1,11 +1,56 @@
+# -*- coding: utf-8 -*-
 from pypassage.reference import PassageCollection as C
 from pypassage.reference import Passage as P
 from pypassage.reference import PassageDelta as D
 from pypassage.reference import InvalidPassageException
 from pypassage.reference import passages_from_string
+from pypassage.reference import passage_from_ordinals
+from pypassage.reference import render_many
+from pypassage import reference
+from pypassage import styles
+from pypassage.index import PassageIndex
+from pypassage import index as index_module
+from pypassage import streams
+from pypassage.verseset import VerseSet
+from pypassage.plans import reading_plan
+from pypassage import similarity
+from pypassage.coverage import Coverage
+from pypassage.sampling import VerseSampler
+from pypassage.bibledata.text_size import TextSizeTable
+from pypassage.columnar import PassageArray
 import pypassage.bibledata.esv as bd
 from pypassage.bibledata import text_cache
+from pypassage.bibledata.transport import HTTPTransport, StubTransport
+from pypassage.bibledata.transport import HTTPStatusError, NetworkError
+from pypassage.bibledata.transport import FetchTimeoutError, CircuitOpenError
+from pypassage.bibledata.transport import InvalidResponseError
+from pypassage.bibledata.transport import RetryTransport
+from pypassage.bibledata.transport import CircuitBreakerTransport
+from pypassage.bibledata.transport import HedgingTransport
+from pypassage.bibledata.rate_limit import RateLimiter, RateLimitedTransport
+from pypassage.bibledata.rate_limit import INTERACTIVE, BACKGROUND
 import unittest
+import gzip
+import io
+import json
+import math
+import threading
+import time
+import traceback
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+try:
+    import pandas
+    from pypassage.pandas_ext import PassageExtensionArray
+except ImportError:
+    pandas = None
 
 try:
     from settings import ESV_API_KEY
@@ -13,6 +58,109 @@ except ImportError:
     ESV_API_KEY = ""
 
 
+class StubESVServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the ESV API. Each reference in the 'q' parameter
+    (separated by semicolons) is given the text "Text of <reference>". Requests
+    for references in 'fail' get a 500 response, and every response is delayed
+    by 'delay' seconds. Connections are kept alive between requests, and
+    responses are gzipped if 'gzip' is True and the client accepts it.
+
+    'faults' is a list of faults to inject into the next requests, one per
+    request: an HTTP status (or (status, Retry-After) tuple) to respond with,
+    "invalid" for a response that isn't JSON, or "drop" to close the
+    connection without responding.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, fail=(), gzip=False, faults=()):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StubESVHandler)
+        self.delay = delay
+        self.fail = set(fail)
+        self.gzip = gzip
+        self.faults = list(faults)
+        self.requests = []
+        self.connections = set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.url = "http://127.0.0.1:" + str(self.server_address[1]) + "/"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class StubESVHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            query = parse_qs(urlparse(self.path).query)
+            refs = query["q"][0].split(";")
+            with server.lock:
+                server.requests.append((self.path, query, dict(
+                    [(k.title(), v) for (k, v) in self.headers.items()])))
+                server.connections.add(self.client_address)
+                fault = server.faults.pop(0) if server.faults else None
+            if fault == "drop":
+                self.close_connection = True
+                return
+            elif fault == "invalid":
+                self.send_response(200)
+                self.send_header("Content-Length", "9")
+                self.end_headers()
+                self.wfile.write(b"<html>...")
+                return
+            elif fault is not None:
+                (status, retry_after) = fault if isinstance(fault, tuple) \
+                    else (fault, None)
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", retry_after)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if server.fail.intersection(refs):
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.dumps({"passages": ["Text of " + r for r in refs]})
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            if server.gzip and "gzip" in self.headers.get("Accept-Encoding",
+                                                          ""):
+                compressed = io.BytesIO()
+                with gzip.GzipFile(fileobj=compressed, mode="wb") as f:
+                    f.write(body)
+                body = compressed.getvalue()
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
 class TestBookData(unittest.TestCase):
 
     def test_last_verses(self):
@@ -374,6 +522,89 @@ class TestPassage(unittest.TestCase):
         multi3 = P('Luk', 24, 1, 1, 26, 'Act').truncate(number_verses=940)
         self.assertEqual(multi3, P('Luk', 24, 1, 1, 9, 'Act'))
 
+    def test_iteration(self):
+        p = P('Mar', 9, 42, 10, 2)
+        self.assertEqual(list(p.iter_chapters()), [(41, 9), (41, 10)])
+        self.assertEqual(list(p.iter_verses()),
+                         [(41, 9, 42), (41, 9, 43), (41, 9, 45), (41, 9, 47),
+                          (41, 9, 48), (41, 9, 49), (41, 9, 50), (41, 10, 1),
+                          (41, 10, 2)])
+        (start, end) = p.ordinal_range()
+        self.assertEqual(list(p.iter_verses(ordinals=True)),
+                         list(range(start, end + 1)))
+        self.assertEqual(list(p.verses_array()), list(range(start, end + 1)))
+        self.assertEqual(p.verses_array().typecode, 'I')
+        p = P('Gen', 50, 26, 1, 1, 'Exo')
+        self.assertEqual(list(p.iter_verses()), [(1, 50, 26), (2, 1, 1)])
+        self.assertEqual(len(list(P('Gen', 1, 1, 22, 21, 'Rev').iter_verses())),
+                         bd.number_verses_in_bible)
+
+    def test_sequence(self):
+        p = P('Mar', 9, 40, 10, 3)
+        self.assertEqual(p[0], P('Mar', 9, 40))
+        self.assertEqual(p[4], P('Mar', 9, 45))
+        self.assertEqual(p[-1], P('Mar', 10, 3))
+        self.assertRaises(IndexError, p.__getitem__, 12)
+        self.assertRaises(IndexError, p.__getitem__, -13)
+        self.assertEqual(p[2:5], P('Mar', 9, 42, 9, 45))
+        self.assertEqual(p[-3:], P('Mar', 10, 1, 10, 3))
+        self.assertEqual(p[:], p)
+        # Slices are Passage objects, or None if empty
+        self.assertTrue(isinstance(p[4:5], P))
+        self.assertEqual(p[4:5], P('Mar', 9, 45))
+        self.assertTrue(isinstance(p[-1:], P))
+        self.assertEqual(p[5:5], None)
+        self.assertEqual(p[8:2], None)
+        self.assertEqual(p[20:], None)
+        self.assertRaises(ValueError, p.__getitem__, slice(0, 5, 2))
+        self.assertEqual(list(p)[3:6], [P('Mar', 9, 43), P('Mar', 9, 45),
+                                        P('Mar', 9, 47)])
+        self.assertEqual(len(list(p)), len(p))
+        # Translation is kept
+        p = P('Mar', 9, 40, 10, 3, translation="NIV")
+        self.assertEqual(set([x.translation for x in
+                              [p[0], p[2:5]] + list(p) + list(p.chunks(5))]),
+                         set(["NIV"]))
+        c = C(P('Gen', 1), p, P('Exo', 1))
+        self.assertTrue(isinstance(c[1:], C))
+        self.assertEqual(c[1:], C(p, P('Exo', 1)))
+        self.assertEqual(c[3:], C())
+        self.assertEqual(C(p).normalize()[0].translation, "NIV")
+
+    def test_contains(self):
+        p = P('Mar', 9, 40, 10, 3)
+        self.assertTrue(P('Mar', 9, 45) in p)
+        self.assertTrue(P('Mar', 9, 50, 10, 3) in p)
+        self.assertTrue(p in p)
+        self.assertFalse(P('Mar', 9, 39, 9, 41) in p)
+        self.assertFalse(P('Gen', 1) in p)
+        self.assertTrue((41, 9, 45) in p)
+        self.assertFalse((41, 9, 44) in p)  # missing verse
+        self.assertFalse((41, 10, 4) in p)
+        self.assertFalse((41, 99, 1) in p)
+
+    def test_chunks(self):
+        self.assertEqual(list(P('Eph', 1, 5, 2, 10).chunks(10)),
+                         [P('Eph', 1, 5, 1, 14), P('Eph', 1, 15, 2, 1),
+                          P('Eph', 2, 2, 2, 10)])
+        self.assertEqual([str(p) for p in P('Eph').chunks(50, align="chapter")],
+                         ['Ephesians 1-2', 'Ephesians 3', 'Ephesians 4',
+                          'Ephesians 5', 'Ephesians 6'])
+        # Chapters longer than the limit are split between verses
+        self.assertEqual(list(P('Psa', 118, 20, 120, 3).chunks(60, "chapter")),
+                         [P('Psa', 118, 20, 118, 29), P('Psa', 119, 1, 119, 60),
+                          P('Psa', 119, 61, 119, 120),
+                          P('Psa', 119, 121, 120, 3)])
+        # Missing verses are not counted
+        self.assertEqual(list(P('Mar', 9).chunks(44)),
+                         [P('Mar', 9, 1, 9, 45), P('Mar', 9, 47, 9, 50)])
+        chunks = list(P('Gen', 1, 1, 22, 21, 'Rev').chunks(500))
+        self.assertEqual(len(chunks), 63)
+        self.assertEqual(sum([len(p) for p in chunks]),
+                         bd.number_verses_in_bible)
+        self.assertEqual(list(P('Eph', 1, 1).chunks(10)), [P('Eph', 1, 1)])
+        self.assertRaises(ValueError, list, P('Eph').chunks(0))
+
 
 class TestPassageCollection(unittest.TestCase):
     def test_init(self):
@@ -510,6 +741,141 @@ class TestPassageCollection(unittest.TestCase):
         self.assertEqual(C(P('Eph', 1), P('Gen', 3, 2), P('Gen', 3, 6), P('Gen', 8),
                            P('Mat', 5)).abbr(), 'Eph 1; Gn 3:2, 3:6, 8:1-22; Mt 5')
 
+    def test_chunks(self):
+        self.assertEqual(list(C(P('Eph', 1), P('Jude')).chunks(20)),
+                         [P('Eph', 1, 1, 1, 20), P('Eph', 1, 21, 1, 23),
+                          P('Jude', 1, 1, 1, 20), P('Jude', 1, 21, 1, 25)])
+
+    def test_ordinals(self):
+        self.assertEqual(P('Gen', 1, 1).ordinal_range(), (0, 0))
+        self.assertEqual(P('Gen', 2, 1).ordinal_range(), (31, 31))
+        self.assertEqual(P('Rev', 22, 21).ordinal_range(),
+                         (bd.number_verses_in_bible - 1,
+                          bd.number_verses_in_bible - 1))
+        (start, end) = P('Mar', 9).ordinal_range()
+        self.assertEqual(end - start + 1, len(P('Mar', 9)))
+        self.assertEqual(passage_from_ordinals(start, end), P('Mar', 9))
+        self.assertEqual(passage_from_ordinals(start + 43, start + 43),
+                         P('Mar', 9, 45))
+
+    def test_normalize(self):
+        self.assertEqual(C(P('Rom', 1, 1, 1, 10), P('Rom', 1, 8, 1, 20),
+                           P('Rom', 1, 21)).normalize(), C(P('Rom', 1, 1, 1, 21)))
+        # Results are sorted; chapter and book boundaries are adjacent
+        self.assertEqual(C(P('Rom', 2), P('Exo', 1, 1), P('Rom', 1),
+                           P('Gen', 50, 26)).normalize(),
+                         C(P('Gen', 50, 26, 1, 1, 'Exo'), P('Rom', 1, 1, 2, 29)))
+        # Verses either side of a missing verse (Mark 9:44) are adjacent
+        self.assertEqual(C(P('Mar', 9, 1, 9, 43), P('Mar', 9, 45)).normalize(),
+                         C(P('Mar', 9, 1, 9, 45)))
+        self.assertEqual(C(P('Mar', 9, 1), P('Mar', 9, 3)).normalize(),
+                         C(P('Mar', 9, 1), P('Mar', 9, 3)))
+        self.assertEqual(C().normalize(), C())
+
+    def test_set_operations(self):
+        c = C(P('Rom', 1), P('Rom', 3))
+        self.assertEqual(c.union(P('Rom', 2, 1, 2, 5)),
+                         C(P('Rom', 1, 1, 2, 5), P('Rom', 3)))
+        self.assertEqual(c.union(C(P('Rom', 3), P('Gen', 1))),
+                         C(P('Gen', 1), P('Rom', 1), P('Rom', 3)))
+        self.assertEqual(c.intersection(P('Rom', 1, 30, 3, 2)),
+                         C(P('Rom', 1, 30, 1, 32), P('Rom', 3, 1, 3, 2)))
+        self.assertEqual(c.difference(C(P('Rom', 1, 5, 1, 10), P('Rom', 3, 1))),
+                         C(P('Rom', 1, 1, 1, 4), P('Rom', 1, 11, 1, 32),
+                           P('Rom', 3, 2, 3, 31)))
+        self.assertEqual(c.difference(c), C())
+        self.assertTrue(c.contains(P('Rom', 1, 2, 1, 3)))
+        self.assertTrue(c.contains(C(P('Rom', 1, 2), P('Rom', 3))))
+        self.assertFalse(c.contains(P('Rom', 1, 2, 2, 3)))
+        self.assertEqual(C(P('Rom', 1, 1, 1, 10), P('Rom', 1, 8, 1, 20),
+                           P('Rom', 1, 21)).total_verses(), 21)
+        self.assertEqual(C(P('Mar', 9), P('Mar', 9, 40, 9, 50)).total_verses(),
+                         48)
+
+    def test_reference_cache(self):
+        reference.clear_reference_cache()
+        c = C(P('Rom', 1, 1, 1, 10), P('Rom', 3, 21), P('Gen', 1))
+        self.assertEqual(str(c), "Romans 1:1-10, 3:21; Genesis 1")
+        self.assertEqual(len(reference.reference_cache), 1)
+        self.assertEqual(str(c), "Romans 1:1-10, 3:21; Genesis 1")
+        # Changes to passages and collections are picked up
+        (c[2].end_chapter, c[2].end_verse) = (2, 25)
+        c.append(P('Exo', 3))
+        self.assertEqual(str(c), "Romans 1:1-10, 3:21; Genesis 1-2; Exodus 3")
+        self.assertEqual(c.abbr(), "Rom 1:1-10, 3:21; Gn 1-2; Ex 3")
+        p = P('Rom', 8)
+        p.end_verse = [1]
+        self.assertEqual(str(p), "Invalid passage")
+        reference.clear_reference_cache()
+        self.assertEqual(reference.reference_cache, {})
+        # Large collections aren't cached, though their passages may be
+        big = C(*[P('Ps', n, 1) for n in range(1, 151)])
+        array = PassageArray(big)
+        self.assertEqual(str(array), str(big))
+        self.assertEqual(render_many([big, array]), [str(big)] * 2)
+        self.assertEqual([k for k in reference.reference_cache
+                          if k[0] in (C, PassageArray)], [])
+
+    def test_render_many(self):
+        a = C(P('Rom', 8), P('Jn', 3, 16))
+        b = C(P('Gen', 1), P('Rom', 8))
+        self.assertEqual(render_many([a, b, a, P('Rom', 8)]),
+                         ["Romans 8; John 3:16", "Genesis 1; Romans 8",
+                          "Romans 8; John 3:16", "Romans 8"])
+        self.assertEqual(render_many([a, b], abbreviated=True, dash="--"),
+                         ["Rom 8; Jn 3:16", "Gn 1; Rom 8"])
+        self.assertEqual(render_many([PassageArray(a)]), [str(a)])
+
+
+class TestStyles(unittest.TestCase):
+    def setUp(self):
+        self.c = C(P('Rom', 1, 1, 1, 10), P('Rom', 3, 21), P('Rom', 5),
+                   P('Jude', 3, 5), P('Jude', 7), P('Gen', 50, 26, 1, 1, 'Exo'),
+                   P('Ps', 23))
+
+    def test_default(self):
+        self.assertEqual(self.c.reference_string(style=styles.STANDARD),
+                         str(self.c))
+        self.assertEqual(self.c.reference_string(style=styles.ABBREVIATED),
+                         self.c.abbr())
+        self.assertEqual(P('Ps', 23, 1).reference_string(
+            style=styles.EN_DASH), "Psalm 23:1")
+        # Dash is used for every passage
+        self.assertEqual(C(P('Rom', 1, 1, 1, 3), P('Gen', 1, 1, 1, 3)
+                           ).reference_string(dash="--"),
+                         "Romans 1:1--3; Genesis 1:1--3")
+        self.assertEqual(C(P('Rom', 8)).abbr(), "Rom 8")
+
+    def test_styles(self):
+        self.assertEqual(P('Jn', 3, 16).reference_string(style=styles.DOTTED),
+                         "Jn 3.16")
+        self.assertEqual(self.c.reference_string(style=styles.DOTTED),
+                         "Rom 1.1-10, 3.21, 5.1-21; Jude 3-5, 7; " +
+                         "Gn 50.26-Ex 1.1; Ps 23")
+        self.assertEqual(self.c.reference_string(style=styles.NO_SPACE),
+                         "Rom1:1-10,3:21,5:1-21;Jude3-5,7;Gn50:26-Ex1:1;Ps23")
+        self.assertEqual(self.c.reference_string(style=styles.OSIS),
+                         "Rom.1.1-Rom.1.10 Rom.3.21 Rom.5.1-Rom.5.21 " +
+                         "Jude.1.3-Jude.1.5 Jude.1.7 Gen.50.26-Exod.1.1 " +
+                         "Ps.23.1-Ps.23.6")
+        self.assertEqual(self.c.reference_string(style=styles.USFM),
+                         "ROM 1:1-10; ROM 3:21; ROM 5:1-21; JUD 1:3-5; " +
+                         "JUD 1:7; GEN 50:26-EXO 1:1; PSA 23:1-6")
+        self.assertEqual(P('Jn', 3, 16, 4, 2).reference_string(
+            style=styles.USFM), "JHN 3:16-4:2")
+
+    def test_custom(self):
+        style = styles.ReferenceStyle({45: u"Römer", 43: u"Joh"}, dash=u"–",
+                                      chapter_separator=",")
+        self.assertEqual(P('Rom', 8, 28, 8, 30).reference_string(style=style),
+                         u"Römer 8,28–30")
+        self.assertEqual(render_many([C(P('Jn', 3), P('Rom', 1, 1))],
+                                     style=style), [u"Joh 3; Römer 1,1"])
+        self.assertRaises(ValueError, styles.ReferenceStyle, "latin")
+        style = styles.ReferenceStyle(book_separator="%", dash="%d")
+        self.assertEqual(P('Rom', 8, 28, 8, 30).reference_string(style=style),
+                         "Romans%8:28%d30")
+
 
 class TestPassageDelta(unittest.TestCase):
 
@@ -633,6 +999,1200 @@ class TestPassageDelta(unittest.TestCase):
             pass
 
 
+class TestPassageIndex(unittest.TestCase):
+    def setUp(self):
+        self.passages = [P('Rom', 8), P('Rom', 8, 28), P('Rom', 1, 1, 16, 27),
+                         P('Gen', 1, 1, 3, 24), P('Gen', 3, 1, 1, 5, 'Exo'),
+                         P('Mat', 5)]
+        self.index = PassageIndex(self.passages)
+
+    def test_stabbing(self):
+        self.assertEqual(sorted(self.index.stabbing(P('Rom', 8, 28))),
+                         [0, 1, 2])
+        self.assertEqual(sorted(self.index.stabbing(P('Exo', 1, 2).start)), [4])
+        self.assertEqual(self.index.stabbing(P('Mar', 1, 1)), [])
+
+    def test_overlapping(self):
+        self.assertEqual(sorted(self.index.overlapping(
+            P('Gen', start_chapter=1, end_chapter=3))), [3, 4])
+        self.assertEqual(sorted(self.index.overlapping(
+            P('Rom', 8, 39, 9, 1))), [0, 2])
+
+    def test_containment(self):
+        self.assertEqual(sorted(self.index.containing(P('Rom', 8, 1, 8, 30))),
+                         [0, 2])
+        self.assertEqual(sorted(self.index.within(P('Rom'))), [0, 1, 2])
+        self.assertEqual(sorted(self.index.within(P('Gen', end_book='Exo'))),
+                         [3, 4])
+
+    def test_insert_and_remove(self):
+        key = self.index.add(P('Rom', 8, 26, 8, 30))
+        self.assertEqual(key, 6)
+        self.index.add(P('Eph', 1), key='eph')
+        self.assertEqual(sorted(self.index.stabbing(P('Rom', 8, 28)),
+                                key=str), [0, 1, 2, 6])
+        self.assertEqual(self.index.stabbing(P('Eph', 1, 3)), ['eph'])
+        self.index.remove(1)
+        del self.index['eph']
+        self.assertEqual(sorted(self.index.stabbing(P('Rom', 8, 28))),
+                         [0, 2, 6])
+        self.assertEqual(self.index.stabbing(P('Eph', 1, 3)), [])
+        self.assertEqual(len(self.index), 6)
+        self.assertRaises(KeyError, self.index.remove, 1)
+
+    def test_sorted_inserts(self):
+        # Adding entries in order keeps the tree balanced, with O(log n)
+        # amortised work per add
+        n = 4000
+        index = PassageIndex()
+        built = []
+        build_node = index._build_node
+
+        def counting_build_node(items):
+            built.append(len(items))
+            return build_node(items)
+        index._build_node = counting_build_node
+
+        def depth(node):
+            if node is None:
+                return 0
+            return 1 + max(depth(node.left), depth(node.right))
+
+        for i in range(n):
+            index.add((2 * i, 2 * i + 1))
+            index.add((4 * n - 2 * i, 4 * n - 2 * i + 1))
+            if i % 500 == 0:
+                self.assertEqual(len(index.stabbing(2 * i)), 1)
+        self.assertTrue(depth(index.root) <=
+                        1 + math.log(2 * n) / -math.log(index_module.BALANCE))
+        self.assertTrue(len(built) < 3 * 2 * n * math.log(2 * n, 2))
+        self.assertEqual(sorted(index.overlapping((101, 106))),
+                         [100, 102, 104, 106])
+
+    def test_from_arrays(self):
+        starts = [10, 20, 30, 5]
+        ends = [15, 40, 30, 50]
+        index = PassageIndex.from_arrays(starts, ends, keys=['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(index.stabbing(30)), ['b', 'c', 'd'])
+        self.assertEqual(sorted(index.overlapping((16, 19))), ['d'])
+        self.assertEqual(index['a'], (10, 15))
+        self.assertRaises(ValueError, PassageIndex.from_arrays, [1, 2], [3])
+        # A failed build leaves the index unchanged
+        self.assertRaises(ValueError, index.build, [1, 2], [3, 4], ['x', 'x'])
+        self.assertRaises(ValueError, index.build, [1, 5], [3, 4], ['x', 'y'])
+        self.assertEqual(len(index), 4)
+        self.assertEqual(sorted(index.stabbing(30)), ['b', 'c', 'd'])
+
+    @unittest.skipIf(similarity.numpy is None, "NumPy not installed")
+    def test_numpy_points(self):
+        import numpy
+        index = PassageIndex.from_arrays(numpy.array([10, 20]),
+                                         numpy.array([15, 40]))
+        self.assertEqual(index.stabbing(numpy.int64(30)), [1])
+
+
+class TestStreams(unittest.TestCase):
+    def test_conversion(self):
+        passages = [P('Gen', 1), P('Mar', 9)]
+        self.assertEqual(list(streams.to_passages(streams.to_ranges(passages))),
+                         passages)
+
+    def test_set_operations(self):
+        read = list(streams.to_ranges([P('Rom', 1), P('Rom', 1, 20, 2, 3),
+                                       P('Rom', 3, 1, 3, 4), P('Rom', 3, 5)]))
+        plan = list(streams.to_ranges([P('Rom', 1), P('Rom', 2), P('Rom', 3)]))
+        self.assertEqual(list(streams.to_passages(streams.coalesce(read))),
+                         [P('Rom', 1, 1, 2, 3), P('Rom', 3, 1, 3, 5)])
+        self.assertEqual(list(streams.to_passages(streams.difference(plan, read))),
+                         [P('Rom', 2, 4, 2, 29), P('Rom', 3, 6, 3, 31)])
+        self.assertEqual(list(streams.to_passages(streams.intersection(
+            plan, read, streams.to_ranges([P('Rom', 2)])))),
+            [P('Rom', 2, 1, 2, 3)])
+        self.assertEqual(list(streams.union(plan[2:], read[:1], plan[:1])),
+                         list(streams.to_ranges([P('Rom', 1), P('Rom', 3)])))
+        self.assertEqual(list(streams.merge([(1, 2), (5, 6)], [(3, 9)])),
+                         [(1, 2), (3, 9), (5, 6)])
+        self.assertRaises(ValueError, list, streams.coalesce([(5, 6), (1, 2)]))
+
+    def test_external_sort(self):
+        ranges = [((i * 7919) % 1000, (i * 7919) % 1000 + i % 5)
+                  for i in range(1000)]
+        self.assertEqual(list(streams.external_sort(ranges, run_size=64)),
+                         sorted(ranges))
+        self.assertEqual(list(streams.external_sort(ranges)), sorted(ranges))
+        self.assertEqual(list(streams.external_sort([])), [])
+
+
+class TestVerseSet(unittest.TestCase):
+    def test_add_and_remove(self):
+        v = VerseSet(C(P('Rom', 8), P('Rom', 8, 20, 9, 5)))
+        self.assertEqual(len(v), 44)
+        self.assertEqual(v.passages(), C(P('Rom', 8, 1, 9, 5)))
+        v.remove(P('Rom', 8, 28))
+        self.assertEqual(v.passages(), C(P('Rom', 8, 1, 8, 27),
+                                         P('Rom', 8, 29, 9, 5)))
+        self.assertTrue(P('Rom', 8, 1, 8, 27) in v)
+        self.assertFalse(P('Rom', 8, 27, 8, 29) in v)
+        # Missing verses are never in the set
+        self.assertEqual(len(VerseSet(P('Mar', 9))), 48)
+
+    def test_counts(self):
+        v = VerseSet(C(P('Gen'), P('Mat', 1), P('Mat', 12, 1, 12, 10)))
+        self.assertEqual(len(v), 1533 + 25 + 10)
+        self.assertEqual(v.number_verses(per_book=True)[40], 35)
+        self.assertEqual(v.number_verses(per_book=True)[2], 0)
+        self.assertEqual(v.number_verses(per_chapter=True)[40, 12], 10)
+        self.assertEqual(v.coverage(per_book=True)[1], 1.0)
+        self.assertEqual(v.coverage(per_chapter=True)[40, 1], 1.0)
+        # Matthew 12 has 50 verses, of which v47 is missing
+        self.assertEqual(v.coverage(per_chapter=True)[40, 12], 10.0 / 49)
+        self.assertEqual(VerseSet(P('Gen', 1, 1, 22, 21, 'Rev')).coverage(), 1.0)
+
+    def test_set_operations(self):
+        a = VerseSet(P('Rom', 1, 1, 1, 20))
+        b = VerseSet(P('Rom', 1, 10, 2, 5))
+        self.assertEqual((a | b).passages(), C(P('Rom', 1, 1, 2, 5)))
+        self.assertEqual((a & b).passages(), C(P('Rom', 1, 10, 1, 20)))
+        self.assertEqual((a - b).passages(), C(P('Rom', 1, 1, 1, 9)))
+        self.assertEqual(a.union(b), b.union(a))
+
+    def test_compression(self):
+        for v in [VerseSet(), VerseSet(C(P('Gen'), P('Mar', 9), P('Rev', 22)))]:
+            data = v.compress()
+            self.assertEqual(VerseSet.decompress(data), v)
+        self.assertTrue(len(v.compress()) < 20)
+        # Sets with many short runs fall back to storing the bitmap
+        v = VerseSet()
+        for ordinal in range(0, bd.number_verses_in_bible, 2):
+            v.add_range(ordinal, ordinal)
+        self.assertEqual(len(v.compress()), len(v.bits) + 1)
+        self.assertEqual(VerseSet.decompress(v.compress()), v)
+
+
+class TestReadingPlan(unittest.TestCase):
+    def test_verse_aligned(self):
+        plan = reading_plan(P('Rom'), 7)
+        self.assertEqual(len(plan), 7)
+        self.assertEqual(C(plan).normalize(), C(P('Rom')))
+        lengths = [len(p) for p in plan]
+        self.assertTrue(max(lengths) - min(lengths) <= 1)
+        # Whole bible in a year
+        plan = reading_plan(P('Gen', 1, 1, 22, 21, 'Rev'), 365)
+        self.assertEqual(sum([len(p) for p in plan]),
+                         bd.number_verses_in_bible)
+        self.assertEqual(set([len(p) for p in plan]), set([85, 86]))
+
+    def test_chapter_aligned(self):
+        self.assertEqual(str(reading_plan(P('Rom'), 7, align="chapter")),
+                         "Romans 1-2, 3-4, 5-7, 8-9, 10-11, 12-14, 15-16")
+        self.assertEqual(reading_plan(P('Psa'), 150, align="chapter"),
+                         C([P('Psa', i) for i in range(1, 151)]))
+        self.assertRaises(ValueError, reading_plan, P('Rom'), 17,
+                          align="chapter")
+
+    def test_chapter_aligned_optimal(self):
+        def best(lengths, parts):
+            # Smallest longest part, by trying every split
+            if parts == 1:
+                return sum(lengths)
+            return min([max(sum(lengths[:i]), best(lengths[i:], parts - 1))
+                        for i in range(1, len(lengths) - parts + 2)])
+
+        for book in ('Ruth', 'Eph', 'Col', '1Th', 'Jas', 'Jon', 'Mal'):
+            lengths = [len(P(book, c))
+                       for c in range(1, P(book).end_chapter + 1)]
+            for parts in range(1, len(lengths) + 1):
+                plan = reading_plan(P(book), parts, align="chapter")
+                self.assertEqual(len(plan), parts)
+                self.assertEqual(C(plan).normalize(), C(P(book)))
+                self.assertEqual(max([len(p) for p in plan]),
+                                 best(lengths, parts))
+        plan = reading_plan(P('Jer'), 22, align="chapter")
+        self.assertEqual(max([len(p) for p in plan]), 74)
+        # Parts are shared between passages as well as within them
+        plan = reading_plan(C(P('Gen'), P('Lev')), 35, align="chapter")
+        self.assertEqual(len(plan), 35)
+        self.assertEqual(max([len(p) for p in plan]), 83)
+
+    def test_books(self):
+        plan = reading_plan(P('Mat', 1, 1, 22, 21, 'Rev'), 30,
+                            cross_books=False)
+        self.assertEqual(len(plan), 30)
+        for p in plan:
+            self.assertEqual(p.start_book_n, p.end_book_n)
+        self.assertEqual(plan[2], P('Mar'))
+        self.assertRaises(ValueError, reading_plan,
+                          P('Mat', 1, 1, 22, 21, 'Rev'), 26, cross_books=False)
+        # Parts never span gaps between passages in a collection
+        plan = reading_plan(C(P('Rom', 1), P('Rom', 3)), 2)
+        self.assertEqual(plan, C(P('Rom', 1), P('Rom', 3)))
+
+
+class TestSimilarity(unittest.TestCase):
+    def setUp(self):
+        self.passages = [P('Rom', 8), P('Rom', 8, 28, 8, 39), P('Gen', 1),
+                         P('Rom', 9), P('Rom', 8, 1, 9, 5)]
+
+    def test_score(self):
+        rom8 = P('Rom', 8).ordinal_range()
+        end = P('Rom', 8, 28, 9, 5).ordinal_range()
+        # 12 verses shared, 44 verses in total; Romans 8 is 39 verses long
+        self.assertEqual(similarity.score(rom8, end), 12.0 / 44)
+        self.assertEqual(similarity.score(rom8, end, "overlap"), 12.0 / 17)
+        self.assertEqual(similarity.score(rom8, end, "distance"), 0)
+        self.assertEqual(similarity.score(rom8, P('Rom', 9, 2).ordinal_range(),
+                                          "distance"), 2)
+        self.assertRaises(ValueError, similarity.score, rom8, end, "cosine")
+
+    def test_sparse_matrix(self):
+        (rows, columns, scores) = similarity.overlap_matrix(self.passages)
+        pairs = dict([((i, j), v) for (i, j, v) in zip(rows, columns, scores)])
+        self.assertEqual(sorted(pairs), [(0, 1), (0, 4), (1, 0), (1, 4),
+                                         (3, 4), (4, 0), (4, 1), (4, 3)])
+        self.assertEqual(pairs[0, 1], 12.0 / 39)
+        self.assertEqual(pairs[0, 1], pairs[1, 0])
+        (rows, columns, scores) = similarity.overlap_matrix(
+            [P('Rom', 8, 28)], self.passages, metric="overlap")
+        self.assertEqual(list(columns), [0, 1, 4])
+        self.assertEqual(list(scores), [1.0, 1.0, 1.0])
+        self.assertRaises(ValueError, similarity.overlap_matrix,
+                          self.passages, metric="distance")
+
+    def test_top_k(self):
+        best = similarity.top_k(self.passages, k=2)
+        self.assertEqual([j for (j, v) in best[0]], [4, 1])
+        self.assertEqual(best[2], [])
+        nearest = similarity.top_k(similarity.passage_arrays([P('Rom', 10)]),
+                                   self.passages, k=3, metric="distance")
+        self.assertEqual(nearest, [[(3, 1), (4, 29), (1, 34)]])
+
+    @unittest.skipIf(similarity.numpy is None, "NumPy not installed")
+    def test_dense_matrix(self):
+        matrix = similarity.overlap_matrix(self.passages, dense=True,
+                                           block_size=2)
+        (rows, columns, scores) = similarity.overlap_matrix(self.passages)
+        for (i, j, v) in zip(rows, columns, scores):
+            self.assertAlmostEqual(matrix[i, j], v)
+        self.assertEqual(matrix[0, 2], 0.0)
+        self.assertEqual(matrix[0, 0], 1.0)
+        distances = similarity.overlap_matrix(self.passages, dense=True,
+                                              metric="distance")
+        self.assertEqual(distances[3, 0], 1)
+
+
+class TestCoverage(unittest.TestCase):
+    def test_counts(self):
+        c = Coverage([P('Rom', 8), P('Rom', 8, 28), P('Rom')])
+        c.add(P('Mar', 9), count=2)
+        self.assertEqual(c.count(P('Rom', 8, 28)), 3)
+        self.assertEqual(c.count(P('Rom', 8, 27, 8, 28)), 5)
+        self.assertEqual(c.verse_counts()[P('Rom', 8, 28).ordinal_range()[0]], 3)
+        chapters = c.counts(per_chapter=True)
+        self.assertEqual(chapters[45, 8], 39 * 2 + 1)
+        self.assertEqual(chapters[45, 9], 33)
+        self.assertEqual(chapters[41, 9], 48 * 2)
+        self.assertEqual(chapters[1, 1], 0)
+        self.assertEqual(len(chapters), 1189)
+        books = c.counts(per_book=True)
+        self.assertEqual(books[45], bd.number_verses_in_book[45] + 39 + 1)
+        self.assertEqual(c.counts(per_book=True, aggregate="min")[45], 1)
+        self.assertEqual(c.counts(per_book=True, aggregate="max")[45], 3)
+        self.assertEqual(c.counts(per_chapter=True, aggregate="min")[45, 8], 2)
+        self.assertRaises(ValueError, c.counts)
+
+    def test_merge(self):
+        shard_a = Coverage([P('Rom', 8), P('Gen', 1)])
+        shard_b = Coverage(C(P('Rom', 8, 28), P('Rom', 9)))
+        combined = shard_a + shard_b
+        self.assertEqual(combined.count(P('Rom', 8, 28)), 2)
+        self.assertEqual(combined.count(P('Rom', 9, 1)), 1)
+        self.assertEqual(shard_a.count(P('Rom', 8, 28)), 1)
+        shard_a.merge(shard_b)
+        self.assertEqual(list(shard_a.verse_counts()),
+                         list(combined.verse_counts()))
+
+
+class TestSampling(unittest.TestCase):
+    def test_verses(self):
+        sampler = VerseSampler(seed=1)
+        verses = sampler.verses(100)
+        self.assertEqual(len(verses), 100)
+        for p in verses:
+            self.assertEqual(len(p), 1)
+        # Missing verses are never drawn
+        sampler = VerseSampler(P('Mar', 9, 43, 9, 46), seed=1)
+        self.assertEqual(set([str(p) for p in sampler.verses(200)]),
+                         set(["Mark 9:43", "Mark 9:45"]))
+
+    def test_seeds(self):
+        sampler = VerseSampler()
+        self.assertEqual(sampler.verse(seed="2026-10-19"),
+                         sampler.verse(seed="2026-10-19"))
+        self.assertEqual(VerseSampler(seed=5).verses(10),
+                         VerseSampler(seed=5).verses(10))
+        self.assertEqual(sampler.passages(5, 3, seed=7),
+                         VerseSampler(seed=1).passages(5, 3, seed=7))
+
+    def test_passages(self):
+        sampler = VerseSampler(seed=2)
+        for p in sampler.passages(200, 20, boundary="chapter"):
+            self.assertEqual(len(p), 20)
+            self.assertEqual((p.start_book_n, p.start_chapter),
+                             (p.end_book_n, p.end_chapter))
+        for p in sampler.passages(200, 200, boundary="book"):
+            self.assertEqual(len(p), 200)
+            self.assertEqual(p.start_book_n, p.end_book_n)
+        # Only two 38-verse passages fit inside Romans 8
+        within = VerseSampler(P('Rom', 8, 1, 9, 3), seed=2)
+        self.assertEqual(set([str(p) for p in within.passages(50, 38)]),
+                         set(["Romans 8:1-38", "Romans 8:2-39"]))
+        self.assertEqual(within.passage(40, boundary=None).end_chapter, 9)
+        self.assertRaises(ValueError, within.passage, 40)
+        self.assertRaises(ValueError, within.passage, 5, "paragraph")
+
+    def test_weights(self):
+        sampler = VerseSampler(C(P('Phm'), P('Jude')), weights={65: 0}, seed=3)
+        self.assertEqual(set([p.start_book_n for p in sampler.verses(100)]),
+                         set([57]))
+        sampler = VerseSampler(C(P('Phm'), P('Jude')), weights={57: 3}, seed=3)
+        books = [p.start_book_n for p in sampler.verses(4000)]
+        self.assertTrue(2.5 < float(books.count(57)) / books.count(65) < 3.5)
+        # Weighted passages may still span books with boundary=None, and are
+        # weighted by the book they start in
+        within = P('Ruth', 4, 20, 1, 3, '1Sa')
+        for weights in (None, {9: 3}):
+            sampler = VerseSampler(within, weights=weights, seed=3)
+            starts = [str(p.start_book_n) + ":" + str(p.start_verse)
+                      for p in sampler.passages(4000, 3, boundary=None)]
+            self.assertEqual(sorted(set(starts)),
+                             ["8:20", "8:21", "8:22", "9:1"])
+        self.assertTrue(0.45 < starts.count("9:1") / 4000.0 < 0.55)
+        self.assertEqual(len(VerseSampler(within, weights={9: 3}).passages(
+            5, 3, boundary="book")), 5)
+        self.assertRaises(ValueError, VerseSampler(within, weights={9: 3}).
+                          passages, 5, 4, boundary="book")
+
+
+class TestTextSize(unittest.TestCase):
+    def setUp(self):
+        # Ten words and fifty characters per verse, except for John 3:16
+        # (ordinal 26125) which is twice as long
+        words = [10] * bd.number_verses_in_bible
+        chars = [50] * bd.number_verses_in_bible
+        words[26125] = 20
+        chars[26125] = 100
+        self.table = TextSizeTable(words, chars)
+
+    def test_size(self):
+        self.assertEqual(P('Jn', 3, 16).ordinal_range(), (26125, 26125))
+        self.assertEqual(P('Jn', 3, 14, 3, 17).number_words(self.table), 50)
+        self.assertEqual(P('Jn', 3, 14, 3, 17).number_characters(self.table),
+                         250)
+        self.assertEqual(P('Mar', 9, 42, 9, 48).number_words(self.table), 50)
+        self.assertRaises(ValueError, P('Jn', 3, 16).number_words)
+
+    def test_truncate(self):
+        p = P('Jn', 3, 1, 3, 36)
+        self.assertEqual(p.truncate(max_words=100, size_table=self.table),
+                         P('Jn', 3, 1, 3, 10))
+        self.assertEqual(p.truncate(max_words=175, size_table=self.table),
+                         P('Jn', 3, 1, 3, 16))
+        self.assertEqual(p.truncate(max_words=169, size_table=self.table),
+                         P('Jn', 3, 1, 3, 15))
+        self.assertEqual(p.truncate(max_words=169, max_chars=300,
+                                    size_table=self.table),
+                         P('Jn', 3, 1, 3, 6))
+        self.assertEqual(p.truncate(number_verses=3, max_words=169,
+                                    size_table=self.table),
+                         P('Jn', 3, 1, 3, 3))
+        self.assertEqual(p.truncate(max_words=10000, size_table=self.table), p)
+        self.assertEqual(P('Jn', 3, 16).truncate(max_words=19,
+                                                 size_table=self.table), None)
+        self.assertEqual(P('Mar', 9, 42, 9, 48).truncate(
+            max_words=25, size_table=self.table), P('Mar', 9, 42, 9, 43))
+
+    def test_default_table(self):
+        bd.size_table = self.table
+        try:
+            self.assertEqual(P('Jn', 3, 1, 3, 36).truncate(max_chars=500),
+                             P('Jn', 3, 1, 3, 10))
+            self.assertEqual(P('Jn', 3, 16).number_characters(), 100)
+        finally:
+            bd.size_table = None
+
+    def test_save_load(self):
+        f = io.BytesIO()
+        self.table.save(f)
+        self.assertEqual(len(f.getvalue()), 9 + 4 * bd.number_verses_in_bible)
+        f.seek(0)
+        table = TextSizeTable.load(f)
+        self.assertEqual(table.word_counts, self.table.word_counts)
+        self.assertEqual(table.cumulative_chars, self.table.cumulative_chars)
+        self.assertRaises(ValueError, TextSizeTable.load,
+                          io.BytesIO(b"XXXX" + f.getvalue()[4:]))
+        self.assertRaises(ValueError, TextSizeTable.load,
+                          io.BytesIO(f.getvalue()[:100]))
+
+    def test_from_texts(self):
+        table = TextSizeTable.from_texts(["In the beginning, God", "", "a  b"])
+        self.assertEqual(list(table.word_counts), [4, 0, 2])
+        self.assertEqual(list(table.char_counts), [21, 0, 4])
+        self.assertEqual(table.words(0, 2), 6)
+
+
+class TestPassageArray(unittest.TestCase):
+    def setUp(self):
+        self.passages = [P('Rom', 1, 8, 1, 20), P('Rom', 1, 1, 1, 10),
+                         P('Rom', 3, 21), P('Gen', 1), P('Mat', 28, 19, 28, 20)]
+        self.c = C(self.passages)
+        self.a = PassageArray(self.c)
+
+    def test_sequence(self):
+        self.assertEqual(len(self.a), 5)
+        self.assertEqual(self.a[0], P('Rom', 1, 8, 1, 20))
+        self.assertEqual(self.a[-1], P('Mat', 28, 19, 28, 20))
+        self.assertEqual(list(self.a), self.passages)
+        self.assertEqual(self.a, self.c)
+        self.assertTrue(isinstance(self.a[1:3], PassageArray))
+        self.assertEqual(list(self.a[1:3]), self.passages[1:3])
+        self.assertTrue(P('Gen', 1) in self.a)
+        self.assertFalse(P('Gen', 1, 1) in self.a)
+        self.assertEqual(self.a.to_collection(), self.c)
+
+    def test_strings(self):
+        self.assertEqual(str(self.a), str(self.c))
+        self.assertEqual(self.a.abbr(), self.c.abbr())
+        self.assertEqual(self.a.reference_string(dash="--"),
+                         self.c.reference_string(dash="--"))
+        self.assertEqual(str(PassageArray()), "")
+
+    def test_arrays(self):
+        (starts, ends) = self.a.arrays()
+        self.assertEqual(self.a.ordinal_ranges(), self.c.ordinal_ranges())
+        b = PassageArray.from_arrays(starts, ends)
+        self.assertEqual(b, self.a)
+        self.assertEqual(b.starts.itemsize * 2, 8)
+        self.assertRaises(ValueError, PassageArray.from_arrays, [0, 1], [5])
+        self.assertRaises(ValueError, PassageArray.from_arrays, [10], [5])
+        self.assertRaises(ValueError, PassageArray.from_arrays, [0],
+                          [bd.number_verses_in_bible])
+
+    def test_modify(self):
+        b = self.a + P('Jn', 3, 16)
+        self.assertTrue(isinstance(b, PassageArray))
+        self.assertEqual(len(b), 6)
+        self.assertEqual(len(self.a), 5)
+        self.assertEqual(b[5], P('Jn', 3, 16))
+        b = C(P('Jn', 3, 16)) + self.a
+        self.assertTrue(isinstance(b, PassageArray))
+        self.assertEqual(b[0], P('Jn', 3, 16))
+        self.assertEqual(list(P('Jn', 3, 16) + self.a)[1:], self.passages)
+        self.assertEqual(len(self.a + self.a), 10)
+        b.append(P('Exo'))
+        b.append("Exo")
+        b.insert(0, P('Lev'))
+        self.assertEqual((len(b), b[0], b[-1]), (8, P('Lev'), P('Exo')))
+
+    def test_set_operations(self):
+        self.assertEqual(str(self.a.normalize()), str(self.c.normalize()))
+        self.assertTrue(isinstance(self.a.normalize(), PassageArray))
+        self.assertEqual(str(self.a.union(P('Rom', 2))),
+                         str(self.c.union(P('Rom', 2))))
+        self.assertEqual(str(self.a.intersection(self.c)),
+                         str(self.c.normalize()))
+        self.assertEqual(len(self.a.difference(self.c)), 0)
+        self.assertTrue(self.a.contains(P('Rom', 1, 3, 1, 18)))
+        self.assertTrue(self.c.contains(self.a))
+        self.assertEqual(self.a.total_verses(), self.c.total_verses())
+
+
+@unittest.skipIf(pandas is None, "pandas not installed")
+class TestPandas(unittest.TestCase):
+    def setUp(self):
+        self.passages = [P('Rom', 8), P('Jn', 3, 16), None, P('Gen', 1, 1),
+                         P('Rom', 8)]
+        self.s = pandas.Series(self.passages, dtype="passage")
+
+    def test_series(self):
+        self.assertEqual(str(self.s.dtype), "passage")
+        self.assertEqual(self.s[1], P('Jn', 3, 16))
+        self.assertTrue(pandas.isna(self.s[2]))
+        self.assertEqual(list(self.s.isna()), [False, False, True, False,
+                                               False])
+        self.assertEqual(self.s.array.nbytes, 80)
+        self.assertEqual(list(self.s.dropna()),
+                         [p for p in self.passages if p is not None])
+        self.assertEqual(list(pandas.Series(["Rom 8", "Jn 3:16"],
+                                            dtype="passage")),
+                         [P('Rom', 8), P('Jn', 3, 16)])
+        self.assertRaises(ValueError, pandas.Series, ["Rom 8", "Hezekiah 3"],
+                          dtype="passage")
+
+    def test_unique(self):
+        u = self.s.unique()
+        self.assertEqual(str(u.dtype), "passage")
+        self.assertEqual(list(u.fillna(P('Jude', 1))),
+                         [P('Rom', 8), P('Jn', 3, 16), P('Jude', 1),
+                          P('Gen', 1, 1)])
+        self.assertEqual(self.s.nunique(), 3)
+
+    def test_accessor(self):
+        self.assertEqual(list(self.s.passage.str().fillna("")),
+                         ["Romans 8", "John 3:16", "", "Genesis 1:1",
+                          "Romans 8"])
+        self.assertEqual(list(self.s.passage.abbr().fillna(""))[:2],
+                         ["Rom 8", "Jn 3:16"])
+        self.assertEqual(list(self.s.passage.len().fillna(0)),
+                         [39, 1, 0, 1, 39])
+        self.assertEqual(list(self.s.passage.book.fillna(0)),
+                         [45, 43, 0, 1, 45])
+        self.assertEqual(list(self.s.passage.overlaps(P('Rom', 8, 28))),
+                         [True, False, False, False, True])
+        self.assertRaises(AttributeError, lambda: pandas.Series([1]).passage)
+
+    def test_sort_and_group(self):
+        s = self.s.sort_values(kind="stable")
+        self.assertEqual(list(s.index), [3, 1, 0, 4, 2])
+        df = pandas.DataFrame({"p": self.s, "n": [1, 2, 3, 4, 5]})
+        totals = df.groupby("p")["n"].sum()
+        self.assertEqual(dict(zip([str(p) for p in totals.index], totals)),
+                         {"Genesis 1:1": 4, "John 3:16": 2, "Romans 8": 6})
+
+    def test_collections(self):
+        c = C(P('Rom', 8), P('Jn', 3, 16))
+        a = PassageExtensionArray.from_collection(c)
+        self.assertEqual(a.to_collection(), c)
+        self.assertEqual(self.s.passage.to_collection(),
+                         C(P('Rom', 8), P('Jn', 3, 16), P('Gen', 1, 1),
+                           P('Rom', 8)))
+        b = PassageExtensionArray.from_collection(PassageArray(c))
+        self.assertEqual(list(b == a), [True, True])
+
+
+class TestTextFetching(unittest.TestCase):
+    def setUp(self):
+        self.cache = text_cache.SimpleCache(500, dict(
+            [(k, v * 0.5) for (k, v) in bd.number_verses_in_book.items()]))
+
+    def test_concurrent(self):
+        c = C(P('Gen', 1), P('Jn', 3, 16), P('Rom', 8), P('Ps', 23), P('Eph', 1))
+        with StubESVServer(delay=0.2) as server:
+            start = time.time()
+            results = c.texts(workers=5, batch=False, api_url=server.url,
+                              cache=self.cache)
+            elapsed = time.time() - start
+        self.assertEqual([r.text for r in results],
+                         ["Text of " + str(p) for p in c])
+        self.assertEqual([r.passage for r in results], list(c))
+        self.assertEqual(server.max_active, 5)
+        self.assertTrue(elapsed < 0.8)
+        self.assertTrue(server.requests[0][0].startswith("/text/?"))
+        # Results now come from the cache
+        with StubESVServer() as server:
+            self.assertEqual(c.text(api_url=server.url, cache=self.cache),
+                             ("\n\n".join(["Text of " + str(p) for p in c]),
+                              False))
+            self.assertEqual(server.requests, [])
+
+    def test_errors_and_truncation(self):
+        c = C(P('Gen', 1), P('Jude', 3), P('Ps', 1, 1, 119, 176))
+        with StubESVServer(delay=0.05, fail=["Jude 3"]) as server:
+            results = c.texts(workers=2, api_url=server.url, cache=self.cache,
+                              api_key="abc")
+            self.assertEqual(server.max_active, 2)
+            (text, truncated) = c.text(workers=1, api_url=server.url,
+                                       cache=self.cache, raise_errors=False)
+            self.assertRaises(HTTPStatusError, c.text, api_url=server.url,
+                              cache=self.cache)
+        self.assertEqual([r.truncated for r in results], [False, None, True])
+        self.assertEqual(results[1].text, None)
+        self.assertEqual(results[1].error.status, 500)
+        self.assertEqual(results[2].text, "Text of Psalms 1:1-36:1")
+        self.assertEqual(server.requests[0][2]["Authorization"], "Token abc")
+        self.assertEqual(text, "Text of Genesis 1\n\n" + bd.FETCH_ERROR_TEXT +
+                         "\n\nText of Psalms 1:1-36:1")
+        self.assertTrue(truncated)
+        self.assertEqual(C().text(), ("", False))
+
+    def test_batching(self):
+        c = C(P('Gen', 1), P('Jn', 3, 16), P('Jn', 3, 17), P('Rom', 8),
+              P('Gen', 1), P('Ps', 1, 1, 119, 176), P('Jn', 3, 16))
+        self.assertEqual(bd.batch_passages(c, cache=self.cache),
+                         [[0, 1], [2, 3, 4], [5], [6]])
+        with StubESVServer() as server:
+            results = c.texts(workers=1, api_url=server.url, cache=self.cache)
+            self.assertEqual(sorted([r[1]["q"][0] for r in server.requests]),
+                             ["Genesis 1;John 3:16", "John 3:17;Romans 8",
+                              "Psalms 1:1-36:1"])
+            self.assertEqual([r.text for r in results],
+                             ["Text of " + str(p) for p in c[:5]] +
+                             ["Text of Psalms 1:1-36:1", "Text of John 3:16"])
+            self.assertEqual([r.truncated for r in results],
+                             [False] * 5 + [True, False])
+            # Each passage was cached individually
+            self.assertEqual(P('Rom', 8).text(api_url=server.url,
+                                              cache=self.cache),
+                             ("Text of Romans 8", False))
+            self.assertEqual(len(server.requests), 3)
+        self.assertEqual([len(b) for b in bd.batch_passages(
+            [P('Ps', 119, v) for v in range(1, 121, 2)])], [50, 10])
+
+    def test_split(self):
+        p = P('Ps', 1, 1, 119, 176)
+        parts = ["Psalms 1-35", "Psalms 36-68", "Psalms 69:1-78:57"]
+        with StubESVServer(delay=0.2) as server:
+            start = time.time()
+            self.assertEqual(
+                p.text(api_url=server.url, cache=self.cache, split=True),
+                ("\n\n".join(["Text of " + x for x in parts]), True))
+            self.assertTrue(time.time() - start < 0.5)
+            self.assertEqual(sorted([r[1]["q"][0] for r in server.requests]),
+                             parts)
+            self.assertEqual(server.max_active, 3)
+            # Within a collection, long passages get requests of their own
+            c = C(P('Gen', 1), p, P('Gen', 2), P('Isa', 1, 1, 1, 3))
+            self.assertEqual(bd.batch_passages(c, cache=self.cache, split=True),
+                             [[0], [1], [2, 3]])
+            results = c.texts(workers=1, api_url=server.url, cache=self.cache,
+                              split=True)
+            self.assertEqual(results[1].text,
+                             "\n\n".join(["Text of " + x for x in parts]))
+            self.assertEqual([r[1]["q"][0] for r in server.requests
+                              if not r[1]["q"][0].startswith("Psalms")],
+                             ["Genesis 1", "Genesis 2;Isaiah 1:1-3"])
+            # Short passages are unaffected
+            self.assertEqual(P('Isa', 1, 1, 20, 6).text(
+                api_url=server.url, cache=self.cache, split=True),
+                ("Text of Isaiah 1-20", False))
+        with StubESVServer(fail=["Psalms 36-68"]) as server:
+            self.assertEqual(p.text(api_url=server.url, split=True,
+                                    raise_errors=False),
+                             (bd.FETCH_ERROR_TEXT, True))
+            self.assertRaises(HTTPStatusError, p.text, api_url=server.url,
+                              split=True)
+
+
+class TestTransport(unittest.TestCase):
+    def test_keep_alive(self):
+        transport = HTTPTransport()
+        with StubESVServer() as server:
+            for ref in ("Gen 1", "Gen 2", "Gen 3"):
+                response = transport.get(server.url + "text/?q=" + ref.replace(" ", "+"),
+                                         {"Authorization": "Token abc"})
+            self.assertEqual(json.loads(response.body.decode("utf-8")),
+                             {"passages": ["Text of Gen 3"]})
+            self.assertEqual(response.status, 200)
+            self.assertEqual(len(server.requests), 3)
+            self.assertEqual(len(server.connections), 1)
+            self.assertEqual(server.requests[0][2]["Authorization"],
+                             "Token abc")
+            # Connections closed by the server are replaced
+            transport.close()
+            p = P('Jn', 3, 16)
+            self.assertEqual(p.text(api_url=server.url, transport=transport,
+                                    cache={}),
+                             ("Text of John 3:16", False))
+            self.assertEqual(len(server.connections), 2)
+
+    def test_gzip_and_errors(self):
+        with StubESVServer(gzip=True, fail=["Jude 3"]) as server:
+            self.assertEqual(HTTPTransport().get(server.url + "?q=Jude+1").body,
+                             b'{"passages": ["Text of Jude 1"]}')
+            self.assertEqual(server.requests[0][2]["Accept-Encoding"], "gzip")
+            self.assertEqual(HTTPTransport(gzip=False).get(
+                server.url + "?q=Jude+2").body,
+                b'{"passages": ["Text of Jude 2"]}')
+            try:
+                HTTPTransport().get(server.url + "?q=Jude+3")
+                self.fail("HTTPStatusError not raised")
+            except HTTPStatusError as e:
+                self.assertEqual(e.status, 500)
+        with StubESVServer(delay=0.5) as server:
+            start = time.time()
+            self.assertRaises(IOError, HTTPTransport(timeout=0.1).get,
+                              server.url + "?q=Jude+4")
+            self.assertTrue(time.time() - start < 0.4)
+        self.assertRaises(IOError, HTTPTransport().get, "ftp://localhost/")
+
+    def test_stub(self):
+        stub = StubTransport()
+        self.assertEqual(P('Jn', 3, 16).text(api_key="abc", transport=stub,
+                                             cache={}),
+                         ("Text of John 3:16", False))
+        self.assertEqual(stub.requests[0][1]["Authorization"], "Token abc")
+        self.assertTrue(stub.requests[0][0].startswith(bd.API_URL + "text/?"))
+        stub = StubTransport(lambda url, headers: (404, b""))
+        self.assertEqual(P('Jn', 3, 16).text(transport=stub, cache={},
+                                             negative_cache=None,
+                                             raise_errors=False),
+                         (bd.FETCH_ERROR_TEXT, False))
+        self.assertRaises(HTTPStatusError, P('Jn', 3, 16).text,
+                          transport=stub, cache={}, negative_cache=None)
+        # Swapping the default transport
+        (default, bd.default_transport) = (bd.default_transport, stub)
+        try:
+            c = C(P('Jn', 3, 16), P('Rom', 8))
+            results = c.texts(cache={}, negative_cache=None)
+        finally:
+            bd.default_transport = default
+        self.assertTrue(isinstance(results[0].error, HTTPStatusError))
+        self.assertEqual(len(stub.requests), 5)
+
+
+class TestResilience(unittest.TestCase):
+    def test_retry(self):
+        transport = RetryTransport(HTTPTransport(), backoff=0.01)
+        with StubESVServer(faults=[503, "drop"]) as server:
+            self.assertEqual(transport.get(server.url + "?q=Gen+1").body,
+                             b'{"passages": ["Text of Gen 1"]}')
+            self.assertEqual(len(server.requests), 3)
+        with StubESVServer(faults=[502, 504, 429, 503]) as server:
+            try:
+                transport.get(server.url + "?q=Gen+1")
+                self.fail("HTTPStatusError not raised")
+            except HTTPStatusError as e:
+                self.assertEqual(e.status, 429)
+            self.assertEqual(len(server.requests), 3)
+        # Other errors aren't retried
+        with StubESVServer(faults=[404, "invalid"]) as server:
+            self.assertRaises(HTTPStatusError, transport.get,
+                              server.url + "?q=Gen+1")
+            self.assertRaises(InvalidResponseError, P('Gen', 1).text,
+                              api_url=server.url, transport=transport,
+                              cache={}, negative_cache=None)
+            self.assertEqual(len(server.requests), 2)
+        with StubESVServer(delay=0.3) as server:
+            self.assertRaises(FetchTimeoutError, RetryTransport(
+                HTTPTransport(timeout=0.05), attempts=2, backoff=0).get,
+                server.url + "?q=Gen+1")
+        # Delays
+        transport = RetryTransport(None, backoff=1, max_backoff=3)
+        for attempt in (1, 2, 3, 4):
+            delay = transport.delay(attempt)
+            self.assertTrue(0 <= delay <= min(2 ** (attempt - 1), 3))
+        self.assertEqual(transport.delay(1, HTTPStatusError(
+            429, "", headers={"Retry-After": "2"})), 2)
+        self.assertEqual(transport.delay(1, HTTPStatusError(
+            503, "", headers={"retry-after": "10"})), 3)
+        with StubESVServer(faults=[(503, "0")]) as server:
+            self.assertEqual(RetryTransport(HTTPTransport()).get(
+                server.url + "?q=Gen+1").status, 200)
+
+    def test_circuit_breaker(self):
+        # Without keeping connections, so that dropped connections aren't
+        # retried as stale
+        transport = CircuitBreakerTransport(HTTPTransport(max_idle=0),
+                                            threshold=2, reset_timeout=0.2)
+        with StubESVServer(faults=[404, 500, "drop", 500, 503]) as server:
+            url = server.url + "?q=Gen+1"
+            key = ("http", "127.0.0.1", server.server_address[1])
+            self.assertRaises(HTTPStatusError, transport.get, url)
+            self.assertRaises(HTTPStatusError, transport.get, url)
+            self.assertFalse(transport.is_open(key))
+            self.assertRaises(NetworkError, transport.get, url)
+            self.assertTrue(transport.is_open(key))
+            # Failing fast, without requests
+            self.assertRaises(CircuitOpenError, transport.get, url)
+            self.assertEqual(len(server.requests), 3)
+            # A failed trial request opens the circuit again
+            time.sleep(0.25)
+            self.assertRaises(HTTPStatusError, transport.get, url)
+            self.assertRaises(CircuitOpenError, transport.get, url)
+            # A successful trial request closes it
+            time.sleep(0.25)
+            self.assertRaises(HTTPStatusError, transport.get, url)
+            time.sleep(0.25)
+            self.assertEqual(transport.get(url).status, 200)
+            self.assertFalse(transport.is_open(key))
+            self.assertEqual(transport.get(url).status, 200)
+            self.assertEqual(len(server.requests), 7)
+
+    def test_circuit_breaker_unexpected(self):
+        # Unexpected exceptions count as failures, and don't leave a trial
+        # request holding the circuit half-open
+        responses = [ValueError, ValueError, (200, b'{"passages": []}')]
+
+        def respond(url, headers):
+            response = responses.pop(0)
+            if response is ValueError:
+                raise ValueError("Bug")
+            return response
+
+        transport = CircuitBreakerTransport(StubTransport(respond),
+                                            threshold=1, reset_timeout=0.1)
+        self.assertRaises(ValueError, transport.get, "http://x/")
+        self.assertTrue(transport.is_open(("http", "x", None)))
+        time.sleep(0.15)
+        self.assertRaises(ValueError, transport.get, "http://x/")
+        self.assertRaises(CircuitOpenError, transport.get, "http://x/")
+        time.sleep(0.15)
+        self.assertEqual(transport.get("http://x/").status, 200)
+        # Nor does an interrupted trial request
+        transport = CircuitBreakerTransport(StubTransport(), threshold=1,
+                                            reset_timeout=0)
+        transport.failure(("http", "x", None))
+
+        def interrupt(url, headers):
+            raise KeyboardInterrupt
+
+        transport.transport.respond = interrupt
+        self.assertRaises(KeyboardInterrupt, transport.get, "http://x/")
+        transport.transport.respond = lambda url, headers: (200, b"")
+        self.assertEqual(transport.get("http://x/").status, 200)
+
+    def test_negative_cache(self):
+        negative_cache = text_cache.NegativeCache(ttl=0.2)
+        kwargs = dict(cache={}, negative_cache=negative_cache,
+                      transport=HTTPTransport())
+        with StubESVServer(faults=[503]) as server:
+            kwargs["api_url"] = server.url
+            self.assertRaises(HTTPStatusError, P('Gen', 1).text, **kwargs)
+            self.assertRaises(HTTPStatusError, P('Gen', 1).text, **kwargs)
+            self.assertEqual(P('Gen', 1).text(raise_errors=False, **kwargs),
+                             (bd.FETCH_ERROR_TEXT, False))
+            self.assertEqual(len(server.requests), 1)
+            # Other requests are unaffected
+            self.assertEqual(P('Gen', 2).text(**kwargs),
+                             ("Text of Genesis 2", False))
+            time.sleep(0.25)
+            self.assertEqual(P('Gen', 1).text(**kwargs),
+                             ("Text of Genesis 1", False))
+            self.assertEqual(len(server.requests), 3)
+        # Failures with one API key don't affect requests with another
+        stub = StubTransport(lambda url, headers: (
+            (200, b'{"passages": ["Text"]}')
+            if headers["Authorization"] == "Token good" else (401, b"")))
+        kwargs = dict(cache={}, negative_cache=negative_cache, transport=stub)
+        self.assertRaises(HTTPStatusError, P('Gen', 4).text, api_key="bad",
+                          **kwargs)
+        self.assertEqual(P('Gen', 4).text(api_key="good", **kwargs),
+                         ("Text", False))
+        self.assertRaises(HTTPStatusError, P('Gen', 5).text, api_key="bad",
+                          **kwargs)
+        self.assertRaises(HTTPStatusError, P('Gen', 5).text, api_key="bad",
+                          **kwargs)
+        self.assertEqual(len(stub.requests), 3)
+        # Each failure from the cache is a new error, with its own traceback
+        errors = []
+        for _ in range(3):
+            try:
+                P('Gen', 5).text(api_key="bad", **kwargs)
+            except HTTPStatusError as e:
+                errors.append(e)
+        self.assertEqual(len(stub.requests), 3)
+        self.assertTrue(errors[0] is not errors[1])
+        self.assertEqual([(e.status, str(e)) for e in errors],
+                         [(401, str(errors[0]))] * 3)
+        if hasattr(errors[0], "__traceback__"):
+            depths = [len(traceback.extract_tb(e.__traceback__))
+                      for e in errors]
+            self.assertEqual(depths, [depths[0]] * 3)
+        negative_cache = text_cache.NegativeCache(max_entries=2)
+        for key in "abc":
+            negative_cache[key] = IOError(key)
+        self.assertEqual(list(negative_cache.errors), ["c"])
+
+    def test_default_transport(self):
+        self.assertTrue(isinstance(bd.default_transport,
+                                   CircuitBreakerTransport))
+        self.assertTrue(isinstance(bd.default_transport.transport,
+                                   RetryTransport))
+        with StubESVServer(faults=[503]) as server:
+            self.assertEqual(P('Gen', 3).text(api_url=server.url, cache={}),
+                             ("Text of Genesis 3", False))
+            self.assertEqual(len(server.requests), 2)
+        self.assertTrue(issubclass(InvalidResponseError, ValueError))
+        self.assertTrue(issubclass(CircuitOpenError, IOError))
+
+
+class TestDeadlines(unittest.TestCase):
+    def test_deadline(self):
+        kwargs = dict(cache={}, negative_cache=text_cache.NegativeCache(),
+                      transport=HTTPTransport())
+        with StubESVServer(delay=0.3) as server:
+            kwargs["api_url"] = server.url
+            start = time.time()
+            self.assertRaises(FetchTimeoutError, P('Gen', 1).text,
+                              timeout=0.05, **kwargs)
+            self.assertRaises(FetchTimeoutError, P('Gen', 1).text,
+                              deadline=time.time() - 1, **kwargs)
+            self.assertTrue(time.time() - start < 0.2)
+            # Missed deadlines aren't recorded as failures
+            self.assertEqual(P('Gen', 1).text(**kwargs),
+                             ("Text of Genesis 1", False))
+            self.assertEqual(P('Gen', 2).text(timeout=1, **kwargs),
+                             ("Text of Genesis 2", False))
+            # One deadline is shared by a whole collection
+            start = time.time()
+            results = C(P('Gen', 3), P('Gen', 4), P('Gen', 1)).texts(
+                workers=1, batch=False, timeout=0.4, **kwargs)
+            self.assertTrue(time.time() - start < 0.6)
+            self.assertEqual([r.text for r in results],
+                             ["Text of Genesis 3", None, "Text of Genesis 1"])
+            self.assertTrue(isinstance(results[1].error, FetchTimeoutError))
+        # Retries aren't made past the deadline
+        stub = StubTransport(lambda url, headers: (503, b""))
+        start = time.time()
+        self.assertRaises(HTTPStatusError, RetryTransport(stub, backoff=10).get,
+                          "http://x/", deadline=time.time() + 0.5)
+        self.assertEqual(len(stub.requests), 1)
+        self.assertTrue(time.time() - start < 0.2)
+        # Nor do they count against a circuit breaker
+        breaker = CircuitBreakerTransport(StubTransport(delay=0.2),
+                                          threshold=1)
+        self.assertRaises(FetchTimeoutError, breaker.get, "http://x/?q=Gen+1",
+                          deadline=time.time() + 0.05)
+        self.assertFalse(breaker.is_open(("http", "x", None)))
+
+    def test_stale(self):
+        cache = text_cache.SimpleCache(max_age=0.1)
+        with StubESVServer(delay=0.2) as server:
+            kwargs = dict(api_url=server.url, cache=cache,
+                          transport=HTTPTransport(), negative_cache=None)
+            P('Gen', 1).text(**kwargs)
+            self.assertEqual(P('Gen', 1).text(timeout=0.1, **kwargs),
+                             ("Text of Genesis 1", False))
+            self.assertEqual(len(server.requests), 1)
+            time.sleep(0.1)
+            self.assertTrue(cache.get(list(cache.cache)[0]) is None)
+            # Expired text is used if the API is too slow...
+            start = time.time()
+            self.assertEqual(P('Gen', 1).text(timeout=0.05, **kwargs),
+                             ("Text of Genesis 1", False))
+            self.assertTrue(time.time() - start < 0.15)
+            self.assertEqual(C(P('Gen', 1)).texts(timeout=0.05, **kwargs)[0],
+                             (P('Gen', 1), "Text of Genesis 1", False, None))
+            # ...and replaced once it's fetched again
+            P('Gen', 1).text(**kwargs)
+            self.assertEqual(len(cache.lengths[1]), 1)
+            self.assertTrue(cache.get(list(cache.cache)[0]) is not None)
+            self.assertRaises(FetchTimeoutError, P('Gen', 2).text,
+                              timeout=0.05, **kwargs)
+
+    def test_hedging(self):
+        delays = []
+
+        def respond(url, headers):
+            time.sleep(delays.pop(0) if delays else 0.01)
+            return (200, b'{"passages": ["Text"]}')
+
+        transport = HedgingTransport(StubTransport(respond), min_samples=5)
+        self.assertEqual(transport.hedge_delay(), None)
+        for _ in range(5):
+            transport.get("http://x/")
+        self.assertEqual(transport.hedged, 0)
+        self.assertTrue(0.01 <= transport.hedge_delay() < 0.5)
+        # A slow request is overtaken by a second one
+        delays.append(0.5)
+        start = time.time()
+        self.assertEqual(transport.get("http://x/").body,
+                         b'{"passages": ["Text"]}')
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual((transport.requests, transport.hedged), (7, 1))
+        # Errors are raised once every request has failed
+        transport = HedgingTransport(StubTransport(
+            lambda url, headers: (404, b""), delay=0.05), initial_delay=0.01)
+        self.assertRaises(HTTPStatusError, transport.get, "http://x/")
+        self.assertEqual(transport.hedged, 1)
+        with StubESVServer(delay=0.1) as server:
+            self.assertEqual(P('Gen', 1).text(
+                api_url=server.url, cache={}, timeout=1,
+                transport=HedgingTransport(HTTPTransport(),
+                                           initial_delay=0.05)),
+                ("Text of Genesis 1", False))
+            self.assertEqual(server.max_active, 2)
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_limits(self):
+        limiter = RateLimiter(((2, 0.2), (3, 10)))
+        start = time.time()
+        limiter.acquire("http://x/?q=Gen+1")
+        limiter.acquire("http://x/?q=Gen+2")
+        self.assertTrue(time.time() - start < 0.05)
+        limiter.acquire("http://x/?q=Gen+3")
+        self.assertTrue(0.08 < time.time() - start < 0.2)
+        # Quotas are kept for each server
+        limiter.acquire("http://y/?q=Gen+1")
+        # A request that would wait beyond its deadline fails straight away
+        start = time.time()
+        self.assertRaises(FetchTimeoutError, limiter.acquire, "http://x/",
+                          deadline=time.time() + 1)
+        self.assertTrue(time.time() - start < 0.05)
+        stats = limiter.stats()
+        self.assertEqual((stats["depth"], stats["max_depth"],
+                          stats["granted"]), (0, 1, 4))
+        self.assertTrue(0.08 < stats["max_wait"] < 0.2)
+        # No limits
+        limiter = RateLimiter()
+        for _ in range(100):
+            limiter.acquire("http://x/")
+        self.assertEqual(limiter.stats()["max_wait"] < 0.05, True)
+
+    def test_priority(self):
+        limiter = RateLimiter(((1, 0.1),))
+        limiter.acquire("http://x/")
+        order = []
+
+        def request(name, priority):
+            limiter.acquire("http://x/", priority)
+            order.append(name)
+
+        threads = [threading.Thread(target=request, args=a) for a in
+                   [("prefetch 1", BACKGROUND), ("prefetch 2", BACKGROUND),
+                    ("interactive", INTERACTIVE)]]
+        for t in threads:
+            t.start()
+            time.sleep(0.01)
+        self.assertEqual(limiter.depth(), 3)
+        self.assertEqual(limiter.depth(BACKGROUND), 2)
+        for t in threads:
+            t.join()
+        self.assertEqual(order, ["interactive", "prefetch 1", "prefetch 2"])
+        self.assertEqual(limiter.stats()["max_depth"], 3)
+
+    def test_text(self):
+        limiter = RateLimiter(((2, 0.2),))
+        kwargs = dict(cache={}, negative_cache=None,
+                      transport=RateLimitedTransport(StubTransport(), limiter))
+        start = time.time()
+        C(P('Gen', 1), P('Gen', 2), P('Gen', 3)).texts(batch=False, **kwargs)
+        self.assertTrue(0.08 < time.time() - start < 0.2)
+        self.assertEqual(limiter.stats()["granted"], 3)
+        self.assertRaises(FetchTimeoutError, P('Gen', 4).text, timeout=0.01,
+                          **kwargs)
+        self.assertEqual(P('Gen', 5).text(priority=BACKGROUND, **kwargs),
+                         ("Text of Genesis 5", False))
+        self.assertTrue(isinstance(bd.default_transport.transport.transport,
+                                   RateLimitedTransport))
+        self.assertEqual(bd.default_rate_limiter.limits, bd.API_RATE_LIMITS)
+
+    def test_retries(self):
+        # Every attempt takes a token, including retries and hedges
+        limiter = RateLimiter(((100, 1),))
+        stub = StubTransport(lambda url, headers: (503, b""))
+        transport = RetryTransport(RateLimitedTransport(stub, limiter),
+                                   backoff=0.01)
+        self.assertRaises(HTTPStatusError, transport.get, "http://x/")
+        self.assertEqual((len(stub.requests), limiter.granted), (3, 3))
+        stub = StubTransport(delay=0.1)
+        transport = HedgingTransport(RateLimitedTransport(stub, limiter),
+                                     initial_delay=0.01)
+        transport.get("http://x/?q=Gen+1")
+        time.sleep(0.15)
+        self.assertEqual((len(stub.requests), limiter.granted), (2, 5))
+        # Too Many Requests empties the buckets and honours Retry-After
+        limiter = RateLimiter(((100, 1),))
+        responses = [(429, b"", {"Retry-After": "1"})]
+
+        def respond(url, headers):
+            return responses.pop(0) if responses else \
+                (200, b'{"passages": ["Text"]}')
+
+        transport = RetryTransport(RateLimitedTransport(
+            StubTransport(respond), limiter), backoff=0)
+        start = time.time()
+        self.assertEqual(transport.get("http://x/").status, 200)
+        self.assertTrue(0.9 < time.time() - start < 1.2)
+        self.assertEqual(limiter.granted, 2)
+        limiter.pause("http://y/")
+        start = time.time()
+        limiter.acquire("http://y/")
+        self.assertTrue(0.005 < time.time() - start < 0.05)
+
+    def test_accounts(self):
+        # Quotas are kept for each API key, from the Authorization header
+        limiter = RateLimiter(((1, 10),))
+        stub = StubTransport()
+        transport = RateLimitedTransport(stub, limiter)
+        start = time.time()
+        url = "http://x/?q=Gen+1"
+        transport.get(url, {"Authorization": "Token a"})
+        transport.get(url, {"Authorization": "Token b"})
+        self.assertTrue(time.time() - start < 0.05)
+        self.assertRaises(FetchTimeoutError, transport.get, url,
+                          {"Authorization": "Token a"}, time.time() + 1)
+        self.assertEqual(len(stub.requests), 2)
+        self.assertTrue("Token a" not in repr(list(limiter.buckets)))
+        # A 429 pauses only the key it was given for
+        limiter = RateLimiter(((100, 1),))
+        transport = RateLimitedTransport(StubTransport(
+            lambda url, headers: (429, b"", {"Retry-After": "10"})), limiter)
+        self.assertRaises(HTTPStatusError, transport.get, "http://x/",
+                          {"Authorization": "Token a"})
+        self.assertRaises(FetchTimeoutError, limiter.acquire, "http://x/",
+                          deadline=time.time() + 1, account="Token a")
+        limiter.acquire("http://x/", deadline=time.time() + 1,
+                        account="Token b")
+
+    def test_max_wait(self):
+        limiter = RateLimiter(((1, 10),), max_wait=1)
+        limiter.acquire("http://x/")
+        start = time.time()
+        self.assertRaises(FetchTimeoutError, limiter.acquire, "http://x/")
+        self.assertTrue(time.time() - start < 0.05)
+        self.assertEqual(limiter.depth(), 0)
+        # An earlier deadline still applies
+        limiter = RateLimiter(((1, 0.2),), max_wait=10)
+        limiter.acquire("http://x/")
+        self.assertRaises(FetchTimeoutError, limiter.acquire, "http://x/",
+                          deadline=time.time() + 0.1)
+        limiter.acquire("http://x/")
+        self.assertEqual(bd.default_rate_limiter.max_wait,
+                         bd.RATE_LIMIT_MAX_WAIT)
+
+class TestIterText(unittest.TestCase):
+    def setUp(self):
+        self.cache = text_cache.SimpleCache(500, dict(
+            [(k, v * 0.5) for (k, v) in bd.number_verses_in_book.items()]))
+
+    def test_passage(self):
+        p = P('Rom', 1, 18, 3, 20)
+        with StubESVServer() as server:
+            pieces = p.iter_text(api_url=server.url, cache=self.cache)
+            self.assertFalse(pieces.truncated)
+            self.assertEqual(list(pieces), ["Text of Romans 1:18-32", "\n\n",
+                                            "Text of Romans 2", "\n\n",
+                                            "Text of Romans 3:1-20"])
+            self.assertEqual("".join(p.iter_text(20, workers=1,
+                                                 api_url=server.url,
+                                                 cache=self.cache)),
+                             "\n\n".join(["Text of Romans 1:18-2:5",
+                                           "Text of Romans 2:6-25",
+                                           "Text of Romans 2:26-3:16",
+                                           "Text of Romans 3:17-20"]))
+            self.assertEqual(len(server.requests), 7)
+            # Cached pieces, and cached whole passages, need no requests
+            p.text(api_url=server.url, cache=self.cache)
+            self.assertEqual(list(p.iter_text(api_url=server.url,
+                                              cache=self.cache)),
+                             ["Text of Romans 1:18-3:20"])
+            self.assertEqual(list(P('Rom', 2, 6, 3, 16).iter_text(
+                20, api_url=server.url, cache=self.cache)),
+                ["Text of Romans 2:6-25", "\n\n", "Text of Romans 2:26-3:16"])
+            self.assertEqual(len(server.requests), 8)
+            # Truncated as for text
+            pieces = P('Ps').iter_text(api_url=server.url, cache=self.cache)
+            self.assertTrue(pieces.truncated)
+            self.assertEqual(len(list(pieces)), 36 * 2 - 1)
+
+    def test_streaming(self):
+        c = C(P('Jn', 1, 1, 2, 25), P('Rom', 8, 28))
+        with StubESVServer(delay=0.2) as server:
+            start = time.time()
+            pieces = c.iter_text(api_url=server.url, cache=self.cache)
+            self.assertEqual(next(pieces), "Text of John 1")
+            # The first piece is sent without waiting for the others
+            self.assertTrue(time.time() - start < 0.35)
+            self.assertEqual(list(pieces), ["\n\n", "Text of John 2", "\n\n",
+                                            "Text of Romans 8:28"])
+            self.assertFalse(pieces.truncated)
+            self.assertEqual(server.max_active, 3)
+            pieces = C(P('Gen', 1, 2, 5)).iter_text(api_url=server.url)
+            next(pieces)
+            pieces.close()
+
+
 class TestPassageLookup(unittest.TestCase):
     def test_esv(self):
         self.assertEqual(P('Gen', 1, 1).text(api_key=ESV_API_KEY)[0],
@@ -716,5 +2276,12 @@ class TestParsing(unittest.TestCase):
 #        self.assertEqual(passages_from_string("Gen 1, v1-3"), C(P('Gen',1,1,1,3)) )
 
 
+# asyncio tests are kept apart, as Python 2 can't parse them
+try:
+    from unittests_aio import *
+except SyntaxError:
+    pass
+
+
 if __name__ == '__main__':  # If run as a command line script
     unittest.main()
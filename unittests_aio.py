@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the asyncio functions; imported by unittests.py where they can be
+parsed (Python 3).
+"""
+from unittests import P, C, bd, text_cache, StubESVServer
+from pypassage.bibledata.transport import FetchTimeoutError, StubTransport
+from pypassage.bibledata.transport import HTTPStatusError
+from pypassage.bibledata.rate_limit import RateLimiter, RateLimitedTransport
+from pypassage.bibledata.rate_limit import INTERACTIVE, BACKGROUND
+import unittest
+import time
+
+try:
+    import asyncio
+    asyncio.run
+except (ImportError, AttributeError):
+    asyncio = None
+
+__all__ = ["TestAsyncText", "TestAsyncRateLimit"]
+
+
+@unittest.skipIf(asyncio is None, "Python 3.7 or later required")
+class TestAsyncText(unittest.TestCase):
+    def setUp(self):
+        self.cache = text_cache.SimpleCache(500, dict(
+            [(k, v * 0.5) for (k, v) in bd.number_verses_in_book.items()]))
+
+    def test_single_flight(self):
+        ticks = []
+
+        async def ticker():
+            for _ in range(10):
+                ticks.append(None)
+                await asyncio.sleep(0.02)
+
+        async def main(url):
+            p = P('Jn', 3)
+            awaits = [p.atext(api_url=url, cache=self.cache)
+                      for _ in range(50)]
+            results = await asyncio.gather(ticker(), *awaits)
+            return results[1:]
+
+        with StubESVServer(delay=0.2) as server:
+            results = asyncio.run(main(server.url))
+            self.assertEqual(len(server.requests), 1)
+            # Event loop kept running during the request
+            self.assertEqual(len(ticks), 10)
+            self.assertEqual(results, [("Text of John 3", False)] * 50)
+            # Later requests come from the cache
+            self.assertEqual(asyncio.run(P('Jn', 3).atext(
+                api_url=server.url, cache=self.cache)),
+                ("Text of John 3", False))
+            self.assertEqual(len(server.requests), 1)
+
+    def test_single_flight_keys(self):
+        # Requests with different API keys or transports aren't shared
+        stub = StubTransport(lambda url, headers: (
+            (200, b'{"passages": ["Text"]}')
+            if headers["Authorization"] == "Token good" else (401, b"")),
+            delay=0.1)
+        other = StubTransport(delay=0.1)
+
+        async def main():
+            p = P('Jn', 4)
+            return await asyncio.gather(
+                p.atext(api_key="bad", cache={}, transport=stub),
+                p.atext(api_key="good", cache={}, transport=stub),
+                p.atext(api_key="good", cache={}, transport=stub),
+                p.atext(api_key="good", cache={}, transport=other),
+                return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertTrue(isinstance(results[0], HTTPStatusError))
+        self.assertEqual(results[1:3], [("Text", False)] * 2)
+        self.assertEqual(results[3][1], False)
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(len(other.requests), 1)
+
+    def test_collection(self):
+        c = C(P('Gen', 1), P('Jude', 3), P('Gen', 1), P('Ps', 1, 1, 119, 176))
+        with StubESVServer(delay=0.1, fail=["Jude 3"]) as server:
+            results = asyncio.run(c.atexts(api_url=server.url,
+                                           cache=self.cache))
+            self.assertEqual(len(server.requests), 3)
+            (text, truncated) = asyncio.run(c.atext(api_url=server.url,
+                                                    cache=self.cache,
+                                                    raise_errors=False))
+        self.assertEqual([r.text for r in results],
+                         ["Text of Genesis 1", None, "Text of Genesis 1",
+                          "Text of Psalms 1:1-36:1"])
+        self.assertTrue(isinstance(results[1].error, IOError))
+        self.assertEqual(text, "Text of Genesis 1\n\n" + bd.FETCH_ERROR_TEXT +
+                         "\n\nText of Genesis 1\n\nText of Psalms 1:1-36:1")
+        self.assertTrue(truncated)
+
+    def test_deadline(self):
+        with StubESVServer(delay=0.3) as server:
+            start = time.time()
+            self.assertRaises(FetchTimeoutError, asyncio.run, P('Jn', 5).atext(
+                api_url=server.url, cache=self.cache, timeout=0.05))
+            self.assertTrue(time.time() - start < 0.2)
+            results = asyncio.run(C(P('Jn', 5), P('Jn', 6)).atexts(
+                api_url=server.url, cache=self.cache, timeout=0.05))
+            self.assertTrue(all([isinstance(r.error, FetchTimeoutError)
+                                 for r in results]))
+
+
+@unittest.skipIf(asyncio is None, "Python 3.7 or later required")
+class TestAsyncRateLimit(unittest.TestCase):
+    def test_async(self):
+        from pypassage import aio
+        limiter = RateLimiter(((1, 0.1),))
+        order = []
+        # Quotas of the API key used by the text lookup below
+        account = "Token XXXX"
+
+        async def request(name, priority):
+            await aio.acquire(limiter, bd.API_URL, priority, account=account)
+            order.append(name)
+
+        async def main():
+            await aio.acquire(limiter, bd.API_URL, account=account)
+            await asyncio.gather(request("prefetch", BACKGROUND),
+                                 request("interactive", INTERACTIVE))
+            # Threads and coroutines share the limiter
+            await asyncio.gather(request("coroutine", BACKGROUND),
+                                 asyncio.get_running_loop().run_in_executor(
+                                     None, limiter.acquire, bd.API_URL,
+                                     INTERACTIVE, None, account))
+            return await P('Jn', 3).atext(
+                api_key="XXXX", cache={}, transport=RateLimitedTransport(StubTransport(),
+                                                         limiter),
+                timeout=0.01)
+
+        start = time.time()
+        self.assertRaises(FetchTimeoutError, asyncio.run, main())
+        self.assertTrue(0.35 < time.time() - start < 0.5)
+        self.assertEqual(order, ["interactive", "prefetch", "coroutine"])
+        self.assertEqual(limiter.stats()["granted"], 5)